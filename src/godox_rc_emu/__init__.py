@@ -1,13 +1,48 @@
-# Signal -> Message
-from .ookfloat_to_timings import ookfloat_to_timings
-from .timings_to_bitfield import timings_to_bitfield
-from .bitfield_to_message import bitfield_to_message
-
-# Message -> Message
-from .message_sanitizer import message_sanitizer
-from .message_muxer import message_muxer
-
-# Message -> Signal
-from .message_to_bitfield import message_to_bitfield
-from .bitfield_to_timings import bitfield_to_timings
-from .timings_to_ookfloat import timings_to_ookfloat
+# Blocks are imported on first use (PEP 562), so that importing the package, or its GNU Radio-free core
+# (godox_rc_emu.core), does not load gnuradio or pmt.
+
+import importlib
+import sys
+
+# block name -> the module defining it, which has the same name
+BLOCKS = [
+    # Signal -> Message
+    'ookfloat_to_timings',
+    'ookmag_to_timings',
+    'timings_to_bitfield',
+    'bitfield_to_message',
+
+    # Control input
+    'control_source',
+
+    # Message -> Message
+    'message_sanitizer',
+    'state_cache',
+    'message_muxer',
+
+    # Message -> Signal
+    'message_to_bitfield',
+    'bitfield_to_timings',
+    'timings_to_ookfloat',
+
+    # Message -> Signal, in a single block
+    'message_to_ookfloat',
+
+    # Monitoring
+    'metrics_exporter',
+]
+
+def __getattr__(name):
+    if name not in BLOCKS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    importlib.import_module(f'.{name}', __name__)
+    # importing a block module (and any it imports in turn) binds the module itself to its name in this package;
+    # replace each with the block class, as the eager imports used to
+    for block_name in BLOCKS:
+        module = sys.modules.get(f'{__name__}.{block_name}')
+        if module is not None:
+            globals()[block_name] = getattr(module, block_name)
+    return globals()[name]
+
+def __dir__():
+    return sorted(set(globals()) | set(BLOCKS))
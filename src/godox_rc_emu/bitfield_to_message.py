@@ -1,11 +1,27 @@
+import collections
+
 import numpy as np
 from gnuradio import gr
 import pmt
 
+from .core.checksum import checksum, checksum_array
+from .core.frame import FRAME_DTYPE, bits_to_frame, frame_error, unpack_frame, unpack_frames
+from .metrics import make_metrics
+
+# metrics counter for each description frame_error() can return
+FRAME_ERROR_METRICS = {
+    'last bit high': 'decode_failures_trailing_bit',
+    'high bits left after consuming expected content': 'decode_failures_length',
+}
+
 class bitfield_to_message(gr.sync_block):
-    """Take messages from Godox Binary Decoder; decode them into key/value pairs"""
+    """Take messages from Godox Binary Decoder; decode them into key/value pairs
+
+    If stats_interval is nonzero, metrics are published on the stats port at most that often (seconds); checksums
+    are then also verified, so that mismatches can be counted (such frames are still passed on).
+    """
 
-    def __init__(self):  # only default arguments here
+    def __init__(self, stats_interval=0.0):  # only default arguments here
         gr.sync_block.__init__(
             self,
             name='Godox Bitfield->Message',
@@ -18,6 +34,10 @@ class bitfield_to_message(gr.sync_block):
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
         self.set_msg_handler(self.inPortName, self.handle_msg)
 
         self.group_field = pmt.intern('group')
@@ -31,8 +51,11 @@ class bitfield_to_message(gr.sync_block):
     def handle_msg(self, msg_pmt):
         """
         A valid input message shall consist of a stream of high and low bits.
-        This may be represented either with a string containing 0s and 1s, or a
-        vec of uint8s, each of which is either 1 or 0.
+        This may be represented either with a string containing 0s and 1s, a
+        vec of uint8s, each of which is either 1 or 0, or an integer with the
+        bits already packed (first bit most significant). A uint64 vector is
+        taken as a batch of packed frames, each decoded to its own output
+        message.
 
         Last bit is expected to be always low, so while we expect 33 bits of
         input, the meaningful subset can be encoded in 32.
@@ -46,51 +69,57 @@ class bitfield_to_message(gr.sync_block):
           * colortemp (integer from which desired color temperature is derived: 3200K + (colortemp*100K))
           * cksum (actual checksum present in the packet; only covers group/chan/brightness as inputs)
         """
+        started = self.metrics.clock()
         msg = pmt.to_python(msg_pmt)
-        if len(msg) != 33:
-            self.message_port_pub(self.debugPortName, pmt.to_pmt(f"Value of improper length seen; expected 33 bits, got {len(bits)}: {bits!r}"))
-            return
-        if isinstance(msg, (str, bytes)):
-            msg_int = int(bits, 2)
+        if isinstance(msg, np.ndarray) and msg.dtype == np.uint64:
+            self.handle_frames(msg)
         else:
-            msg_int = 0
-            for bit in msg:
-                msg_int *= 2
-                if bit:
-                    msg_int += 1
-        ## least significant bit should always be 0
-        if msg_int % 2:
-            self.message_port_pub(self.debugPortName, pmt.to_pmt(f"Unexpected message seen with last bit high: {msg!r}"))
-            return
-        msg_int >>= 1
-        ## below here we're actually collecting data to use for output
-        out = pmt.make_dict()
-        ## next: checksum
-        cksum = msg_int & 0xff
-        out = pmt.dict_add(out, self.cksum_field, pmt.to_pmt(cksum))
-        msg_int >>= 8
-        ## next: color temperature
-        color = msg_int & 0x3f
-        out = pmt.dict_add(out, self.color_field, pmt.to_pmt(color))
-        msg_int >>= 6
-        ## next: cmd field
-        cmd = msg_int & 0x03
-        out = pmt.dict_add(out, self.cmd_field, pmt.to_pmt(cmd))
-        msg_int >>= 2
-        ## next: brightness field
-        brightness = msg_int & 0xff
-        out = pmt.dict_add(out, self.brightness_field, pmt.to_pmt(brightness))
-        msg_int >>= 8
-        ## next: chan field
-        chan = msg_int & 0x0f
-        out = pmt.dict_add(out, self.chan_field, pmt.to_pmt(chan))
-        msg_int >>= 4
-        ## last: group field
-        grp = msg_int & 0x0f
-        out = pmt.dict_add(out, self.group_field, pmt.to_pmt(grp))
-        msg_int >>= 4
-        if msg_int != 0:
-            self.message_port_pub(self.debugPortName, pmt.to_pmt(f"High bits {msg_int!r} left after consuming expected content from message: {msg!r}"))
+            self.handle_frame(msg)
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
+
+    def handle_frame(self, msg):
+        self.metrics.count('messages_in')
+        if isinstance(msg, (int, np.integer)):
+            msg_int = int(msg)
+        else:
+            if len(msg) != 33:
+                self.metrics.count('decode_failures_length')
+                self.message_port_pub(self.debugPortName, pmt.to_pmt(f"Value of improper length seen; expected 33 bits, got {len(msg)}: {msg!r}"))
+                return
+            if isinstance(msg, bytes):
+                msg = msg.decode('ascii', errors='replace')
+            try:
+                msg_int = bits_to_frame(msg)
+            except ValueError as e:
+                self.metrics.count('decode_failures_characters')
+                self.message_port_pub(self.debugPortName, pmt.to_pmt(str(e)))
+                return
+        error = frame_error(msg_int)
+        if error is not None:
+            self.metrics.count(FRAME_ERROR_METRICS[error])
+            self.message_port_pub(self.debugPortName, pmt.to_pmt(f"Unexpected message seen with {error}: {msg!r}"))
             return
-        self.message_port_pub(self.outPortName, out)
+        fields = unpack_frame(msg_int)
+        if self.metrics.enabled and checksum(fields['group'], fields['chan'], fields['brightness']) != fields['cksum']:
+            self.metrics.count('decode_failures_checksum')
+        self.message_port_pub(self.outPortName, pmt.to_pmt(fields))
+        self.metrics.count('messages_out')
 
+    def handle_frames(self, frames):
+        self.metrics.count('messages_in', len(frames))
+        (fields, valid) = unpack_frames(frames)
+        if not valid.all():
+            errors = collections.Counter(frame_error(int(frame)) for frame in frames[~valid])
+            for (error, count) in errors.items():
+                self.metrics.count(FRAME_ERROR_METRICS[error], count)
+            self.message_port_pub(self.debugPortName, pmt.to_pmt(
+                'Discarded invalid frames: ' + '; '.join(f'{count} x {error}' for (error, count) in errors.items())))
+        valid_fields = fields[valid]
+        if self.metrics.enabled:
+            self.metrics.count('decode_failures_checksum', int(np.count_nonzero(
+                checksum_array(valid_fields['group'], valid_fields['chan'], valid_fields['brightness'])
+                != valid_fields['cksum'])))
+            self.metrics.count('messages_out', len(valid_fields))
+        for row in valid_fields.tolist():
+            self.message_port_pub(self.outPortName, pmt.to_pmt(dict(zip(FRAME_DTYPE.names, row))))
@@ -2,8 +2,18 @@ import numpy as np
 from gnuradio import gr
 import pmt
 
+from .core.timing import bits_to_timing_arrays, bits_to_timings
+from .metrics import make_metrics
+from .pmt_wire import pmt_to_bits, timings_to_pmt
+
 class bitfield_to_timings(gr.sync_block):
-    def __init__(self, hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4):
+    """Encode bitfields, in any of the forms described in pmt_wire, as (bool, float) timings.
+
+    With compact_output set, timings are sent as a pair of a u8vector of levels and an f32vector of durations. A
+    string with characters other than 0 and 1 is dropped, with a note on the debug port.
+    """
+    def __init__(self, hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4,
+            compact_output=False, stats_interval=0.0):
         gr.sync_block.__init__(
             self,
             name='Godox Bitfield -> Timings',   # will show up in GRC
@@ -17,20 +27,35 @@ class bitfield_to_timings(gr.sync_block):
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
         self.set_msg_handler(self.inPortName, self.handle_msg)
 
         self.hello_time = hello_time
         self.bit_low_time = bit_low_time
         self.bit_high_time = bit_high_time
         self.bit_sep_time = bit_sep_time
+        self.compact_output = compact_output
 
     def handle_msg(self, msg_pmt):
-        out = [(True, self.hello_time)]
-        msg = pmt.to_python(msg_pmt)
-        for bit in msg:
-            if bit:
-                out.append((False, self.bit_high_time))
-            else:
-                out.append((False, self.bit_low_time))
-            out.append((True, self.bit_sep_time))
-        self.message_port_pub(self.outPortName, pmt.to_pmt(out))
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
+        try:
+            bits = pmt_to_bits(msg_pmt)
+        except ValueError as e:
+            self.metrics.count('messages_dropped')
+            self.message_port_pub(self.debugPortName, pmt.to_pmt(str(e)))
+            return
+        if self.compact_output:
+            (levels, durations) = bits_to_timing_arrays(bits, self.hello_time, self.bit_low_time, self.bit_high_time,
+                self.bit_sep_time)
+            self.message_port_pub(self.outPortName, timings_to_pmt(levels, durations, compact=True))
+        else:
+            out = bits_to_timings(bits.tolist(), self.hello_time, self.bit_low_time, self.bit_high_time,
+                self.bit_sep_time)
+            self.message_port_pub(self.outPortName, pmt.to_pmt(out))
+        self.metrics.count('messages_out')
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
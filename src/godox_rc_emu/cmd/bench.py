@@ -0,0 +1,197 @@
+#!/usr/bin/env nix-shell
+#!nix-shell -i python -p gnuradio.pythonEnv
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from godox_rc_emu.core import (EdgeExtractor, bits_to_frame, bits_to_timings, decode_timings, frame_error,
+    message_to_bits, pack_frame, render_frame, render_timings, sanitize_message, unpack_frame, unpack_frames)
+
+default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'database.sqlite.sql')
+
+ap = argparse.ArgumentParser(description='Measure the throughput of each encode/decode stage over the capture corpus, without any radio hardware.')
+ap.add_argument('--corpus', default=default_corpus, help='SQL dump of a collector database to take frames from')
+ap.add_argument('--sample_rate', type=float, action='append', help='sample rate to render and decode at; may be given more than once (default: 1e6)')
+ap.add_argument('--corpus_repeat', type=int, default=1, help='run each stage over this many copies of the corpus')
+ap.add_argument('--runs', type=int, default=3, help='time each stage this many times, and report the fastest')
+ap.add_argument('--chunk_size', type=int, default=8192, help='samples per block when extracting edges, as a GNU Radio buffer would deliver them')
+ap.add_argument('--frame_gap', type=float, default=10e-3, help='silence (seconds) rendered between frames')
+ap.add_argument('--noise', type=float, default=0.0, help='standard deviation of Gaussian noise added to synthesized samples')
+ap.add_argument('--seed', type=int, default=0, help='seed for the noise generator')
+ap.add_argument('--output', help='write results as JSON to this file (default: stdout)')
+ap.add_argument('--compare', help='JSON results of an earlier run; report each stage relative to it')
+ap.add_argument('--tolerance', type=float, default=0.2, help='with --compare, exit with status 1 if any stage is slower by more than this fraction')
+
+# encoder timings, as used by Godox Bitfield -> Timings and Timings -> OOK
+encode_timings = dict(hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4)
+# decoder limits; hello_max leaves room above the encoder's hello_time for rounding to whole samples
+decode_limits = dict(hello_min=10e-4, hello_max=14e-4, low_min=5e-4, low_max=7e-4, high_max=14e-4, sep_min=6e-4, sep_max=8e-4)
+threshold_low = 0.02
+threshold_high = 0.04
+gap_time = 5e-3
+# as the Godox Message Sanitizer block's defaults
+sanitizer_defaults = {'group': 1, 'chan': 0, 'brightness': 25, 'color': 24}
+
+def ignore_warning(s):
+    pass
+
+def load_corpus(path):
+    """Load a collector database dump into an in-memory database, and return its distinct well-formed frames as dicts."""
+    conn = sqlite3.connect(':memory:')
+    with open(path) as f:
+        conn.executescript(f.read())
+    messages = []
+    for (content,) in conn.execute('SELECT content FROM raw_messages WHERE length(content) = 33 ORDER BY id'):
+        frame = bits_to_frame(content)
+        if frame_error(frame) is None:
+            messages.append(unpack_frame(frame))
+    conn.close()
+    return messages
+
+def timed(runs, fn):
+    """Call fn() runs times; return the fastest time taken, and the result of the last call."""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def result(stage, seconds, frames, samples=None, sample_rate=None):
+    return {
+        'stage': stage,
+        'sample_rate': sample_rate,
+        'frames': frames,
+        'samples': samples,
+        'seconds': seconds,
+        'frames_per_sec': frames / seconds,
+        'samples_per_sec': None if samples is None else samples / seconds,
+    }
+
+def extract_packets(samples, sample_rate, chunk_size):
+    extractor = EdgeExtractor(threshold_low, threshold_high, max(1, int(gap_time * sample_rate)))
+    packets = []
+    for start in range(0, len(samples), chunk_size):
+        packets.extend(extractor.process(samples[start:start+chunk_size]))
+    # the stream ends in a gap; let the extractor see all of it so the final packet is closed
+    packets.extend(extractor.process(np.zeros(int(gap_time * sample_rate) + 1, dtype=np.float32)))
+    return packets
+
+def decode_packets(packets, sample_rate):
+    frames = []
+    for packet in packets:
+        levels = np.fromiter((level for (level, _) in packet), dtype=bool, count=len(packet))
+        durations = np.fromiter((duration for (_, duration) in packet), dtype=np.float64, count=len(packet)) / sample_rate
+        (decoded, _) = decode_timings(levels, durations, **decode_limits)
+        frames.extend(bits for (bits, partial) in decoded if not partial)
+    return frames
+
+def run_message_stages(messages, runs):
+    results = []
+    (seconds, sanitized) = timed(runs, lambda: [sanitize_message(dict(msg), sanitizer_defaults, ignore_warning) for msg in messages])
+    results.append(result('sanitizer', seconds, len(messages)))
+    (seconds, bitfields) = timed(runs, lambda: [message_to_bits(msg) for msg in sanitized])
+    results.append(result('message_to_bitfield', seconds, len(messages)))
+    (seconds, _) = timed(runs, lambda: [bits_to_timings(bits, **encode_timings) for bits in bitfields])
+    results.append(result('bitfield_to_timings', seconds, len(messages)))
+
+    bit_strings = [''.join(str(bit) for bit in bits) for bits in bitfields]
+    (seconds, _) = timed(runs, lambda: [unpack_frame(frame) for frame in map(bits_to_frame, bit_strings) if frame_error(frame) is None])
+    results.append(result('bitfield_to_message', seconds, len(messages)))
+    packed = np.array([pack_frame(msg) for msg in sanitized], dtype=np.uint64)
+    (seconds, _) = timed(runs, lambda: unpack_frames(packed))
+    results.append(result('bitfield_to_message (batch)', seconds, len(messages)))
+    return results, sanitized, bitfields
+
+def run_signal_stages(sanitized, bitfields, sample_rate, args, rng):
+    results = []
+    timings = [bits_to_timings(bits, **encode_timings) + [(0.0, args.frame_gap)] for bits in bitfields]
+    (seconds, bursts) = timed(args.runs, lambda: [render_timings(t, sample_rate) for t in timings])
+    total_samples = sum(len(burst) for burst in bursts)
+    results.append(result('timings_to_ookfloat', seconds, len(bursts), total_samples, sample_rate))
+    (seconds, _) = timed(args.runs, lambda: [render_frame(pack_frame(msg), sample_rate, sep_time=args.frame_gap, **encode_timings)
+        for msg in sanitized])
+    results.append(result('message_to_ookfloat', seconds, len(sanitized), total_samples, sample_rate))
+
+    samples = np.concatenate(bursts)
+    if args.noise:
+        samples = (samples + rng.normal(0, args.noise, len(samples))).astype(np.float32)
+    (seconds, packets) = timed(args.runs, lambda: extract_packets(samples, sample_rate, args.chunk_size))
+    results.append(result('ookmag_to_timings', seconds, len(packets), len(samples), sample_rate))
+    (seconds, frames) = timed(args.runs, lambda: decode_packets(packets, sample_rate))
+    results.append(result('timings_to_bitfield', seconds, len(frames), None, sample_rate))
+
+    def round_trip():
+        stream = np.concatenate([render_frame(pack_frame(sanitize_message(dict(msg), sanitizer_defaults, ignore_warning)), sample_rate,
+            sep_time=args.frame_gap, **encode_timings) for msg in sanitized])
+        if args.noise:
+            stream = (stream + rng.normal(0, args.noise, len(stream))).astype(np.float32)
+        decoded = decode_packets(extract_packets(stream, sample_rate, args.chunk_size), sample_rate)
+        return [unpack_frame(bits_to_frame(bits)) for bits in decoded if len(bits) == 33], len(stream)
+    (seconds, (decoded, stream_samples)) = timed(args.runs, round_trip)
+    results.append(result('round_trip', seconds, len(sanitized), stream_samples, sample_rate))
+    results[-1]['frames_decoded'] = len(decoded)
+    results[-1]['frames_matched'] = sum(1 for (sent, received) in zip(sanitized, decoded) if sent == received)
+    return results
+
+def compare(results, previous, tolerance):
+    """Print each stage's throughput relative to an earlier run; return True if none regressed beyond tolerance."""
+    previous_rates = {(r['stage'], r['sample_rate']): r['frames_per_sec'] for r in previous['results']}
+    ok = True
+    for r in results:
+        old_rate = previous_rates.get((r['stage'], r['sample_rate']))
+        if not old_rate:
+            continue
+        ratio = r['frames_per_sec'] / old_rate
+        regressed = ratio < 1 - tolerance
+        ok = ok and not regressed
+        print(f"{r['stage']:<28} {r['sample_rate'] or '':>10} {ratio:6.2f}x{'  REGRESSED' if regressed else ''}", file=sys.stderr)
+    return ok
+
+def main():
+    args = ap.parse_args()
+    sample_rates = args.sample_rate or [1e6]
+    rng = np.random.default_rng(args.seed)
+    messages = load_corpus(args.corpus) * args.corpus_repeat
+    print(f'Loaded {len(messages)} frames', file=sys.stderr)
+
+    (results, sanitized, bitfields) = run_message_stages(messages, args.runs)
+    for sample_rate in sample_rates:
+        results.extend(run_signal_stages(sanitized, bitfields, sample_rate, args, rng))
+
+    for r in results:
+        samples_per_sec = '' if r['samples_per_sec'] is None else f"{r['samples_per_sec']:14.0f} samples/s"
+        print(f"{r['stage']:<28} {r['sample_rate'] or '':>10} {r['frames_per_sec']:12.0f} frames/s {samples_per_sec}", file=sys.stderr)
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'args': {k: v for (k, v) in vars(args).items() if k not in ('output', 'compare')},
+        'corpus_frames': len(messages),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if not compare(results, previous, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
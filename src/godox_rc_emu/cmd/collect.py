@@ -2,149 +2,156 @@
 #!nix-shell -i python -p gnuradio.pythonEnv -p gnuradio.unwrapped.python.pkgs.pyzmq
 
 import argparse
+import asyncio
+import collections
+import signal
 import sys
+import time
 
 import pmt
-import sqlite3
 import zmq
+import zmq.asyncio
+
+from godox_rc_emu.database import BatchWriter, setup_database
 
 ap = argparse.ArgumentParser()
-ap.add_argument('--listen_socket', default='tcp://127.0.0.1:15263')
+ap.add_argument('--listen_socket', action='append', help='ZMQ endpoint to receive frames on; may be given more than once (default: tcp://127.0.0.1:15263)')
+ap.add_argument('--hwm', type=int, default=1000, help='ZMQ receive high-water mark for each listen socket')
+ap.add_argument('--queue_size', type=int, default=10000, help='frames to hold between the receivers and the database writer before dropping')
+ap.add_argument('--stats_interval', type=float, default=0, help='print receive/drop counters to stderr this often (seconds); 0 to only print them on exit')
+ap.add_argument('--batch_size', type=int, default=256, help='write to the database after this many frames are received')
+ap.add_argument('--batch_interval', type=float, default=1.0, help='write to the database at least this often (seconds) while frames are pending')
+ap.add_argument('--echo', action='store_true', help='print received frames to stderr')
+ap.add_argument('--echo_interval', type=float, default=0.5, help='print at most one received frame per this many seconds')
+ap.add_argument('--migrate_only', action='store_true', help='update the database schema, decode any stored messages, and exit')
 ap.add_argument('database', default='messages.sqlite')
 
-ddl = '''
-PRAGMA synchronous = OFF;
-PRAGMA foreign_keys = ON;
-CREATE TABLE IF NOT EXISTS raw_messages(
-    id INTEGER PRIMARY KEY,
-    content BLOB UNIQUE,
-    first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    seen_count INTEGER DEFAULT 1
-);
-
-CREATE TABLE IF NOT EXISTS bin2int(binstr BLOB NOT NULL PRIMARY KEY, intval INTEGER, fieldsize INTEGER);
-
-DROP VIEW IF EXISTS parsed_messages;
-DROP VIEW IF EXISTS _parsed_messages_step5;
-DROP VIEW IF EXISTS _parsed_messages_step4;
-DROP VIEW IF EXISTS _parsed_messages_step3;
-DROP VIEW IF EXISTS _parsed_messages_step2;
-DROP VIEW IF EXISTS _parsed_messages_step1;
-DROP VIEW IF EXISTS _parsed_message_bits;
-
-CREATE VIEW _parsed_message_bits AS
-SELECT
-       content,
-       substr(content, 1, 4) AS grp_bits,
-       substr(content, 5, 4) AS chan_bits,
-       substr(content, 9, 8) AS brightness_bits,
-       substr(content, 17, 2) AS cmd_bits,
-       substr(content, 19, 6) AS color_bits,
-       substr(content, 25, 8) AS cksum_bits,
-       substr(content, 1, 16) AS hashed_bits
-FROM raw_messages
-WHERE length(content) = 33 AND seen_count > 2;
-
-CREATE VIEW _parsed_messages_step1 AS
-SELECT
-    content,
-    hashed_bits,
-    grp_bits,        grp_bin2int.intval        AS grp_int,
-    chan_bits,       chan_bin2int.intval       AS chan_int,
-    brightness_bits, brightness_bin2int.intval AS brightness_int,
-    cmd_bits,        cmd_bin2int.intval        AS cmd_int,
-    color_bits,      color_bin2int.intval      AS color_int,
-    cksum_bits,      cksum_bin2int.intval      AS cksum_int
-FROM _parsed_message_bits
-LEFT OUTER JOIN bin2int AS grp_bin2int        ON grp_bits = grp_bin2int.binstr
-LEFT OUTER JOIN bin2int AS chan_bin2int       ON chan_bits = chan_bin2int.binstr
-LEFT OUTER JOIN bin2int AS brightness_bin2int ON brightness_bits = brightness_bin2int.binstr
-LEFT OUTER JOIN bin2int AS cmd_bin2int        ON cmd_bits = cmd_bin2int.binstr
-LEFT OUTER JOIN bin2int AS color_bin2int      ON color_bits = color_bin2int.binstr
-LEFT OUTER JOIN bin2int AS cksum_bin2int      ON cksum_bits = cksum_bin2int.binstr;
-
-CREATE VIEW _parsed_messages_step2 AS
-SELECT
-    *,
-    iif(0 != grp_int & 1, 110, 0) AS xor_grp1,
-    iif(0 != grp_int & 2, 220, 0) AS xor_grp2,
-    iif(0 != grp_int & 4, 137, 0) AS xor_grp4,
-    iif(0 != grp_int & 8, 35, 0) AS xor_grp8,
-    iif(0 != chan_int & 1, 244, 0) AS xor_chan1,
-    iif(0 != chan_int & 2, 217, 0) AS xor_chan2,
-    iif(0 != chan_int & 4, 131, 0) AS xor_chan4,
-    iif(0 != chan_int & 8, 55, 0) AS xor_chan8,
-    iif(0 != brightness_int & 1, 49, 0) AS xor_brightness1,
-    iif(0 != brightness_int & 2, 98, 0) AS xor_brightness2,
-    iif(0 != brightness_int & 4, 196, 0) AS xor_brightness4,
-    iif(0 != brightness_int & 8, 185, 0) AS xor_brightness8,
-    iif(0 != brightness_int & 16, 67, 0) AS xor_brightness16,
-    iif(0 != brightness_int & 32, 134, 0) AS xor_brightness32,
-    iif(0 != brightness_int & 64, 61, 0) AS xor_brightness64
-FROM _parsed_messages_step1;
-
-CREATE VIEW _parsed_messages_step3 AS SELECT *,
-    (~(xor_grp1 & xor_grp2)) & (xor_grp1|xor_grp2) as xor_part1a,
-    (~(xor_grp4 & xor_grp8)) & (xor_grp4|xor_grp8) as xor_part1b,
-    (~(xor_chan1 & xor_chan2)) & (xor_chan1|xor_chan2) as xor_part1c,
-    (~(xor_chan4 & xor_chan8)) & (xor_chan4|xor_chan8) as xor_part1d,
-    (~(xor_brightness1 & xor_brightness2)) & (xor_brightness1|xor_brightness2) as xor_part1e,
-    (~(xor_brightness4 & xor_brightness8)) & (xor_brightness4|xor_brightness8) as xor_part1f,
-    (~(xor_brightness16 & xor_brightness32)) & (xor_brightness16|xor_brightness32) as xor_part1g,
-    xor_brightness64 as xor_part1h
-FROM _parsed_messages_step2;
-
-CREATE VIEW _parsed_messages_step4 AS SELECT *,
-    (~(xor_part1a & xor_part1b)) & (xor_part1a | xor_part1b) as xor_part2a,
-    (~(xor_part1c & xor_part1d)) & (xor_part1c | xor_part1d) as xor_part2b,
-    (~(xor_part1e & xor_part1f)) & (xor_part1e | xor_part1f) as xor_part2c,
-    (~(xor_part1g & xor_part1h)) & (xor_part1g | xor_part1h) as xor_part2d
-FROM _parsed_messages_step3;
-
-CREATE VIEW _parsed_messages_step5 AS SELECT *,
-    (~(xor_part2a & xor_part2b)) & (xor_part2a | xor_part2b) as xor_part3a,
-    (~(xor_part2c & xor_part2d)) & (xor_part2c | xor_part2d) as xor_part3b
-FROM _parsed_messages_step4;
-
-CREATE VIEW parsed_messages AS SELECT
-    content,
-    hashed_bits,
-    grp_bits, grp_int,
-    chan_bits, chan_int,
-    brightness_bits, brightness_int,
-    cmd_bits, cmd_int,
-    color_bits, color_int,
-    cksum_bits, cksum_int,
-    (~(xor_part3a & xor_part3b)) & (xor_part3a | xor_part3b) as cksum_int_calc
-FROM _parsed_messages_step5;
-'''
-
-def populate_bin2int(conn):
-    curs = conn.cursor()
-    for fieldsize in (2, 4, 6, 8):
-        for n in range((2**fieldsize)):
-            curs.execute('INSERT OR IGNORE INTO bin2int(binstr, intval, fieldsize) VALUES(?, ?, ?)', (bin(n).lstrip('0b').zfill(fieldsize), n, fieldsize))
-    conn.commit()
+class RateLimitedEcho:
+    """Print received frames to stderr, but no more than one per interval seconds."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_time = 0.0
+        self.suppressed = 0
+
+    def __call__(self, content):
+        now = time.monotonic()
+        if now < self.next_time:
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            print(f'{content!r} (+{self.suppressed} more since last shown)', file=sys.stderr)
+        else:
+            print(repr(content), file=sys.stderr)
+        self.suppressed = 0
+        self.next_time = now + self.interval
+
+class ReceiveStats:
+    def __init__(self):
+        self.received = collections.Counter()
+        self.dropped = collections.Counter()
+        self.malformed = collections.Counter()
+
+    def report(self):
+        return ', '.join(f'{endpoint}: {self.received[endpoint]} received, {self.dropped[endpoint]} dropped, '
+            f'{self.malformed[endpoint]} malformed' for endpoint in self.received)
+
+async def receive_frames(socket, endpoint, queue, stats, echo):
+    while True:
+        data = await socket.recv()
+        try:
+            content = pmt.to_python(pmt.deserialize_str(data))
+            if not isinstance(content, str):
+                # a bitfield sent as a vector (as with compact_output) rather than as text
+                content = ''.join('1' if bit else '0' for bit in content)
+        except Exception:
+            # whatever a sender gets wrong, it must not stop this endpoint being listened to
+            stats.malformed[endpoint] += 1
+            continue
+        stats.received[endpoint] += 1
+        if echo is not None:
+            echo(content)
+        try:
+            queue.put_nowait((content, time.time()))
+        except asyncio.QueueFull:
+            stats.dropped[endpoint] += 1
+
+async def write_frames(queue, writer):
+    """Move frames from the queue to the batch writer, doing the database writes themselves in a worker thread.
+
+    Returns once a None is taken from the queue.
+    """
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), writer.time_until_due())
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(writer.flush)
+            continue
+        if item is None:
+            return
+        if writer.add(*item) or writer.time_until_due() == 0:
+            await asyncio.to_thread(writer.flush)
+
+async def report_stats(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(stats.report(), file=sys.stderr)
+
+async def collect(args, writer, echo):
+    endpoints = args.listen_socket or ['tcp://127.0.0.1:15263']
+    queue = asyncio.Queue(maxsize=args.queue_size)
+    stats = ReceiveStats()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        loop.add_signal_handler(signum, stop.set)
 
+    print("Performing message queue bind...", file=sys.stderr)
+    context = zmq.asyncio.Context()
+    sockets = []
+    for endpoint in endpoints:
+        socket = context.socket(zmq.PULL)
+        socket.setsockopt(zmq.RCVHWM, args.hwm)
+        socket.bind(endpoint)
+        sockets.append(socket)
+        stats.received[endpoint] = 0
+    tasks = [asyncio.create_task(receive_frames(socket, endpoint, queue, stats, echo))
+        for (socket, endpoint) in zip(sockets, endpoints)]
+    if args.stats_interval:
+        tasks.append(asyncio.create_task(report_stats(stats, args.stats_interval)))
+    writer_task = asyncio.create_task(write_frames(queue, writer))
+    # if the writer fails, there is no point in receiving any more
+    writer_task.add_done_callback(lambda _: stop.set())
+    print("Ready", file=sys.stderr)
+    try:
+        await stop.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # let the writer work through anything already received before it stops
+        if not writer_task.done():
+            await queue.put(None)
+        await writer_task
+        writer.flush()
+        for socket in sockets:
+            socket.close(linger=0)
+        context.term()
+        print(stats.report(), file=sys.stderr)
 
 def main():
     args = ap.parse_args()
     print("Performing database setup...", file=sys.stderr)
-    conn = sqlite3.connect(args.database)
-    conn.executescript(ddl)
-    populate_bin2int(conn)
-    curs = conn.cursor()
-    print("Performing message queue bind...", file=sys.stderr)
-    context = zmq.Context()
-    receiver = context.socket(zmq.PULL)
-    with receiver.bind(args.listen_socket) as zmq_binding:
-        print("Ready", file=sys.stderr)
-        while True:
-            content = pmt.to_python(pmt.deserialize_str(receiver.recv()))
-            print(repr(content), file=sys.stderr)
-            curs.execute('''INSERT INTO raw_messages(content) VALUES(?) ON CONFLICT(content) DO UPDATE SET seen_count = seen_count + 1, last_seen = CURRENT_TIMESTAMP''', (content,))
-            conn.commit()
+    # the connection is handed to a worker thread for each batch write, though only ever used by one at a time
+    conn = setup_database(args.database, check_same_thread=False)
+    if args.migrate_only:
+        conn.close()
+        return
+    writer = BatchWriter(conn, batch_size=args.batch_size, batch_interval=args.batch_interval)
+    echo = RateLimitedEcho(args.echo_interval) if args.echo else None
+    try:
+        asyncio.run(collect(args, writer, echo))
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
     main()
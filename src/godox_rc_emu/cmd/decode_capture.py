@@ -0,0 +1,153 @@
+#!/usr/bin/env nix-shell
+#!nix-shell -i python -p gnuradio.pythonEnv
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+
+from godox_rc_emu.core import EdgeExtractor, decode_timings, threshold_levels
+from godox_rc_emu.database import BatchWriter, setup_database
+
+ap = argparse.ArgumentParser(description='Decode frames from a recorded capture file into a collector database, using every core.')
+ap.add_argument('--format', choices=['complex64', 'float32', 'sc16'], default='complex64', help='sample format of the capture; float32 captures are taken to be magnitudes already')
+ap.add_argument('--sample_rate', type=float, required=True, help='sample rate of the capture')
+ap.add_argument('--start_time', type=float, help='time.time() at the first sample, for first_seen/last_seen (default: the file\'s modification time, less its duration)')
+ap.add_argument('--threshold_low', type=float, default=0.02)
+ap.add_argument('--threshold_high', type=float, default=0.04)
+ap.add_argument('--gap_time', type=float, default=5e-3, help='how long the signal must stay low to end a packet (seconds)')
+ap.add_argument('--hello_min', type=float, default=10e-4)
+ap.add_argument('--hello_max', type=float, default=12e-4)
+ap.add_argument('--low_min', type=float, default=5e-4)
+ap.add_argument('--low_max', type=float, default=7e-4)
+ap.add_argument('--high_max', type=float, default=14e-4)
+ap.add_argument('--sep_min', type=float, default=6e-4)
+ap.add_argument('--sep_max', type=float, default=8e-4)
+ap.add_argument('--forward_partial', action='store_true', help='also store frames that ended in an invalid pulse')
+ap.add_argument('--chunk_time', type=float, default=60.0, help='seconds of capture given to each worker at a time')
+ap.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes to decode with')
+ap.add_argument('capture')
+ap.add_argument('database', default='messages.sqlite')
+
+# samples converted to magnitudes at a time, bounding each worker's memory use
+block_samples = 1 << 20
+
+def open_capture(path, sample_format):
+    """Memory-map a capture file; returns an array of samples, which magnitude() turns into float32 magnitudes."""
+    if sample_format == 'sc16':
+        samples = np.memmap(path, dtype=np.int16, mode='r')
+        return samples[:len(samples) // 2 * 2].reshape(-1, 2)
+    return np.memmap(path, dtype=np.complex64 if sample_format == 'complex64' else np.float32, mode='r')
+
+def magnitude(samples, sample_format):
+    if sample_format == 'complex64':
+        return np.abs(samples)
+    if sample_format == 'sc16':
+        return (np.hypot(samples[:, 0], samples[:, 1], dtype=np.float32) / np.float32(32768))
+    return np.asarray(samples, dtype=np.float32)
+
+def gap_boundary(samples, sample_format, position, gap_samples, threshold_low, threshold_high):
+    """Return the first offset at or after position which is preceded by at least gap_samples of low signal.
+
+    Whether a sample is low is worked out from the samples since the gap started alone, so every worker asked about
+    the same position agrees on the answer; a packet never spans the offset returned, and the hysteresis threshold
+    is low there. Returns the length of the capture if there is no such offset.
+    """
+    if position <= 0:
+        return 0
+    # a gap is usually close by; look a little way ahead first, and further each time none is found
+    search_samples = 4 * gap_samples
+    while position < len(samples):
+        start = max(0, position - gap_samples)
+        end = min(len(samples), position + search_samples)
+        search_samples = min(2 * search_samples, block_samples)
+        # assume high before the window, so a sample only counts as low once a sample below threshold_low is seen
+        low = threshold_levels(magnitude(samples[start:end], sample_format), threshold_low, threshold_high, 1) == 0
+        index = np.arange(len(low))
+        last_high = np.maximum.accumulate(np.where(low, -1, index))
+        # offsets just past each sample that ends a long enough run of lows
+        candidates = start + np.flatnonzero(index - last_high >= gap_samples) + 1
+        candidates = candidates[candidates >= position]
+        if len(candidates):
+            return int(candidates[0])
+        position = end
+    return len(samples)
+
+def decode_chunk(path, sample_format, sample_rate, chunk_start, chunk_end, args):
+    """Decode the packets starting between the gap boundaries after chunk_start and chunk_end.
+
+    Returns a list of (sample_offset, content) pairs, content being a string of '0's and '1's as the collector
+    stores it, and the offset that of the rising edge which began the frame's hello pulse; repeats of a frame
+    within one packet are told apart by it.
+    """
+    samples = open_capture(path, sample_format)
+    gap_samples = max(1, int(args.gap_time * sample_rate))
+    start = gap_boundary(samples, sample_format, chunk_start, gap_samples, args.threshold_low, args.threshold_high)
+    end = gap_boundary(samples, sample_format, chunk_end, gap_samples, args.threshold_low, args.threshold_high)
+    extractor = EdgeExtractor(args.threshold_low, args.threshold_high, gap_samples, offset=start)
+    packets = []
+    for block_start in range(start, end, block_samples):
+        block = magnitude(samples[block_start:min(end, block_start + block_samples)], sample_format)
+        packets.extend(extractor.process_with_offsets(block))
+    # a packet still open at the end of the capture is cut off there; flush it with a gap's worth of silence
+    if extractor.packet_content is not None:
+        packets.extend(extractor.process_with_offsets(np.zeros(gap_samples, dtype=np.float32)))
+
+    frames = []
+    for (packet_offset, packet) in packets:
+        levels = np.fromiter((level for (level, _) in packet), dtype=bool, count=len(packet))
+        sample_durations = np.fromiter((duration for (_, duration) in packet), dtype=np.int64, count=len(packet))
+        # offset of the start of each pulse in the packet
+        pulse_offsets = packet_offset + np.concatenate(([0], np.cumsum(sample_durations)[:-1]))
+        (decoded, _) = decode_timings(levels, sample_durations / sample_rate, args.hello_min, args.hello_max,
+            args.low_min, args.low_max, args.high_max, args.sep_min, args.sep_max, return_starts=True)
+        for (bits, partial, start) in decoded:
+            if partial and not args.forward_partial:
+                continue
+            frames.append((int(pulse_offsets[start]), ''.join('1' if bit else '0' for bit in bits)))
+    return frames
+
+def store_frames(conn, writer, capture, sample_rate, start_time, frames):
+    """Record decoded frames in capture_frames, and count those not already recorded there in raw_messages."""
+    added = 0
+    with conn:
+        for (sample_offset, content) in frames:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO capture_frames(capture, sample_offset, sample_rate, content) VALUES(?, ?, ?, ?)',
+                (capture, sample_offset, sample_rate, content))
+            if cursor.rowcount:
+                writer.add(content, start_time + sample_offset / sample_rate)
+                added += 1
+    writer.flush()
+    return added
+
+def main():
+    args = ap.parse_args()
+    capture = os.path.abspath(args.capture)
+    total_samples = len(open_capture(capture, args.format))
+    start_time = args.start_time
+    if start_time is None:
+        start_time = os.path.getmtime(capture) - total_samples / args.sample_rate
+    chunk_samples = max(1, int(args.chunk_time * args.sample_rate))
+    chunk_starts = list(range(0, total_samples, chunk_samples))
+
+    conn = setup_database(args.database)
+    writer = BatchWriter(conn, batch_size=float('inf'))
+    started = time.monotonic()
+    decoded = added = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(decode_chunk, capture, args.format, args.sample_rate, chunk_start,
+            min(chunk_start + chunk_samples, total_samples), args) for chunk_start in chunk_starts]
+        for future in futures:
+            frames = future.result()
+            decoded += len(frames)
+            added += store_frames(conn, writer, capture, args.sample_rate, start_time, frames)
+    conn.close()
+    print(f'Decoded {decoded} frames ({added} not previously stored) from {total_samples / args.sample_rate:.1f} s of capture '
+        f'in {time.monotonic() - started:.1f} s', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# Control server for injecting JSON commands into a running flowgraph; needs neither gnuradio nor pmt, and only
+# imports zmq if a ZMQ endpoint is asked for.
+
+import asyncio
+import json
+import os
+import socket
+
+# fields of a light's state a command may give, with the (inclusive) range of integers each may take
+FIELD_RANGES = {
+    'group': (0, 15),
+    'chan': (0, 15),
+    'brightness': (0, 127),
+    'cmd': (0, 3),
+    'color': (0, 63),
+    'cksum': (0, 255),
+}
+
+def check_light(light, where):
+    if not isinstance(light, dict):
+        raise ValueError(f'{where} must be a JSON object')
+    for (field, (low, high)) in FIELD_RANGES.items():
+        if field not in light:
+            continue
+        value = light[field]
+        if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+            raise ValueError(f'{where}: {field} must be an integer from {low} to {high}, not {value!r}')
+    fade_time = light.get('fade_time', 0)
+    if not isinstance(fade_time, (int, float)) or isinstance(fade_time, bool) or not 0 <= fade_time < float('inf'):
+        raise ValueError(f'{where}: fade_time must be a non-negative number of seconds, not {fade_time!r}')
+
+def check_command(command, where):
+    """Raise ValueError unless command is one the Message Sanitizer can take without tripping over its values."""
+    if not isinstance(command, dict):
+        raise ValueError(f'{where} must be a JSON object')
+    if 'recall' in command:
+        if not isinstance(command['recall'], str):
+            raise ValueError(f'{where}: recall must be a scene name (a string)')
+    elif 'scene' in command:
+        lights = command['scene']
+        if isinstance(lights, dict):
+            lights = list(lights.values())
+        if not isinstance(lights, list):
+            raise ValueError(f'{where}: scene must be a list of lights, or an object of them')
+        for (index, light) in enumerate(lights):
+            check_light(light, f'{where}, light {index}')
+        if not isinstance(command.get('name', ''), str):
+            raise ValueError(f'{where}: name must be a string')
+    else:
+        check_light(command, where)
+
+def parse_request(data):
+    """Parse one request, a JSON command (a dict) or a list of them; returns the list of commands.
+
+    Raises ValueError if the request is not valid JSON, or any command in it has a field of the wrong type or out of
+    range, in which case none of its commands are submitted.
+    """
+    request = json.loads(data)
+    if isinstance(request, dict):
+        request = [request]
+    elif not isinstance(request, list):
+        raise ValueError('a request must be a JSON object, or a list of JSON objects')
+    for (index, command) in enumerate(request):
+        check_command(command, f'command {index}')
+    return request
+
+class ControlServer:
+    """Accept JSON commands from local clients, and pass them to submit.
+
+    endpoints is a list of:
+    - tcp://HOST:PORT, or unix:PATH: a stream socket; clients send one request per line, and get one reply line for
+      each, over a connection kept open as long as they like
+    - zmq-rep:ENDPOINT: a ZMQ REP socket; one reply for each request
+    - zmq-pull:ENDPOINT: a ZMQ PULL socket; requests are not replied to
+
+    A request is a single command ({"group": 2, "chan": 11, ...}) or a list of them, which are submitted together.
+    submit is a coroutine function taking the list of commands, and returning a list of per-command results; the
+    reply is {"ok": true, "results": [...]}, or {"ok": false, "error": "..."} if the request could not be parsed, or
+    any of its commands has a field of the wrong type or out of range (see parse_request()).
+    """
+    def __init__(self, endpoints, submit):
+        self.endpoints = endpoints
+        self.submit = submit
+        self.servers = []
+        self.unix_paths = []
+        self.zmq_context = None
+        self.tasks = []
+        # writers of the stream connections currently open, so close() need not wait for clients to hang up
+        self.connections = set()
+
+    async def handle_request(self, data):
+        try:
+            commands = parse_request(data)
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'results': await self.submit(commands)}
+
+    async def handle_stream(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self.handle_request(line)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def serve_zmq(self, zmq_socket, reply):
+        while True:
+            data = await zmq_socket.recv()
+            response = await self.handle_request(data)
+            if reply:
+                await zmq_socket.send(json.dumps(response).encode())
+
+    async def start(self):
+        for endpoint in self.endpoints:
+            if endpoint.startswith('tcp://'):
+                (host, _, port) = endpoint[len('tcp://'):].rpartition(':')
+                self.servers.append(await asyncio.start_server(self.handle_stream, host or None, int(port)))
+            elif endpoint.startswith('unix:'):
+                path = endpoint[len('unix:'):]
+                if os.path.exists(path):
+                    os.unlink(path)
+                self.servers.append(await asyncio.start_unix_server(self.handle_stream, path))
+                self.unix_paths.append(path)
+            elif endpoint.startswith(('zmq-rep:', 'zmq-pull:')):
+                import zmq
+                import zmq.asyncio
+                if self.zmq_context is None:
+                    self.zmq_context = zmq.asyncio.Context()
+                (kind, _, zmq_endpoint) = endpoint.partition(':')
+                zmq_socket = self.zmq_context.socket(zmq.REP if kind == 'zmq-rep' else zmq.PULL)
+                zmq_socket.bind(zmq_endpoint)
+                self.tasks.append(asyncio.create_task(self.serve_zmq(zmq_socket, kind == 'zmq-rep')))
+            else:
+                raise ValueError(f'Unrecognized control endpoint {endpoint!r}')
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+        for writer in list(self.connections):
+            writer.close()
+        for server in self.servers:
+            await server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.zmq_context is not None:
+            self.zmq_context.destroy(linger=0)
+        for path in self.unix_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.servers = []
+        self.unix_paths = []
+        self.tasks = []
+        self.zmq_context = None
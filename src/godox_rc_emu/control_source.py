@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import threading
+
+import pmt
+from gnuradio import gr
+
+from .control import ControlServer
+from .metrics import make_metrics
+
+# shared by every Control Source in the process, so acks fanned out to several of them match only the right one
+ack_ids = itertools.count()
+
+class control_source(gr.sync_block):
+    """Publish JSON commands from local clients as messages, for the Message Sanitizer (or Muxer) to take.
+
+    Runs a ControlServer on the comma-separated endpoints (tcp://HOST:PORT, unix:PATH, zmq-rep:ENDPOINT or
+    zmq-pull:ENDPOINT) from its own thread, publishing each command as soon as it is read, and replying with
+    {"queued": null, "acked": false} for each. If the muxer's ack port is connected to the ack input and ack_timeout
+    is set, each command's reply instead waits up to that many seconds for the muxer to accept it, and reports
+    {"queued": true, "acked": true} with its position in the muxer's queue; commands the sanitizer drops, moves to
+    another light (as it does with an invalid group or channel), or holds back while fading, and those a State
+    Cache suppresses, are still reported as not acked.
+
+    While waiting, each command is published with an 'ack_id', which the sanitizer passes on and the muxer echoes
+    in its ack, so each reply gets the ack for its own command however many clients are sending at once.
+    """
+    def __init__(self, endpoints='tcp://127.0.0.1:15264', ack_timeout=0.0, stats_interval=0.0):
+        gr.sync_block.__init__(
+            self,
+            name='Godox Control Source',
+            in_sig=None,
+            out_sig=None,
+        )
+        self.outPortName = pmt.intern('out')
+        self.ackPortName = pmt.intern('ack')
+        self.message_port_register_out(self.outPortName)
+        self.message_port_register_in(self.ackPortName)
+        self.set_msg_handler(self.ackPortName, self.handle_ack)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
+
+        self.endpoints = [endpoint.strip() for endpoint in endpoints.split(',') if endpoint.strip()]
+        self.ack_timeout = ack_timeout
+        # map from the ack_id of each command awaiting an ack from the muxer to the future its ack resolves
+        self.waiters = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = ControlServer(self.endpoints, self.submit)
+        # bind here, so that a bad endpoint stops the flowgraph from starting
+        self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever, name='godox-control', daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if self.thread is not None:
+            asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.thread = None
+        return True
+
+    async def submit(self, commands):
+        started = self.metrics.clock()
+        futures = []
+        for command in commands:
+            future = None
+            if self.ack_timeout:
+                future = self.loop.create_future()
+                command = dict(command, ack_id=next(ack_ids))
+                with self.lock:
+                    self.waiters[command['ack_id']] = future
+            self.message_port_pub(self.outPortName, pmt.to_pmt(command))
+            futures.append(future)
+        self.metrics.count('requests')
+        self.metrics.count('commands', len(commands))
+        pending = [future for future in futures if future is not None]
+        if pending:
+            await asyncio.wait(pending, timeout=self.ack_timeout)
+            with self.lock:
+                self.waiters = {ack_id: future for (ack_id, future) in self.waiters.items() if future not in pending}
+        results = []
+        for future in futures:
+            if future is not None and future.done():
+                results.append(future.result())
+            else:
+                self.metrics.count('acks_missed' if future is not None else 'acks_skipped')
+                results.append({'queued': None, 'acked': False, 'position': None})
+        self.metrics.elapsed('submit', started)
+        self.metrics.poll()
+        return results
+
+    def handle_ack(self, msg_pmt):
+        ack = pmt.to_python(msg_pmt)
+        with self.lock:
+            future = self.waiters.pop(ack.get('ack_id'), None)
+        if future is None:
+            return
+        result = {'queued': True, 'acked': True, 'position': ack['position'], 'pending': ack['pending'],
+            'backlog': ack['backlog']}
+        self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
@@ -0,0 +1,13 @@
+# Protocol logic shared by the GNU Radio blocks, with no dependency on gnuradio or pmt: frame packing, checksums,
+# timing encoding and decoding, and sample rendering. Safe to import from command-line tools and scripts.
+
+from .checksum import checksum, checksum_array
+from .frame import (MESSAGE_FORMAT, FRAME_FIELDS, FRAME_DTYPE, pack_frame, frame_to_bits, message_to_bits,
+    bits_to_frame, frame_error, unpack_frame, unpack_frames)
+from .timing import bits_to_timings, bits_to_timing_arrays, frame_airtime, classify_pulses, decode_timings, TimingRecovery
+from .render import sample_counts, render_timings, render_levels, render_frame, mix_to_carrier
+from .edges import threshold_levels, EdgeExtractor
+from .sanitize import sanitize_message, sanitize_scene, scene_lights
+from .fade import fade_state, Fader, shared_fader
+from .state_cache import StateCache
+from .waveform_cache import WaveformCache, message_key, shared_cache
@@ -0,0 +1,48 @@
+import numpy as np
+
+# Each set bit of the group, channel and brightness fields XORs a fixed value into the checksum. Since XOR is
+# associative, the contribution of every possible value of a field can be precomputed; checksumming a frame then
+# takes three table lookups and two XORs.
+
+GROUP_XOR_VALUES = [110, 220, 137, 35]
+CHAN_XOR_VALUES = [244, 217, 131, 55]
+# we don't know how the 8th bit of brightness goes into the checksum
+BRIGHTNESS_XOR_VALUES = [49, 98, 196, 185, 67, 134, 61]
+
+def update_checksum(checksum, content, xor_values):
+    current_bit = 1
+    for xor_value in xor_values:
+        if content & current_bit:
+            checksum ^= xor_value
+        current_bit <<= 1
+    return checksum
+
+def build_table(xor_values, size):
+    return [update_checksum(0, n, xor_values) for n in range(size)]
+
+GROUP_TABLE = build_table(GROUP_XOR_VALUES, 16)
+CHAN_TABLE = build_table(CHAN_XOR_VALUES, 16)
+BRIGHTNESS_TABLE = build_table(BRIGHTNESS_XOR_VALUES, 256)
+
+GROUP_ARRAY = np.array(GROUP_TABLE, dtype=np.uint8)
+CHAN_ARRAY = np.array(CHAN_TABLE, dtype=np.uint8)
+BRIGHTNESS_ARRAY = np.array(BRIGHTNESS_TABLE, dtype=np.uint8)
+
+def checksum(group, chan, brightness):
+    return GROUP_TABLE[group & 0x0f] ^ CHAN_TABLE[chan & 0x0f] ^ BRIGHTNESS_TABLE[brightness & 0xff]
+
+def checksum_array(group, chan, brightness):
+    """Vectorized checksum over arrays of group, chan and brightness values; returns a uint8 array."""
+    group = np.asarray(group, dtype=np.intp)
+    chan = np.asarray(chan, dtype=np.intp)
+    brightness = np.asarray(brightness, dtype=np.intp)
+    return GROUP_ARRAY[group & 0x0f] ^ CHAN_ARRAY[chan & 0x0f] ^ BRIGHTNESS_ARRAY[brightness & 0xff]
+
+def sqlite_checksum(group, chan, brightness):
+    if group is None or chan is None or brightness is None:
+        return None
+    return checksum(group, chan, brightness)
+
+def register_sqlite(conn, name='godox_checksum'):
+    """Make godox_checksum(group, chan, brightness) available as a scalar function on a SQLite connection."""
+    conn.create_function(name, 3, sqlite_checksum, deterministic=True)
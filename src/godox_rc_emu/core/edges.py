@@ -0,0 +1,68 @@
+import numpy as np
+
+def threshold_levels(samples, low, high, initial_level):
+    """Apply a hysteresis threshold to a block of samples, as blocks_threshold_ff does.
+
+    A sample above high sets the level to 1, a sample below low sets it to 0, and anything in between holds the
+    previous level (initial_level at the start of the block). Returns an int8 array of levels.
+    """
+    above = samples > high
+    decided = above | (samples < low)
+    # index of the most recent sample which was decisively above or below the thresholds, or -1 if none yet
+    last_decided = np.where(decided, np.arange(len(samples)), -1)
+    np.maximum.accumulate(last_decided, out=last_decided)
+    return np.where(last_decided >= 0, above[last_decided], bool(initial_level)).astype(np.int8)
+
+class EdgeExtractor:
+    """Find packets of OOK edge timings in a float magnitude stream, one block of samples at a time.
+
+    Packets start with a rising edge, and end once the signal has stayed low for gap_samples; each is returned as a
+    list of (bool, duration) pairs, with durations in samples. Threshold and packet state carries over from one call
+    to process() to the next, so packets may span blocks.
+
+    offset is the absolute offset of the first sample that will be passed in; process_with_offsets() reports the
+    absolute offset of each packet's first rising edge along with the packet.
+    """
+    def __init__(self, threshold_low, threshold_high, gap_samples, offset=0):
+        self.threshold_low = threshold_low
+        self.threshold_high = threshold_high
+        self.gap_samples = gap_samples
+
+        # absolute offset of the first sample of the next block
+        self.offset = offset
+        self.level = 0
+        self.packet_content = None
+        # absolute offset of the rising edge that started the current packet
+        self.packet_start = None
+        # absolute offset of the last edge seen within the current packet
+        self.state_start = None
+
+    def process(self, samples):
+        return [packet for (_, packet) in self.process_with_offsets(samples)]
+
+    def process_with_offsets(self, samples):
+        """As process(), but returns a list of (offset, packet) pairs."""
+        levels = threshold_levels(samples, self.threshold_low, self.threshold_high, self.level)
+        edges = np.flatnonzero(np.diff(levels, prepend=np.int8(self.level)))
+        packets = []
+        for (edge, rising) in zip((edges + self.offset).tolist(), levels[edges].tolist()):
+            if self.packet_content is None:
+                if rising:
+                    self.packet_content = []
+                    self.state_start = self.packet_start = edge
+                continue
+            duration = edge - self.state_start
+            if rising and duration >= self.gap_samples:
+                # low too long; the previous packet ended, and this edge starts a new one
+                packets.append((self.packet_start, self.packet_content))
+                self.packet_content = []
+                self.packet_start = edge
+            else:
+                self.packet_content.append((not rising, duration))
+            self.state_start = edge
+        self.offset += len(samples)
+        self.level = int(levels[-1]) if len(levels) else self.level
+        if self.packet_content is not None and not self.level and self.offset - self.state_start >= self.gap_samples:
+            packets.append((self.packet_start, self.packet_content))
+            self.packet_content = self.state_start = self.packet_start = None
+        return packets
@@ -0,0 +1,120 @@
+import threading
+import time
+
+from .checksum import checksum
+
+def fade_state(start, target, fraction):
+    """Return the message fraction of the way from start to target, with brightness and color rounded to whole steps."""
+    brightness = round(start['brightness'] + (target['brightness'] - start['brightness']) * fraction)
+    color = round(start['color'] + (target['color'] - start['color']) * fraction)
+    msg = dict(target, brightness=brightness, color=color)
+    msg['cksum'] = checksum(msg['group'], msg['chan'], brightness)
+    return msg
+
+def same_state(a, b):
+    return a['brightness'] == b['brightness'] and a['color'] == b['color'] and a['cmd'] == b['cmd']
+
+class Fade:
+    def __init__(self, start, target, start_time, end_time, step_time, publish):
+        self.start = start
+        self.target = target
+        self.start_time = start_time
+        self.end_time = end_time
+        self.step_time = step_time
+        self.publish = publish
+        self.last_sent = start
+
+    def fraction(self, now):
+        return min(1.0, max(0.0, (now - self.start_time) / (self.end_time - self.start_time)))
+
+    def state(self, now):
+        return fade_state(self.start, self.target, self.fraction(now))
+
+    def position(self, now):
+        """Return the state reached by now without rounding, so a fade restarted from it loses no progress."""
+        fraction = self.fraction(now)
+        return dict(self.target,
+            brightness=self.start['brightness'] + (self.target['brightness'] - self.start['brightness']) * fraction,
+            color=self.start['color'] + (self.target['color'] - self.start['color']) * fraction)
+
+class Fader:
+    """Steps lights from one brightness/color to another over time, for any number of lights, from one thread.
+
+    Each step sends the state every fading light should have reached by then, and steps are spaced by the sum of
+    step_time(state) for each state sent, so that however many lights are fading, their steps together never ask for
+    more air than there is; step_time should give the time a state takes to send with all its repeats, so that each
+    state has been sent in full before the next replaces it. A fade sends its target at the first step at or after
+    its end time (unless its last step already sent it), so the target waits its turn for the air like any other
+    state. Starting a new fade for a light that is still fading carries on from wherever the old fade had got to;
+    the states the old fade would have passed through are never generated.
+
+    publish is called with each message to send, from the fader's thread.
+    """
+    def __init__(self):
+        # map from (group, chan) to the Fade in progress for that light
+        self.fades = {}
+        self.next_step = 0.0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def fade(self, key, start, target, duration, step_time, publish):
+        with self.condition:
+            now = time.monotonic()
+            current = self.fades.pop(key, None)
+            if current is not None:
+                start = current.position(now)
+            if duration <= 0 or start is None or same_state(start, target):
+                publish(target)
+                return
+            fade = self.fades[key] = Fade(start, target, now, now + duration, step_time, publish)
+            if current is not None:
+                fade.last_sent = current.last_sent
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='godox-fader', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, key):
+        with self.condition:
+            self.fades.pop(key, None)
+
+    def cancel_all(self, publish):
+        """Cancel every fade that would be sent through publish."""
+        with self.condition:
+            for key in [key for (key, fade) in self.fades.items() if fade.publish == publish]:
+                del self.fades[key]
+
+    def run(self):
+        with self.condition:
+            while True:
+                if not self.fades:
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                self.step(now)
+                if self.fades:
+                    self.condition.wait(max(0.0, self.next_step - now))
+
+    def step(self, now):
+        if now < self.next_step:
+            return
+        used = 0.0
+        for (key, fade) in list(self.fades.items()):
+            if now >= fade.end_time:
+                del self.fades[key]
+                state = fade.target
+            else:
+                state = fade.state(now)
+            # the last step may already have reached this state
+            if same_state(state, fade.last_sent):
+                continue
+            fade.last_sent = state
+            fade.publish(state)
+            used += fade.step_time(state)
+        if not used:
+            # nothing changed; look again once the quickest fade could have
+            used = min((fade.step_time(fade.last_sent) for fade in self.fades.values()), default=0.0)
+        self.next_step = now + used
+
+# shared by every sanitizer in the process, so lights fading in different blocks share the air fairly
+shared_fader = Fader()
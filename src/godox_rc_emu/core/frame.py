@@ -0,0 +1,87 @@
+import numpy as np
+
+# name, bit count, default
+MESSAGE_FORMAT = [
+    ('group', 4, 1),
+    ('chan', 4, 0),
+    ('brightness', 8, 25),
+    ('cmd', 2, 0),
+    ('color', 6, 1),
+    ('cksum', 8, None),
+]
+
+def pack_frame(msg):
+    """Pack a dict with the fields of MESSAGE_FORMAT into the 33-bit integer sent on air, most significant bit first."""
+    frame = 0
+    for (field_name, field_size, field_default) in MESSAGE_FORMAT:
+        frame = (frame << field_size) | (msg.get(field_name, field_default) & ((1 << field_size) - 1))
+    return frame << 1 # all messages end with a trailing 0 as the 33rd bit
+
+def frame_to_bits(frame):
+    """Unpack a 33-bit frame into a list of 0s and 1s, in transmission order."""
+    return [(frame >> shift) & 1 for shift in range(32, -1, -1)]
+
+def message_to_bits(msg):
+    """Given a dict with the fields of MESSAGE_FORMAT, return the 33 transmitted bits as a list of 0s and 1s."""
+    return frame_to_bits(pack_frame(msg))
+
+# (name, bit count) of each field, most significant first; the trailing always-0 bit is not included
+FRAME_FIELDS = [
+    ('group', 4),
+    ('chan', 4),
+    ('brightness', 8),
+    ('cmd', 2),
+    ('color', 6),
+    ('cksum', 8),
+]
+FRAME_DTYPE = np.dtype([(field_name, np.uint8) for (field_name, _) in FRAME_FIELDS])
+
+def bits_to_frame(bits):
+    """Pack a string of '0's and '1's, or a sequence of 0/1 values, into an integer.
+
+    Raises ValueError for a string that is empty or has any other character; int(bits, 2) alone would take
+    '0b101', ' 101' or '1_01'.
+    """
+    if isinstance(bits, bytes):
+        bits = bits.decode('ascii', errors='replace')
+    if isinstance(bits, str):
+        if not bits or bits.strip('01'):
+            raise ValueError(f'Value with characters other than 0 and 1 seen: {bits!r}')
+        return int(bits, 2)
+    frame = 0
+    for bit in bits:
+        frame = (frame << 1) | (1 if bit else 0)
+    return frame
+
+def frame_error(frame):
+    """Return a description of what is wrong with a packed 33-bit frame, or None if it is well-formed."""
+    ## least significant bit should always be 0
+    if frame & 1:
+        return 'last bit high'
+    if frame >> 33:
+        return 'high bits left after consuming expected content'
+    return None
+
+def unpack_frame(frame):
+    """Split a well-formed packed 33-bit frame into a dict of its fields."""
+    frame >>= 1
+    out = {}
+    for (field_name, field_size) in reversed(FRAME_FIELDS):
+        out[field_name] = frame & ((1 << field_size) - 1)
+        frame >>= field_size
+    return out
+
+def unpack_frames(frames):
+    """Split an array of packed 33-bit frames into a structured array of fields, all at once.
+
+    Returns (fields, valid), where valid is a boolean array which is False for frames that fail the checks made by
+    frame_error(); fields of those frames are meaningless.
+    """
+    frames = np.asarray(frames, dtype=np.uint64)
+    valid = ((frames & np.uint64(1)) == 0) & ((frames >> np.uint64(33)) == 0)
+    fields = np.empty(len(frames), dtype=FRAME_DTYPE)
+    shift = 1
+    for (field_name, field_size) in reversed(FRAME_FIELDS):
+        fields[field_name] = (frames >> np.uint64(shift)) & np.uint64((1 << field_size) - 1)
+        shift += field_size
+    return fields, valid
@@ -0,0 +1,58 @@
+import numpy as np
+
+def sample_counts(durations, sample_rate):
+    """Return the whole number of samples each duration (in seconds) lasts at sample_rate, as an intp array.
+
+    Other durations are truncated, as int() would, but those within float32 precision of a whole number of samples
+    (falling just short of it through rounding, in float64 or in float32 as compact timings carry them) are taken
+    to be that whole number rather than losing a sample; every renderer counts samples here, so every form of the
+    same timings renders the same burst.
+    """
+    counts = np.asarray(durations, dtype=np.float64) * sample_rate
+    whole = np.rint(counts)
+    # a relative rather than absolute tolerance, as float32 durations are only that precise to begin with
+    return np.where(np.abs(counts - whole) <= np.abs(counts) * np.finfo(np.float32).eps, whole,
+        np.floor(counts)).astype(np.intp)
+
+def render_timings(timings, sample_rate, true_value=1.0, false_value=0.0):
+    """Render a sequence of (value, time) pairs into one contiguous float32 sample array.
+
+    Boolean values are mapped to true_value/false_value; any other value is used as the sample value directly.
+    """
+    values = np.fromiter(
+        (((true_value if value else false_value) if isinstance(value, bool) else value) for (value, _) in timings),
+        dtype=np.float32, count=len(timings))
+    durations = np.fromiter((time for (_, time) in timings), dtype=np.float64, count=len(timings))
+    counts = sample_counts(durations, sample_rate)
+    return np.repeat(values, counts)
+
+def render_levels(levels, durations, sample_rate, true_value=1.0, false_value=0.0):
+    """As render_timings(), given parallel arrays of boolean levels and durations."""
+    values = np.where(np.asarray(levels, dtype=bool), np.float32(true_value), np.float32(false_value))
+    counts = sample_counts(durations, sample_rate)
+    return np.repeat(values, counts)
+
+def render_frame(frame, sample_rate, true_value=1.0, false_value=0.0, sep_value=0.0, sep_time=1e-3,
+        hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4):
+    """Render a packed 33-bit frame straight to samples, without building an intermediate list of timings.
+
+    Equivalent to rendering bits_to_timings() of the frame's bits, followed by sep_time of sep_value.
+    """
+    bits = (frame >> np.arange(32, -1, -1)) & 1
+    (hello_count, low_count, high_count, bit_sep_count, sep_count) = sample_counts(
+        [hello_time, bit_low_time, bit_high_time, bit_sep_time, sep_time], sample_rate)
+    counts = np.empty(2 * len(bits) + 2, dtype=np.intp)
+    counts[0] = hello_count
+    counts[1:-1:2] = np.where(bits, high_count, low_count)
+    counts[2:-1:2] = bit_sep_count
+    counts[-1] = sep_count
+    values = np.empty(len(counts), dtype=np.float32)
+    values[0::2] = true_value
+    values[1::2] = false_value
+    values[-1] = sep_value
+    return np.repeat(values, counts)
+
+def mix_to_carrier(samples, phase_step, amplitude=1.0, phase=0.0):
+    """Multiply real samples by a complex carrier advancing phase_step radians per sample; returns complex64."""
+    carrier = np.exp(1j * (phase + phase_step * np.arange(len(samples))))
+    return (carrier * (np.asarray(samples, dtype=np.float64) * amplitude)).astype(np.complex64)
@@ -0,0 +1,140 @@
+import numbers
+
+import numpy as np
+
+from .checksum import checksum, checksum_array
+
+def sanitize_message(msg_in, defaults, warn, validate_incoming_checksum=True):
+    """Coerce a dict (or tuple of pairs) into a message whose values can be represented in binary form, with a checksum.
+
+    Fields absent from msg_in are taken from defaults. Problems are reported by calling warn with a description;
+    returns None if msg_in cannot be interpreted as a message at all.
+    """
+    if not isinstance(msg_in, dict):
+        if isinstance(msg_in, tuple):
+            try:
+                msg_in = dict(msg_in)
+            except ValueError as e:
+                warn(f'Received message in tuple form that could not be converted to a dict: {msg_in!r}: {e}')
+                return None
+        else:
+            warn(f'Ignoring message which is not in either dict or tuple form')
+            return None
+    group = msg_in.pop('group', defaults['group'])
+    if group < 0 or group > 15:
+        warn(f'Invalid group {group!r}')
+        group = defaults['group']
+    chan = msg_in.pop('chan', defaults['chan'])
+    if chan < 0 or chan > 15:
+        warn(f'Invalid channel {chan!r}')
+        chan = defaults['chan']
+    brightness = msg_in.pop('brightness', defaults['brightness'])
+    if brightness < 0:
+        warn(f'Coercing negative brightness {brightness!r} to 0')
+        brightness = 0
+    elif brightness > 127:
+        brightness = 127 # we don't know how the 8th bit goes into the checksum
+    cmd = msg_in.pop('cmd', 0)
+    if cmd < 0:
+        warn(f'Coercing negative command {cmd!r} to 0')
+        cmd = 0
+    elif cmd > 3:
+        warn(f'Coercing invalid command {cmd!r} to 0')
+        cmd = 0
+    # default is daylight temp; bicolor lights support largest brightness range here
+    color = msg_in.pop('color', defaults['color'])
+    if color < 0:
+        warn(f'Coercing negative color {color!r} to 0')
+        color = 0
+    elif color > 63:
+        warn(f'Coercing invalid color {color!r} to 24')
+        color = 63
+    orig_cksum = msg_in.pop('cksum', None)
+    cksum = checksum(group, chan, brightness)
+    msg_out = {
+        'brightness': brightness,
+        'chan': chan,
+        'cksum': cksum,
+        'cmd': cmd,
+        'color': color,
+        'group': group,
+    }
+    if validate_incoming_checksum and orig_cksum is not None and orig_cksum != cksum:
+        warn(f'Calculated checksum {cksum!r} for message {msg_out!r}, but originally had checksum {orig_cksum!r}')
+    return msg_out
+
+def scene_lights(scene):
+    """Return the per-light states of a scene, given as a list of dicts or as a dict of dicts keyed by any label."""
+    if isinstance(scene, dict):
+        return list(scene.values())
+    if isinstance(scene, (list, tuple)):
+        return list(scene)
+    return []
+
+def scene_row(light, defaults):
+    """Return a light's (group, chan, brightness, cmd, color, cksum) as integers, or None if it has a field that
+    is not a number, or is not a dict (or tuple of pairs) at all. An absent cksum is given as -1."""
+    if not isinstance(light, (dict, tuple)):
+        return None
+    try:
+        light = dict(light)
+        values = [light.get('group', defaults['group']), light.get('chan', defaults['chan']),
+            light.get('brightness', defaults['brightness']), light.get('cmd', 0), light.get('color', defaults['color']),
+            light.get('cksum', -1)]
+        if not all(isinstance(value, numbers.Real) for value in values):
+            return None
+        row = tuple(int(value) for value in values)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not all(-2**63 <= value < 2**63 for value in row):
+        return None
+    return row
+
+def sanitize_scene(lights, defaults, warn, validate_incoming_checksum=True):
+    """Sanitize a scene's per-light states all at once, applying the same rules as sanitize_message().
+
+    Returns a list of messages, one per (group, chan); if a light is given more than once, its last state is used.
+    Problems are reported with one call to warn per kind of problem, rather than one per light; lights that cannot
+    be interpreted as messages at all are dropped.
+    """
+    rows = [scene_row(light, defaults) for light in lights]
+    dropped = rows.count(None)
+    if dropped:
+        warn(f'Dropping {dropped} light(s) in scene that could not be interpreted as messages')
+    rows = [row for row in rows if row is not None]
+    if not rows:
+        warn('Ignoring scene with no lights')
+        return []
+    (group, chan, brightness, cmd, color, orig_cksum) = np.array(rows, dtype=np.int64).T.copy()
+
+    def coerce(values, bad, replacement, description):
+        count = int(np.count_nonzero(bad))
+        if count:
+            if description:
+                warn(f'{count} light(s) in scene with {description}')
+            values[bad] = replacement
+    coerce(group, (group < 0) | (group > 15), defaults['group'], f'invalid group; using {defaults["group"]}')
+    coerce(chan, (chan < 0) | (chan > 15), defaults['chan'], f'invalid channel; using {defaults["chan"]}')
+    coerce(brightness, brightness < 0, 0, 'negative brightness; coercing to 0')
+    coerce(brightness, brightness > 127, 127, None) # we don't know how the 8th bit goes into the checksum
+    coerce(cmd, (cmd < 0) | (cmd > 3), 0, 'invalid command; coercing to 0')
+    coerce(color, color < 0, 0, 'negative color; coercing to 0')
+    coerce(color, color > 63, 63, 'invalid color; coercing to 63')
+    cksum = checksum_array(group, chan, brightness)
+    if validate_incoming_checksum:
+        mismatched = int(np.count_nonzero((orig_cksum >= 0) & (orig_cksum != cksum)))
+        if mismatched:
+            warn(f'{mismatched} light(s) in scene had a checksum other than the one calculated')
+
+    # later states for the same light replace earlier ones, but keep the position of the first
+    msgs_out = {}
+    for (g, c, b, m, k, s) in zip(group.tolist(), chan.tolist(), brightness.tolist(), cmd.tolist(), color.tolist(), cksum.tolist()):
+        msgs_out[(g, c)] = {
+            'brightness': b,
+            'chan': c,
+            'cksum': s,
+            'cmd': m,
+            'color': k,
+            'group': g,
+        }
+    return list(msgs_out.values())
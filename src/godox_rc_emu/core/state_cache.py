@@ -0,0 +1,74 @@
+from .fade import same_state
+
+class StateCache:
+    """Remembers the state last sent to each (group, chan), and when, so that resending it can be skipped.
+
+    A message is suppressed if its light was sent the same state (brightness, color and command) less than
+    freshness seconds ago; suppressing a message does not extend that time, so a light that missed the state is
+    sent it again at most freshness seconds later. If refresh_interval is nonzero, every light's state becomes due
+    to be sent again once that long has passed since it was last sent, whether or not anything new arrives for it.
+
+    Times are whatever clock the caller passes in, as long as it is used consistently.
+    """
+    def __init__(self, freshness=10.0, refresh_interval=0.0):
+        self.freshness = freshness
+        self.refresh_interval = refresh_interval
+        # map from (group, chan) to (state, time last sent)
+        self.states = {}
+
+    def lookup(self, msg, now):
+        """Return 'miss' if msg's light has no state cached, 'changed' if msg is a different state, 'expired' if the
+        same state was last sent freshness or more seconds ago, and 'hit' if it was sent more recently."""
+        cached = self.states.get((msg['group'], msg['chan']))
+        if cached is None:
+            return 'miss'
+        (state, sent_time) = cached
+        if not same_state(state, msg):
+            return 'changed'
+        return 'hit' if now - sent_time < self.freshness else 'expired'
+
+    def record(self, msg, now):
+        # an ack_id belongs to the command that first sent the state; a refresh resending it must not echo it again
+        if 'ack_id' in msg:
+            msg = {key: value for (key, value) in msg.items() if key != 'ack_id'}
+        self.states[(msg['group'], msg['chan'])] = (msg, now)
+
+    def offer(self, msg, now):
+        """Look msg up, and record it as sent unless it is a hit; returns the result of the lookup."""
+        result = self.lookup(msg, now)
+        if result != 'hit':
+            self.record(msg, now)
+        return result
+
+    def offer_scene(self, lights, now):
+        """Look up each light of a scene; unless every one is a hit, record them all as sent, as the scene must
+        then be sent whole. Returns the list of lookup results."""
+        results = [self.lookup(msg, now) for msg in lights]
+        if any(result != 'hit' for result in results):
+            for msg in lights:
+                self.record(msg, now)
+        return results
+
+    def due(self, now):
+        """Return the states due to be refreshed by now, recording each as sent."""
+        if not self.refresh_interval:
+            return []
+        due = [state for (state, sent_time) in self.states.values() if now - sent_time >= self.refresh_interval]
+        for state in due:
+            self.record(state, now)
+        return due
+
+    def next_refresh_time(self):
+        """Return when the next state falls due to be refreshed, or None if none ever will."""
+        if not self.refresh_interval or not self.states:
+            return None
+        return min(sent_time for (_, sent_time) in self.states.values()) + self.refresh_interval
+
+    def refresh(self, now, group=None, chan=None):
+        """Return the cached states of every light matching group and chan (None matching any), recording each as
+        sent."""
+        states = [state for ((state_group, state_chan), (state, _)) in self.states.items()
+            if group in (None, state_group) and chan in (None, state_chan)]
+        for state in states:
+            self.record(state, now)
+        return states
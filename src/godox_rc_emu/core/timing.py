@@ -0,0 +1,225 @@
+import collections
+
+import numpy as np
+
+def bits_to_timings(bits, hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4):
+    """Given a sequence of bits, return the (value, time) pairs used to transmit them."""
+    out = [(True, hello_time)]
+    for bit in bits:
+        if bit:
+            out.append((False, bit_high_time))
+        else:
+            out.append((False, bit_low_time))
+        out.append((True, bit_sep_time))
+    return out
+
+def bits_to_timing_arrays(bits, hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4):
+    """As bits_to_timings(), but returning parallel uint8 level and float32 duration arrays."""
+    bits = np.asarray(bits, dtype=bool)
+    levels = np.ones(1 + 2 * len(bits), dtype=np.uint8)
+    levels[1::2] = 0
+    durations = np.empty(len(levels), dtype=np.float32)
+    durations[0] = hello_time
+    durations[1::2] = np.where(bits, bit_high_time, bit_low_time)
+    durations[2::2] = bit_sep_time
+    return (levels, durations)
+
+def frame_airtime(frame, hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4, sep_time=1e-3):
+    """Return how long, in seconds, a packed 33-bit frame takes to send, including the sep_time gap that follows it."""
+    high_bits = bin(frame).count('1')
+    return (hello_time + high_bits * bit_high_time + (33 - high_bits) * bit_low_time + 33 * bit_sep_time + sep_time)
+
+# Pulse classes, as assigned by classify_pulses()
+SEP_SHORT, SEP, LONG_HIGH, LOW_SHORT, BIT_ZERO, BIT_ONE, LONG_LOW = range(7)
+
+def classify_pulses(levels, durations, low_min, low_max, high_max, sep_min, sep_max):
+    """Classify every pulse at once, as it would be seen after a hello; returns an array of pulse classes."""
+    high_class = np.digitize(durations, [sep_min])
+    high_class[(high_class == 1) & (durations > sep_max)] = LONG_HIGH
+    low_class = np.digitize(durations, [low_min, low_max])
+    low_class[(low_class == 2) & (durations > high_max)] = LONG_LOW - LOW_SHORT
+    return np.where(levels, high_class, LOW_SHORT + low_class)
+
+def decode_timings(levels, durations, hello_min, hello_max, low_min, low_max, high_max, sep_min, sep_max,
+        return_starts=False):
+    """Decode parallel arrays of pulse levels and durations into frames.
+
+    Returns a list of (bits, partial) pairs, with bits a uint8 array, and a Counter of warnings seen while decoding;
+    with return_starts set, (bits, partial, start) triples, start being the index of the frame's hello pulse.
+    Frames with no bits are not returned. See the timings_to_bitfield block's handle_msg for the rules applied.
+    """
+    levels = np.asarray(levels, dtype=bool)
+    durations = np.asarray(durations, dtype=np.float64)
+    classes = classify_pulses(levels, durations, low_min, low_max, high_max, sep_min, sep_max)
+    hellos = np.flatnonzero(levels & (durations >= hello_min) & (durations <= hello_max))
+    # any pulse other than a valid separator or bit ends the message it appears in
+    terminators = np.flatnonzero(~np.isin(classes, (SEP, BIT_ZERO, BIT_ONE)))
+    rehello = (durations > hello_min) & (durations < hello_max)
+
+    frames = []
+    warnings = collections.Counter()
+    search_from = 0
+    start = None
+    while True:
+        if start is None:
+            next_hello = np.searchsorted(hellos, search_from)
+            if next_hello == len(hellos):
+                break
+            start = hellos[next_hello]
+        frame_start = start
+        next_terminator = np.searchsorted(terminators, start + 1)
+        end = terminators[next_terminator] if next_terminator < len(terminators) else len(classes)
+        body = classes[start+1:end]
+        bits = (body[(body == BIT_ZERO) | (body == BIT_ONE)] == BIT_ONE).astype(np.uint8)
+        if end == len(classes):
+            # ran out of input while in a message; send what we have
+            frames.append((bits, False, frame_start))
+            break
+        terminator = classes[end]
+        start = None
+        search_from = end + 1
+        if terminator == LONG_LOW:
+            # No need for a warning here: This is expected after a legitimate message
+            frames.append((bits, False, frame_start))
+            continue
+        frames.append((bits, True, frame_start))
+        if terminator == SEP_SHORT:
+            warnings[f'Separator seen with duration less than minimum {sep_min}'] += 1
+        elif terminator == LOW_SHORT:
+            warnings[f'Short-low timing below minimum of {low_min}'] += 1
+        elif rehello[end]:
+            # high too long to be a separator, but within the hello range; consider it start of a new message
+            warnings['Hello seen while already in a prior message; truncating and starting new'] += 1
+            start = end
+        else:
+            warnings['Invalid long-high seen; ending message'] += 1
+    if not return_starts:
+        frames = [(bits, partial) for (bits, partial, _) in frames]
+    return [frame for frame in frames if len(frame[0])], warnings
+
+class TimingRecovery:
+    """Decode timings whose pulses have been stretched or smeared, by estimating each frame's timing as it goes.
+
+    A transmitter with a drifting clock stretches every pulse by the same factor; smoothing in the receiver
+    lengthens every high pulse, and shortens every low one, by the same amount. For each hello (a high pulse
+    between 1.2 and 2.4 times as long as the separator after it), the frame's scale and offset are fitted, by least
+    squares, to its hello, its separators and its 0 bits, each taken to be at the middle of its window; its pulses
+    are then mapped back onto the nominal timings and classified with the usual windows.
+
+    Running estimates are kept per (group, chan), updated by adaptation_rate from each complete frame; a frame
+    that decodes incompletely with its own estimate is tried again with its transmitter's, if enough of it was
+    decoded to tell which transmitter sent it.
+    """
+    def __init__(self, hello_min, hello_max, low_min, low_max, high_max, sep_min, sep_max, adaptation_rate=0.1):
+        self.windows = (low_min, low_max, high_max, sep_min, sep_max)
+        self.hello_nominal = (hello_min + hello_max) / 2
+        self.sep_nominal = (sep_min + sep_max) / 2
+        self.zero_nominal = (low_min + low_max) / 2
+        self.low_max = low_max
+        # (center, half width) of each class's window, for judging how comfortably a pulse fell within it
+        self.class_windows = {
+            SEP: (self.sep_nominal, (sep_max - sep_min) / 2),
+            BIT_ZERO: ((low_min + low_max) / 2, (low_max - low_min) / 2),
+            BIT_ONE: ((low_max + high_max) / 2, (high_max - low_max) / 2),
+        }
+        self.adaptation_rate = adaptation_rate
+        # map from (group, chan) to the running (scale, offset) estimate for that transmitter
+        self.estimates = {}
+
+    def estimate(self, levels, durations, start):
+        """Return (scale, offset) for the frame whose hello is at start: a nominal high pulse of t seconds is taken
+        to have been seen as t * scale + offset, and a nominal low pulse as t * scale - offset."""
+        # the pulses after the hello alternate low (a bit) and high (a separator), up to the end of the frame
+        highs = durations[start+2:start+68:2][np.cumprod(levels[start+2:start+68:2]).astype(bool)]
+        lows = durations[start+1:start+67:2][np.cumprod(~levels[start+1:start+67:2]).astype(bool)]
+        if not len(highs):
+            return (1.0, 0.0)
+        median = np.median(highs)
+        seps = highs[(highs > 0.7 * median) & (highs < 1.3 * median)]
+        stretch = np.median(seps) / self.sep_nominal
+        # 0 and 1 bits form two clusters, with a clear gap between; failing that, assume a pure stretch to tell them apart
+        lows = np.sort(lows[lows < 2.5 * np.median(seps)])
+        gaps = lows[1:] / lows[:-1]
+        if len(gaps) and gaps.max() > 1.25:
+            zeros = lows[:np.argmax(gaps) + 1]
+        else:
+            zeros = lows[lows < self.low_max * stretch]
+        if not len(zeros):
+            return (stretch, 0.0)
+        nominal = np.concatenate(([self.hello_nominal], np.full(len(seps), self.sep_nominal), np.full(len(zeros), self.zero_nominal)))
+        sign = np.concatenate(([1.0], np.ones(len(seps)), -np.ones(len(zeros))))
+        observed = np.concatenate(([durations[start]], seps, zeros))
+        ((scale, offset), *_) = np.linalg.lstsq(np.column_stack((nominal, sign)), observed, rcond=None)
+        if not 0.5 < scale < 2:
+            return (stretch, 0.0)
+        return (scale, offset)
+
+    def decode_at(self, levels, durations, start, scale, offset):
+        """Decode the frame whose hello is at start; returns (bits, partial, end, confidence)."""
+        body_levels = levels[start+1:]
+        body = np.where(body_levels, durations[start+1:] - offset, durations[start+1:] + offset) / scale
+        classes = classify_pulses(body_levels, body, *self.windows)
+        bad = np.flatnonzero(~np.isin(classes, (SEP, BIT_ZERO, BIT_ONE)))
+        end = bad[0] if len(bad) else len(classes)
+        partial = end < len(classes) and classes[end] != LONG_LOW
+        pulses = classes[:end]
+        bits = (pulses[(pulses == BIT_ZERO) | (pulses == BIT_ONE)] == BIT_ONE).astype(np.uint8)
+        margin = 0.0
+        for (pulse_class, (center, half_width)) in self.class_windows.items():
+            matching = body[:end][pulses == pulse_class]
+            if len(matching):
+                margin = max(margin, np.max(np.abs(matching - center)) / half_width)
+        return (bits, partial, start + 1 + end, float(max(0.0, 1.0 - margin)))
+
+    @staticmethod
+    def score(decoded):
+        (bits, partial, _, confidence) = decoded
+        return (len(bits) == 33 and not partial, len(bits), confidence)
+
+    def decode(self, levels, durations):
+        """Decode parallel arrays of pulse levels and durations, as decode_timings() does.
+
+        Returns a list of (bits, partial, report) triples, with report a dict of the frame's confidence (0 to 1: how
+        comfortably its worst pulse fell within its window, once corrected), the scale and offset used, and
+        whether those came from the frame itself or its transmitter's running estimate; and a Counter of warnings.
+        """
+        levels = np.asarray(levels, dtype=bool)
+        durations = np.asarray(durations, dtype=np.float64)
+        frames = []
+        warnings = collections.Counter()
+        if len(levels) < 3:
+            return frames, warnings
+        ratios = durations[:-2] / np.maximum(durations[2:], 1e-12)
+        candidates = np.flatnonzero(levels[:-2] & ~levels[1:-1] & levels[2:] & (ratios > 1.2) & (ratios < 2.4))
+        search_from = 0
+        for start in candidates:
+            if start < search_from:
+                continue
+            (scale, offset) = self.estimate(levels, durations, start)
+            (bits, partial, end, confidence) = self.decode_at(levels, durations, start, scale, offset)
+            source = 'frame'
+            key = (int(bits[:4] @ [8, 4, 2, 1]), int(bits[4:8] @ [8, 4, 2, 1])) if len(bits) >= 8 else None
+            if (partial or len(bits) != 33) and key in self.estimates:
+                retry = self.decode_at(levels, durations, start, *self.estimates[key])
+                if self.score(retry) > self.score((bits, partial, end, confidence)):
+                    (bits, partial, end, confidence) = retry
+                    (scale, offset) = self.estimates[key]
+                    source = 'transmitter'
+            search_from = end
+            if not len(bits):
+                continue
+            if len(bits) == 33 and not partial:
+                if source == 'frame':
+                    previous = self.estimates.get(key, (scale, offset))
+                    rate = self.adaptation_rate
+                    self.estimates[key] = (previous[0] + rate * (scale - previous[0]), previous[1] + rate * (offset - previous[1]))
+            elif partial:
+                warnings['Frame ended by a pulse outside every window, even after timing correction'] += 1
+            frames.append((bits, partial, {
+                'confidence': confidence if not partial else 0.0,
+                'bits': len(bits),
+                'scale': float(scale),
+                'offset': float(offset),
+                'source': source,
+            }))
+        return frames, warnings
@@ -0,0 +1,75 @@
+import collections
+import threading
+
+# Fields which, together with the encoder's timing and rendering parameters, fully determine a rendered packet
+MESSAGE_FIELDS = ('group', 'chan', 'brightness', 'cmd', 'color', 'cksum')
+
+def message_key(msg, *params):
+    """Build a cache key from a decoded message and whatever parameters were used to render it."""
+    return tuple(msg.get(field) for field in MESSAGE_FIELDS) + tuple(params)
+
+class WaveformCache:
+    """Size-bounded LRU cache of rendered sample arrays.
+
+    Bounded by the total number of bytes held rather than by entry count, since the size of a packet's rendering
+    depends on the sample rate. Cached arrays are marked read-only, as they are shared between every user of the
+    cache. Safe to use from multiple blocks' threads at once.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            samples = self.entries.get(key)
+            if samples is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return samples
+
+    def put(self, key, samples):
+        if samples.nbytes > self.max_bytes:
+            return samples
+        samples.flags.writeable = False
+        with self.lock:
+            old_samples = self.entries.pop(key, None)
+            if old_samples is not None:
+                self.current_bytes -= old_samples.nbytes
+            self.entries[key] = samples
+            self.current_bytes += samples.nbytes
+            while self.current_bytes > self.max_bytes:
+                (_, evicted) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+        return samples
+
+    def get_or_render(self, key, render):
+        """Return the cached samples for key, calling render() to produce (and cache) them on a miss."""
+        samples = self.get(key)
+        if samples is None:
+            samples = self.put(key, render())
+        return samples
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'bytes': self.current_bytes,
+        }
+
+# shared by every encoder in the process, so identical packets rendered by different blocks are only rendered once
+shared_cache = WaveformCache()
@@ -0,0 +1,161 @@
+# Schema of the database written by cmd/collect.py and cmd/decode_capture.py, and the code to write to it. Needs
+# neither gnuradio nor zmq.
+
+import sqlite3
+import sys
+import time
+
+from .core.checksum import checksum, register_sqlite
+from .core.frame import bits_to_frame, unpack_frame
+
+ddl = '''
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = OFF;
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS raw_messages(
+    id INTEGER PRIMARY KEY,
+    content BLOB UNIQUE,
+    first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    seen_count INTEGER DEFAULT 1,
+    -- decoded once, at insert time; NULL if content is not a 33-bit frame
+    grp INTEGER,
+    chan INTEGER,
+    brightness INTEGER,
+    cmd INTEGER,
+    color INTEGER,
+    cksum INTEGER,
+    cksum_calc INTEGER,
+    cksum_valid INTEGER
+);
+-- where each frame decoded from a recorded capture file was found; content matches raw_messages.content
+CREATE TABLE IF NOT EXISTS capture_frames(
+    id INTEGER PRIMARY KEY,
+    capture TEXT NOT NULL,
+    sample_offset INTEGER NOT NULL,
+    sample_rate REAL NOT NULL,
+    content BLOB NOT NULL,
+    UNIQUE(capture, sample_offset, content)
+);
+'''
+
+# columns added to raw_messages after its original definition, which migrate() adds to older databases
+decoded_columns = ['grp', 'chan', 'brightness', 'cmd', 'color', 'cksum', 'cksum_calc', 'cksum_valid']
+
+# run after migrate(), as the indexes depend on the decoded columns
+views_ddl = '''
+CREATE INDEX IF NOT EXISTS raw_messages_grp_chan ON raw_messages(grp, chan);
+CREATE INDEX IF NOT EXISTS raw_messages_cksum_valid ON raw_messages(cksum_valid);
+
+DROP VIEW IF EXISTS parsed_messages;
+DROP VIEW IF EXISTS _parsed_messages_step5;
+DROP VIEW IF EXISTS _parsed_messages_step4;
+DROP VIEW IF EXISTS _parsed_messages_step3;
+DROP VIEW IF EXISTS _parsed_messages_step2;
+DROP VIEW IF EXISTS _parsed_messages_step1;
+DROP VIEW IF EXISTS _parsed_message_bits;
+
+CREATE VIEW parsed_messages AS SELECT
+    content,
+    substr(content, 1, 16) AS hashed_bits,
+    substr(content, 1, 4) AS grp_bits,         grp AS grp_int,
+    substr(content, 5, 4) AS chan_bits,        chan AS chan_int,
+    substr(content, 9, 8) AS brightness_bits,  brightness AS brightness_int,
+    substr(content, 17, 2) AS cmd_bits,        cmd AS cmd_int,
+    substr(content, 19, 6) AS color_bits,      color AS color_int,
+    substr(content, 25, 8) AS cksum_bits,      cksum AS cksum_int,
+    cksum_calc AS cksum_int_calc
+FROM raw_messages
+WHERE grp IS NOT NULL AND seen_count > 2;
+'''
+
+def decode_content(content):
+    """Decode a received frame into the values of decoded_columns; all None if it is not a 33-bit frame."""
+    if isinstance(content, bytes):
+        content = content.decode('ascii', errors='replace')
+    if not isinstance(content, str) or len(content) != 33 or content.strip('01'):
+        return (None,) * len(decoded_columns)
+    fields = unpack_frame(bits_to_frame(content))
+    cksum_calc = checksum(fields['group'], fields['chan'], fields['brightness'])
+    return (fields['group'], fields['chan'], fields['brightness'], fields['cmd'], fields['color'], fields['cksum'],
+        cksum_calc, int(cksum_calc == fields['cksum']))
+
+def migrate(conn):
+    """Bring a database created by an older version of this script up to date, filling in any undecoded rows."""
+    existing_columns = {row[1] for row in conn.execute('PRAGMA table_info(raw_messages)')}
+    with conn:
+        for column in decoded_columns:
+            if column not in existing_columns:
+                conn.execute(f'ALTER TABLE raw_messages ADD COLUMN {column} INTEGER')
+        # content that is not all 0s and 1s decodes to NULLs, so is left out rather than selected again every time
+        rows = conn.execute('SELECT id, content FROM raw_messages WHERE grp IS NULL AND length(content) = 33 '
+            "AND content NOT GLOB '*[^01]*'").fetchall()
+        conn.executemany(
+            f'UPDATE raw_messages SET {", ".join(f"{column} = ?" for column in decoded_columns)} WHERE id = ?',
+            (decode_content(content) + (row_id,) for (row_id, content) in rows))
+    return len(rows)
+
+def setup_database(path, **connect_args):
+    conn = sqlite3.connect(path, **connect_args)
+    conn.executescript(ddl)
+    backfilled = migrate(conn)
+    if backfilled:
+        print(f"Decoded {backfilled} previously stored messages", file=sys.stderr)
+    conn.executescript(views_ddl)
+    register_sqlite(conn)
+    return conn
+
+def sqlite_timestamp(t):
+    """Format a time.time() value the same way as SQLite's CURRENT_TIMESTAMP."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+
+class BatchWriter:
+    """Collect received frames in memory, and write them to raw_messages in batches.
+
+    Repeats of the same frame within a batch are counted in memory, so each distinct frame costs one row in a single
+    executemany() per batch, which is applied in one transaction. A batch is written once batch_size frames have
+    been received, or batch_interval seconds after the last write, whichever comes first.
+    """
+    upsert_sql = f'''
+        INSERT INTO raw_messages(content, first_seen, last_seen, seen_count, {", ".join(decoded_columns)})
+        VALUES(?, ?, ?, ?, {", ".join("?" for _ in decoded_columns)})
+        ON CONFLICT(content) DO UPDATE SET seen_count = seen_count + excluded.seen_count, last_seen = excluded.last_seen
+    '''
+
+    def __init__(self, conn, batch_size=256, batch_interval=1.0):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        # map from content to [seen_count, first_seen, last_seen]
+        self.pending = {}
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, content, seen_time=None):
+        """Record a received frame; returns True once the pending batch is full and should be flushed."""
+        if seen_time is None:
+            seen_time = time.time()
+        entry = self.pending.get(content)
+        if entry is None:
+            self.pending[content] = [1, seen_time, seen_time]
+        else:
+            entry[0] += 1
+            entry[2] = seen_time
+        self.pending_count += 1
+        return self.pending_count >= self.batch_size
+
+    def time_until_due(self):
+        """Seconds until the pending batch should be written; None if nothing is pending."""
+        if not self.pending:
+            return None
+        return max(0.0, self.last_flush + self.batch_interval - time.monotonic())
+
+    def flush(self):
+        if self.pending:
+            rows = [(content, sqlite_timestamp(first_seen), sqlite_timestamp(last_seen), seen_count) + decode_content(content)
+                for (content, (seen_count, first_seen, last_seen)) in self.pending.items()]
+            with self.conn:
+                self.conn.executemany(self.upsert_sql, rows)
+            self.pending.clear()
+            self.pending_count = 0
+        self.last_flush = time.monotonic()
@@ -2,10 +2,49 @@ import numpy as np
 from gnuradio import gr
 import pmt
 
+import collections
+import heapq
+import itertools
+import threading
 import time
 
+from .core.frame import pack_frame
+from .core.timing import frame_airtime
+from .metrics import make_metrics
+
 class message_muxer(gr.sync_block):
-    def __init__(self, repeat_count=5, time_between_repeats=1e-5, active_gain=50, inactive_gain=0, cutoff_time=4.0):
+    """Deduplicate messages per (group, chan), and interleave the requested number of repeats of each.
+
+    The on-air time of each frame is worked out from the given hello/bit/separator timings, plus the sep_time gap
+    that Timings -> OOK appends; a frame is only released once the previous one has finished, and frames are spaced
+    so that no more than airtime_budget of each second is spent transmitting. If max_backlog is set, and the
+    airtime needed for all pending repeats would exceed it, repeats are capped (to no fewer than min_repeat_count
+    per message) so that new updates are not held up behind old ones.
+
+    A scene message ({'scene': [msg, ...]}, as sent by the Message Sanitizer) is scheduled as one entry: each repeat
+    sends every light in the scene back to back, and other messages are interleaved only between repeats. A newer
+    message or scene for one of its lights takes that light out of the scene.
+
+    Each message or scene accepted is acknowledged on the ack port with its position in the queue (how many frames or
+    scenes are due to be sent before it), the number of entries pending, the backlog in seconds, and the message's
+    'ack_id' if it had one (which is not sent on); connect it to a Control Source to have these reported to its
+    clients.
+
+    If stats_interval is nonzero, every stats_interval seconds a dict of packets sent, airtime used and updates
+    superseded is published on the stats port, along with a snapshot of the muxer's cumulative metrics (under
+    'metrics'). With verbose_debug set, a debug message is also published each time the muxer is triggered with
+    messages pending but none yet due.
+
+    By default the muxer only makes progress when a message arrives on its trigger port (typically from a message
+    strobe). With self_clocked set, it instead runs its own timer thread, which sleeps until the next repeat is
+    due, the channel frees up, the inactive-gain cutoff passes, or a new message arrives; the trigger port still
+    works in this mode. It wakes to publish stats only while it has sent or still has something to send, so an idle
+    muxer does not wake at all; the stats for an idle stretch are published once it is next triggered.
+    """
+    def __init__(self, repeat_count=5, time_between_repeats=1e-5, active_gain=50, inactive_gain=0, cutoff_time=4.0,
+            hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4, sep_time=1e-3,
+            airtime_budget=1.0, max_backlog=0.0, min_repeat_count=1, stats_interval=0.0, self_clocked=False,
+            verbose_debug=False):
         gr.sync_block.__init__(
             self,
             name='Godox Message Muxer',
@@ -17,15 +56,29 @@ class message_muxer(gr.sync_block):
         self.outPortName = pmt.intern('out')
         self.debugPortName = pmt.intern('debug')
         self.gainPortName = pmt.intern('gain')
+        self.statsPortName = pmt.intern('stats')
+        self.ackPortName = pmt.intern('ack')
         self.message_port_register_in(self.inPortName)
         self.message_port_register_in(self.triggerPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.gainPortName)
         self.message_port_register_out(self.debugPortName)
+        self.message_port_register_out(self.statsPortName)
+        self.message_port_register_out(self.ackPortName)
         self.set_msg_handler(self.inPortName, self.handle_msg)
         self.set_msg_handler(self.triggerPortName, self.trigger_now)
-        # map from (group, chan) to (last_transmit_time, num_repeats_left, message)
+        # map from (chan, group) to (last_transmit_time, num_repeats_left, message, seq, airtime_ns); scenes are
+        # keyed by ('scene', n), with a list of ((chan, group), message, airtime_ns) as their message and their
+        # total airtime as airtime_ns
         self.messages = {}
+        # map from (chan, group) to the key of the pending scene that includes it
+        self.scene_keys = {}
+        self.scene_ids = itertools.count()
+        # frames of the scene repeat currently being sent, as ((chan, group), message, airtime_ns)
+        self.scene_pass = collections.deque()
+        # heap of (last_transmit_time, seq, key); an entry is stale once self.messages[key] holds a different seq
+        self.schedule = []
+        self.seq = itertools.count()
         self.last_send_time = None
         self.repeat_count = repeat_count
         self.time_between_repeats_ns = int(time_between_repeats * 1e9)
@@ -33,37 +86,263 @@ class message_muxer(gr.sync_block):
         self.inactive_gain = inactive_gain
         self.cutoff_time_ns = int(cutoff_time * 1e9)
         self.last_set_gain = None
+
+        self.timings = (hello_time, bit_low_time, bit_high_time, bit_sep_time, sep_time)
+        self.airtime_budget = airtime_budget
+        self.max_backlog_ns = int(max_backlog * 1e9)
+        self.min_repeat_count = min_repeat_count
+        # when the frame most recently sent will have finished transmitting (stretched to honour airtime_budget)
+        self.channel_free_time = 0
+        # total airtime of every repeat still pending
+        self.backlog_ns = 0
+
+        self.stats_interval_ns = int(stats_interval * 1e9)
+        self.stats_start_time = time.time_ns()
+        self.stats_packets = 0
+        self.stats_airtime_ns = 0
+        self.stats_superseded = 0
+        self.stats_capped = 0
+        self.metrics = make_metrics(self.alias, stats_interval)
+        self.verbose_debug = verbose_debug
+
+        self.self_clocked = self_clocked
+        # guards all scheduling state, as the clock thread and message handlers may run at once
+        self.condition = threading.Condition(threading.RLock())
+        self.clock_thread = None
+        self.stopping = False
+        # set in start(), once connections are made; working out a queue position takes a scan of everything pending
+        self.ack_connected = False
+
+    def start(self):
+        self.ack_connected = not pmt.is_null(self.message_subscribers(self.ackPortName))
+        if self.self_clocked:
+            self.stopping = False
+            self.clock_thread = threading.Thread(target=self.run_clock, name='godox-muxer-clock', daemon=True)
+            self.clock_thread.start()
+        return True
+
+    def stop(self):
+        if self.clock_thread is not None:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify()
+            self.clock_thread.join()
+            self.clock_thread = None
+        return True
+
+    def run_clock(self):
+        with self.condition:
+            while not self.stopping:
+                self.trigger_now()
+                wakeup_time = self.next_event_time()
+                self.condition.wait(None if wakeup_time is None else max(0.0, (wakeup_time - time.time_ns()) / 1e9))
+
+    def next_event_time(self):
+        """Return the time_ns() at which trigger_now() next has something to do, or None if only a new message would."""
+        event_times = []
+        # stats are only worth waking for while there is something to report; an idle muxer sleeps until woken
+        busy = self.messages or self.scene_pass or self.stats_packets or self.stats_superseded or self.stats_capped
+        if self.stats_interval_ns and busy:
+            event_times.append(self.stats_start_time + self.stats_interval_ns)
+        entry = self.next_scheduled()
+        if self.scene_pass:
+            event_times.append(self.channel_free_time)
+        elif entry is not None:
+            event_times.append(max(entry[0] + self.time_between_repeats_ns, self.channel_free_time))
+        elif self.last_set_gain != self.inactive_gain:
+            event_times.append((self.last_send_time or 0) + self.cutoff_time_ns + 1)
+        return min(event_times) if event_times else None
+
+    def airtime_ns(self, msg):
+        try:
+            frame = pack_frame(msg)
+        except TypeError:
+            # not a complete message; assume the longest possible frame
+            frame = (1 << 33) - 1
+        return int(frame_airtime(frame, *self.timings) * 1e9)
+    def schedule_message(self, key, last_transmit_time, repeat_count, msg_pmt, airtime_ns):
+        seq = next(self.seq)
+        self.messages[key] = (last_transmit_time, repeat_count, msg_pmt, seq, airtime_ns)
+        heapq.heappush(self.schedule, (last_transmit_time, seq, key))
+        # replaced messages leave stale entries behind; don't let them pile up
+        if len(self.schedule) > 2 * len(self.messages) + 16:
+            self.schedule = [(item[0], item[3], key) for (key, item) in self.messages.items()]
+            heapq.heapify(self.schedule)
+
+    def next_scheduled(self):
+        """Return the (last_transmit_time, seq, key) entry of the message that has waited longest, or None."""
+        while self.schedule:
+            (_, seq, key) = entry = self.schedule[0]
+            item = self.messages.get(key)
+            if item is not None and item[3] == seq:
+                return entry
+            heapq.heappop(self.schedule)
+        return None
+
     def handle_msg(self, msg_pmt):
+        started = self.metrics.clock()
+        with self.condition:
+            self.enqueue(msg_pmt)
+            if self.self_clocked:
+                self.condition.notify()
+            else:
+                self.trigger_now()
+        self.metrics.elapsed('handle_msg', started)
+    def supersede(self, key):
+        """Drop anything still pending for the light (chan, group) key, whether alone or in a scene."""
+        superseded = False
+        item = self.messages.pop(key, None)
+        if item is not None:
+            self.backlog_ns -= item[1] * item[4]
+            superseded = True
+        scene_key = self.scene_keys.pop(key, None)
+        scene = self.messages.get(scene_key)
+        if scene is not None:
+            (last_transmit_time, repeat_count, frames, seq, total_airtime_ns) = scene
+            airtime_ns = sum(frame[2] for frame in frames if frame[0] == key)
+            frames = [frame for frame in frames if frame[0] != key]
+            self.backlog_ns -= repeat_count * airtime_ns
+            if frames:
+                self.messages[scene_key] = (last_transmit_time, repeat_count, frames, seq, total_airtime_ns - airtime_ns)
+            else:
+                del self.messages[scene_key]
+            superseded = True
+        for frame in [frame for frame in self.scene_pass if frame[0] == key]:
+            self.scene_pass.remove(frame)
+            self.backlog_ns -= frame[2]
+            superseded = True
+        if superseded:
+            self.stats_superseded += 1
+            self.metrics.count('superseded')
+        return superseded
+    def queue_position(self, key):
+        """Return how many frames or scenes are due to be sent before the pending entry key."""
+        (last_transmit_time, _, _, seq, _) = self.messages[key]
+        ahead = sum(1 for item in self.messages.values() if (item[0], item[3]) < (last_transmit_time, seq))
+        return ahead + len(self.scene_pass)
+    def enqueue(self, msg_pmt):
         msg = pmt.to_python(msg_pmt)
-        chan = msg.get('chan')
-        group = msg.get('group')
-        self.messages[(chan, group)] = (0, self.repeat_count, pmt.to_pmt(msg))
-        self.trigger_now()
+        ack_id = msg.pop('ack_id', None)
+        if 'scene' in msg:
+            key = self.enqueue_scene(msg['scene'])
+            ack = {'scene': len(msg['scene'])}
+        else:
+            key = (msg.get('chan'), msg.get('group'))
+            ack = {'group': key[1], 'chan': key[0]}
+            airtime_ns = self.airtime_ns(msg)
+            # replacing anything still pending for this (chan, group); only the latest is worth sending
+            self.supersede(key)
+            self.schedule_message(key, 0, self.repeat_count, pmt.to_pmt(msg), airtime_ns)
+            self.backlog_ns += self.repeat_count * airtime_ns
+        if self.max_backlog_ns and self.backlog_ns > self.max_backlog_ns:
+            self.cap_repeats()
+        self.metrics.count('messages_in')
+        self.metrics.gauge('pending', len(self.messages))
+        self.metrics.gauge('backlog_seconds', self.backlog_ns / 1e9)
+        if ack_id is not None:
+            ack['ack_id'] = ack_id
+        if key is not None and self.ack_connected:
+            ack.update(position=self.queue_position(key), pending=len(self.messages), backlog=self.backlog_ns / 1e9)
+            self.message_port_pub(self.ackPortName, pmt.to_pmt(ack))
+    def enqueue_scene(self, lights):
+        # one frame per light, the last state given for a light winning
+        frames = {}
+        for msg in lights:
+            key = (msg.get('chan'), msg.get('group'))
+            frames[key] = (key, pmt.to_pmt(msg), self.airtime_ns(msg))
+        if not frames:
+            return None
+        for key in frames:
+            self.supersede(key)
+        scene_key = ('scene', next(self.scene_ids))
+        total_airtime_ns = sum(frame[2] for frame in frames.values())
+        self.schedule_message(scene_key, 0, self.repeat_count, list(frames.values()), total_airtime_ns)
+        self.backlog_ns += self.repeat_count * total_airtime_ns
+        for key in frames:
+            self.scene_keys[key] = scene_key
+        self.metrics.count('scenes_in')
+        return scene_key
+    def cap_repeats(self):
+        """Reduce pending repeats, evenly across messages, until the backlog fits in max_backlog."""
+        total_airtime_ns = sum(item[4] for item in self.messages.values())
+        allowed = max(self.min_repeat_count, self.max_backlog_ns // max(total_airtime_ns, 1))
+        for (key, (last_transmit_time, repeat_count, msg_pmt, seq, airtime_ns)) in self.messages.items():
+            if repeat_count > allowed:
+                self.messages[key] = (last_transmit_time, allowed, msg_pmt, seq, airtime_ns)
+                self.backlog_ns -= (repeat_count - allowed) * airtime_ns
+                self.stats_capped += repeat_count - allowed
+                self.metrics.count('repeats_capped', repeat_count - allowed)
+    def publish_stats(self, current_time):
+        elapsed_ns = current_time - self.stats_start_time
+        self.message_port_pub(self.statsPortName, pmt.to_pmt({
+            'interval': elapsed_ns / 1e9,
+            'packets': self.stats_packets,
+            'airtime': self.stats_airtime_ns / 1e9,
+            'airtime_fraction': self.stats_airtime_ns / elapsed_ns,
+            'superseded': self.stats_superseded,
+            'repeats_capped': self.stats_capped,
+            'pending': len(self.messages),
+            'backlog': self.backlog_ns / 1e9,
+            'metrics': self.metrics.snapshot(),
+        }))
+        self.stats_start_time = current_time
+        self.stats_packets = self.stats_airtime_ns = self.stats_superseded = self.stats_capped = 0
     def trigger_now(self, *_):
+        with self.condition:
+            self.service()
+    def service(self):
+        current_time = time.time_ns()
+        if self.stats_interval_ns and current_time - self.stats_start_time >= self.stats_interval_ns:
+            self.publish_stats(current_time)
         # idle? turn off gain
-        if not self.messages:
+        if not self.messages and not self.scene_pass:
             if self.last_set_gain != self.inactive_gain:
-                current_time = time.time_ns()
                 if current_time > ((self.last_send_time or 0) + self.cutoff_time_ns):
                     self.message_port_pub(self.gainPortName, pmt.to_pmt({"gain": self.inactive_gain}))
                     self.last_set_gain = self.inactive_gain
             return
         # otherwise? enable gain
-        current_time = time.time_ns()
         if self.last_set_gain != self.active_gain:
             if current_time > ((self.last_send_time or 0) + self.cutoff_time_ns):
                 self.message_port_pub(self.gainPortName, pmt.to_pmt({"gain": self.active_gain}))
                 self.last_set_gain = self.active_gain
-        # which messages are old enough to resend?
-        all_msgs = [i for i in self.messages.items() if i[1][0] <= (current_time - self.time_between_repeats_ns)]
-        if not all_msgs:
-            self.message_port_pub(self.debugPortName, pmt.to_pmt(f'No messages left after time filter (current_time={current_time!r}, time_between_repeats_ns={self.time_between_repeats_ns!r}, items={self.messages.items()!r})'))
+        # finish the scene repeat in progress before anything else
+        if self.scene_pass:
+            if current_time >= self.channel_free_time:
+                (_, msg_pmt, airtime_ns) = self.scene_pass.popleft()
+                self.send(current_time, msg_pmt, airtime_ns)
+            return
+        # resend whichever message has waited longest, if it has waited long enough
+        (last_transmit_time, _, msg_key) = self.next_scheduled()
+        if last_transmit_time > (current_time - self.time_between_repeats_ns):
+            self.metrics.count('not_due')
+            if self.verbose_debug:
+                self.message_port_pub(self.debugPortName, pmt.to_pmt(f'No messages due yet ({len(self.messages)} pending; next due in {last_transmit_time + self.time_between_repeats_ns - current_time} ns)'))
+            return
+        # the previous frame is still on air
+        if current_time < self.channel_free_time:
             return
-        # ...sort by age so we resend the oldest first...
-        all_msgs.sort(key=lambda item: item[1][0])
-        (msg_key, (_, repeat_count, msg_pmt)) = all_msgs.pop(0)
+        heapq.heappop(self.schedule)
+        (_, repeat_count, msg_pmt, _, airtime_ns) = self.messages[msg_key]
         if repeat_count > 1:
-            self.messages[msg_key] = (current_time, repeat_count-1, msg_pmt)
+            self.schedule_message(msg_key, current_time, repeat_count-1, msg_pmt, airtime_ns)
         else:
             del self.messages[msg_key]
+            if msg_key[0] == 'scene':
+                for (key, _, _) in msg_pmt:
+                    if self.scene_keys.get(key) == msg_key:
+                        del self.scene_keys[key]
+        if msg_key[0] == 'scene':
+            self.scene_pass.extend(msg_pmt)
+            (_, msg_pmt, airtime_ns) = self.scene_pass.popleft()
+        self.send(current_time, msg_pmt, airtime_ns)
+    def send(self, current_time, msg_pmt, airtime_ns):
+        self.backlog_ns -= airtime_ns
+        self.last_send_time = current_time
+        self.channel_free_time = current_time + int(airtime_ns / self.airtime_budget)
+        self.stats_packets += 1
+        self.stats_airtime_ns += airtime_ns
+        self.metrics.count('messages_out')
+        self.metrics.gauge('pending', len(self.messages))
+        self.metrics.gauge('backlog_seconds', self.backlog_ns / 1e9)
         self.message_port_pub(self.outPortName, msg_pmt)
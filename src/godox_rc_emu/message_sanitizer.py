@@ -2,21 +2,37 @@ import numpy as np
 from gnuradio import gr
 import pmt
 
-def update_checksum(checksum, content, xor_values):
-    current_bit = 1
-    for xor_value in xor_values:
-        if content & current_bit:
-            checksum ^= xor_value
-        current_bit <<= 1
-    return checksum
+from .core.fade import shared_fader
+from .core.frame import pack_frame
+from .core.sanitize import sanitize_message, sanitize_scene, scene_lights
+from .core.timing import frame_airtime
+from .metrics import make_metrics
 
 class message_sanitizer(gr.sync_block):
     """
     Transform dictionary-style messages to ensure that values can be
     represented in binary form, and add a checksum.
+
+    A message of the form {'scene': lights}, with lights a list of messages (or a dict of them, keyed by any label),
+    is sanitized in one pass and sent on as a single {'scene': [...]} message, which the muxer sends as a unit. If
+    it also has a 'name', the sanitized scene is kept, and can be sent again with {'recall': name}; with
+    'store_only' set, it is only kept, not sent.
+
+    If fade_time is nonzero, a light already sent a state fades to each new one over that many seconds (a message's
+    own 'fade_time' overrides it), rather than jumping there. Only as many intermediate states are sent as the air can
+    carry, at one every fade_step_frames times repeat_count frames' airtime per fading light (repeat_count being the
+    number of times the muxer sends each state, so set it to match the muxer's), and those still to come are abandoned
+    whenever a new target arrives, so a slider moved continuously produces a steady trickle of updates rather than a
+    queue of stale ones. Lights fading in every sanitizer in the flowgraph share the air between them.
+
+    A message's 'ack_id' (as added by the Control Source) is passed on with the message or scene it produces, for the
+    muxer to echo in its ack.
+
+    If stats_interval is nonzero, metrics are published on the stats port at most that often (seconds).
     """
     def __init__(self, validate_incoming_checksum=True, maintain_state=False, send_on_update=True,
-            default_group=1, default_chan=0, default_brightness=25, default_color=24):
+            default_group=1, default_chan=0, default_brightness=25, default_color=24, stats_interval=0.0,
+            fade_time=0.0, fade_step_frames=1.0, repeat_count=5):
         gr.sync_block.__init__(
             self,
             name='Godox Message Sanitizer',
@@ -29,6 +45,10 @@ class message_sanitizer(gr.sync_block):
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
         self.set_msg_handler(self.inPortName, self.handle_msg)
         self.validate_incoming_checksum = validate_incoming_checksum
         self.maintain_state = maintain_state
@@ -40,6 +60,17 @@ class message_sanitizer(gr.sync_block):
             'brightness': default_brightness,
             'color': default_color,
         }
+        # map from scene name to the sanitized scene's lights
+        self.scenes = {}
+        self.fade_time = fade_time
+        self.fade_step_frames = fade_step_frames
+        self.repeat_count = repeat_count
+        # map from (group, chan) to the state most recently sent to that light
+        self.sent = {}
+
+    def stop(self):
+        shared_fader.cancel_all(self.publish_state)
+        return True
 
     def set_chan(self, chan):
         self.defaults['chan'] = chan
@@ -53,69 +84,79 @@ class message_sanitizer(gr.sync_block):
         self.defaults['brightness'] = brightness
         if self.send_on_update:
             self.handle_msg(None)
+    def set_fade_time(self, fade_time):
+        self.fade_time = fade_time
 
     def warn(self, s):
+        self.metrics.count('warnings')
         self.message_port_pub(self.debugPortName, pmt.to_pmt(s))
 
-    def handle_msg(self, msg_in_pmt):
-        checksum = 0
-        if msg_in_pmt is None:
-            msg_in = {}
+    def publish_state(self, msg):
+        self.sent[(msg['group'], msg['chan'])] = msg
+        self.message_port_pub(self.outPortName, pmt.to_pmt(msg))
+        self.metrics.count('messages_out')
+
+    def step_time(self, msg):
+        # each state is sent repeat_count times; a step sooner than that would replace one still being repeated
+        return self.fade_step_frames * self.repeat_count * frame_airtime(pack_frame(msg))
+
+    def send(self, msg, fade_time):
+        key = (msg['group'], msg['chan'])
+        start = self.sent.get(key)
+        if fade_time and start is not None:
+            self.metrics.count('fades')
+            shared_fader.fade(key, start, msg, fade_time, self.step_time, self.publish_state)
         else:
-            msg_in = pmt.to_python(msg_in_pmt)
-        if not isinstance(msg_in, dict):
-            if isinstance(msg_in, tuple):
-                try:
-                    msg_in = dict(msg_in)
-                except ValueError as e:
-                    self.warn(f'Received message in tuple form that could not be converted to a dict: {msg_in!r}: {e}')
-                    return
-            else:
-                self.warn(f'Ignoring message which is not in either dict or tuple form')
+            shared_fader.cancel(key)
+            self.publish_state(msg)
+
+    def handle_scene(self, msg_in):
+        ack_id = msg_in.pop('ack_id', None)
+        if 'recall' in msg_in:
+            lights = self.scenes.get(msg_in['recall'])
+            if lights is None:
+                self.warn(f'No scene named {msg_in["recall"]!r} has been stored')
                 return
-        group = msg_in.pop('group', self.defaults['group'])
-        if group < 0 or group > 15:
-            self.warn(f'Invalid group {group!r}')
-            group = self.defaults['group']
-        checksum = update_checksum(checksum, group, [110, 220, 137, 35])
-        chan = msg_in.pop('chan', self.defaults['chan'])
-        if chan < 0 or chan > 15:
-            self.warn(f'Invalid channel {chan!r}')
-            chan = self.defaults['chan']
-        checksum = update_checksum(checksum, chan, [244, 217, 131, 55])
-        brightness = msg_in.pop('brightness', self.defaults['brightness'])
-        if brightness < 0:
-            self.warn(f'Coercing negative brightness {brightness!r} to 0')
-            brightness = 0
-        elif brightness > 127:
-            brightness = 127 # we don't know how the 8th bit goes into the checksum
-        checksum = update_checksum(checksum, brightness, [49, 98, 196, 185, 67, 134, 61])
-        cmd = msg_in.pop('cmd', 0)
-        if cmd < 0:
-            self.warn(f'Coercing negative command {cmd!r} to 0')
-            cmd = 0
-        elif cmd > 3:
-            self.warn(f'Coercing invalid command {cmd!r} to 0')
-            cmd = 0
-        # default is daylight temp; bicolor lights support largest brightness range here
-        color = msg_in.pop('color', self.defaults['color'])
-        if color < 0:
-            self.warn(f'Coercing negative color {color!r} to 0')
-            color = 0
-        elif color > 63:
-            self.warn(f'Coercing invalid color {color!r} to 24')
-            color = 63
-        orig_cksum = msg_in.pop('cksum', None)
-        msg_out = {
-            'brightness': brightness,
-            'chan': chan,
-            'cksum': checksum,
-            'cmd': cmd,
-            'color': color,
-            'group': group,
-        }
-        if self.maintain_state:
-            self.defaults = msg_out
-        if self.validate_incoming_checksum and orig_cksum is not None and orig_cksum != checksum:
-            self.warn(f'Calculated checksum {checksum!r} for message {msg_out!r}, but originally had checksum {orig_cksum!r}')
-        self.message_port_pub(self.outPortName, pmt.to_pmt(msg_out))
+        else:
+            lights = sanitize_scene(scene_lights(msg_in['scene']), self.defaults, self.warn,
+                self.validate_incoming_checksum)
+            if not lights:
+                return
+            if 'name' in msg_in:
+                self.scenes[msg_in['name']] = lights
+            if msg_in.get('store_only'):
+                return
+        # a scene is sent as it stands, ending any fades of its lights
+        for light in lights:
+            key = (light['group'], light['chan'])
+            shared_fader.cancel(key)
+            self.sent[key] = light
+        scene = {'scene': lights}
+        if ack_id is not None:
+            scene['ack_id'] = ack_id
+        self.message_port_pub(self.outPortName, pmt.to_pmt(scene))
+        self.metrics.count('messages_out')
+
+    def handle_msg(self, msg_in_pmt):
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
+        msg_in = {} if msg_in_pmt is None else pmt.to_python(msg_in_pmt)
+        if isinstance(msg_in, dict) and ('scene' in msg_in or 'recall' in msg_in):
+            self.handle_scene(msg_in)
+            self.metrics.elapsed('handle_msg', started)
+            self.metrics.poll()
+            return
+        fade_time = msg_in.pop('fade_time', self.fade_time) if isinstance(msg_in, dict) else self.fade_time
+        ack_id = msg_in.pop('ack_id', None) if isinstance(msg_in, dict) else None
+        msg_out = sanitize_message(msg_in, self.defaults, self.warn, self.validate_incoming_checksum)
+        if msg_out is None:
+            self.metrics.count('messages_dropped')
+        else:
+            if self.maintain_state:
+                # a copy, as the setters change defaults in place, and msg_out is kept as the state sent
+                self.defaults = dict(msg_out)
+            if ack_id is not None:
+                msg_out['ack_id'] = ack_id
+            self.send(msg_out, fade_time)
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
@@ -2,13 +2,21 @@ import numpy as np
 from gnuradio import gr
 import pmt
 
+from .core.frame import message_to_bits
+from .metrics import make_metrics
+from .pmt_wire import bits_to_pmt
+
 class message_to_bitfield(gr.sync_block):
     """Given a stream of dicts with group, chan, brightness, cmd and color keys, generate a stream of uint8 vecs, each with a 0 or 1, indicating a high or low bit.
 
     If the input contains a cksum field, discard any messages where we calculate a different checksum. If it does not, calculate and use our own checksum.
+
+    With compact_output set, each bitfield is sent as a u8vector rather than a list.
+
+    If stats_interval is nonzero, metrics are published on the stats port at most that often (seconds).
     """
 
-    def __init__(self):
+    def __init__(self, compact_output=False, stats_interval=0.0):
         gr.sync_block.__init__(
             self,
             name='Godox Message->Bitfield',
@@ -21,6 +29,10 @@ class message_to_bitfield(gr.sync_block):
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
         self.set_msg_handler(self.inPortName, self.handle_msg)
 
         self.group_field = pmt.intern('group')
@@ -29,24 +41,16 @@ class message_to_bitfield(gr.sync_block):
         self.cmd_field = pmt.intern('cmd')
         self.color_field = pmt.intern('color')
         self.cksum_field = pmt.intern('cksum')
-
-        self.fmt = [
-            # name, bit count, default
-            (pmt.intern('group'), 4, pmt.to_pmt(1)),
-            (pmt.intern('chan'), 4, pmt.to_pmt(0)),
-            (pmt.intern('brightness'), 8, pmt.to_pmt(25)),
-            (pmt.intern('cmd'), 2, pmt.to_pmt(0)),
-            (pmt.intern('color'), 6, pmt.to_pmt(1)),
-            (pmt.intern('cksum'), 8, pmt.PMT_NIL),
-        ]
+        self.compact_output = compact_output
 
     def handle_msg(self, msg_pmt):
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
         if not pmt.is_dict(msg_pmt):
+            self.metrics.count('messages_dropped')
             self.message_port_pub(self.debugPortName, pmt.to_pmt(f'Expected a dict, got: {msg_pmt!r}'))
-            return
-        out_str = ''
-        for (field_name_pmt, field_size, field_default) in self.fmt:
-            field_val = pmt.to_python(pmt.dict_ref(msg_pmt, field_name_pmt, field_default))
-            out_str += bin(field_val).lstrip('0b').zfill(field_size)
-        out_str += '0' # all messages end with a trailing 0 as the 33rd bit
-        self.message_port_pub(self.outPortName, pmt.to_pmt([1 if c == '1' else 0 for c in out_str]))
+        else:
+            self.message_port_pub(self.outPortName, bits_to_pmt(message_to_bits(pmt.to_python(msg_pmt)), self.compact_output))
+            self.metrics.count('messages_out')
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
@@ -0,0 +1,94 @@
+import numpy as np
+import pmt
+
+from .core.sanitize import sanitize_message, sanitize_scene, scene_lights
+from .timings_to_ookfloat import timings_to_ookfloat
+
+class message_to_ookfloat(timings_to_ookfloat):
+    """Sanitize dictionary-style messages and render them directly to a stream of OOK samples.
+
+    Does the work of the Message Sanitizer, Message->Bitfield, Bitfield->Timings and Timings -> OOK blocks in a single
+    message handler, with no PMT conversions or message queue hand-offs in between; the frame is packed with integer
+    shifts and rendered (or fetched from the waveform cache) straight from the packed value. The separate blocks
+    remain available for debugging the individual stages.
+
+    Scene messages are handled as by the Message Sanitizer, with every light in a scene rendered into one burst,
+    so that nothing else is sent between them; named scenes are kept already rendered.
+    """
+    block_name = 'Godox Message -> OOK'
+
+    def __init__(self, sample_rate=1, true_value=1, false_value=0, idle_value=0, sep_time=1e-3, sep_value=0.0,
+            max_queue=32, queue_policy='drop_oldest',
+            hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4, use_cache=True,
+            burst_mode=False, tx_time_lead=0.0, output_type='float', freq_offset=0.0, amplitude=1.0,
+            stats_interval=0.0, validate_incoming_checksum=True, maintain_state=False, send_on_update=True,
+            default_group=1, default_chan=0, default_brightness=25, default_color=24):
+        timings_to_ookfloat.__init__(self, sample_rate=sample_rate, true_value=true_value, false_value=false_value,
+            idle_value=idle_value, sep_time=sep_time, sep_value=sep_value, max_queue=max_queue,
+            queue_policy=queue_policy, hello_time=hello_time, bit_low_time=bit_low_time,
+            bit_high_time=bit_high_time, bit_sep_time=bit_sep_time, use_cache=use_cache,
+            burst_mode=burst_mode, tx_time_lead=tx_time_lead, output_type=output_type, freq_offset=freq_offset,
+            amplitude=amplitude, stats_interval=stats_interval)
+        self.validate_incoming_checksum = validate_incoming_checksum
+        self.maintain_state = maintain_state
+        self.send_on_update = send_on_update
+        # below will be updated iif maintain_state is True
+        self.defaults = {
+            'group': default_group,
+            'chan': default_chan,
+            'brightness': default_brightness,
+            'color': default_color,
+        }
+        # map from scene name to the scene's rendered burst
+        self.scenes = {}
+
+    def set_chan(self, chan):
+        self.defaults['chan'] = chan
+    def set_group(self, group):
+        self.defaults['group'] = group
+    def set_color(self, color):
+        self.defaults['color'] = color
+        if self.send_on_update:
+            self.handle_msg(None)
+    def set_brightness(self, brightness):
+        self.defaults['brightness'] = brightness
+        if self.send_on_update:
+            self.handle_msg(None)
+
+    def warn(self, s):
+        self.metrics.count('warnings')
+        self.message_port_pub(self.debugPortName, pmt.to_pmt(s))
+
+    def handle_scene(self, msg_in):
+        if 'recall' in msg_in:
+            burst = self.scenes.get(msg_in['recall'])
+            if burst is None:
+                self.warn(f'No scene named {msg_in["recall"]!r} has been stored')
+                return
+        else:
+            lights = sanitize_scene(scene_lights(msg_in['scene']), self.defaults, self.warn, self.validate_incoming_checksum)
+            if not lights:
+                return
+            burst = np.concatenate([self.cached_render_message(light) for light in lights])
+            if 'name' in msg_in:
+                self.scenes[msg_in['name']] = burst
+            if msg_in.get('store_only'):
+                return
+        self.enqueue(burst)
+
+    def handle_msg(self, msg_in_pmt):
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
+        msg_in = {} if msg_in_pmt is None else pmt.to_python(msg_in_pmt)
+        if isinstance(msg_in, dict) and ('scene' in msg_in or 'recall' in msg_in):
+            self.handle_scene(msg_in)
+            self.metrics.elapsed('handle_msg', started)
+            return
+        msg_out = sanitize_message(msg_in, self.defaults, self.warn, self.validate_incoming_checksum)
+        if msg_out is None:
+            self.metrics.count('messages_dropped')
+            return
+        if self.maintain_state:
+            self.defaults = msg_out
+        self.enqueue(self.cached_render_message(msg_out))
+        self.metrics.elapsed('handle_msg', started)
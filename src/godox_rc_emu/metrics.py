@@ -0,0 +1,154 @@
+import bisect
+import os
+import tempfile
+import threading
+import time
+
+# Upper bounds (seconds) of the timing histogram buckets: 1us to ~1s in powers of two, plus +Inf
+HISTOGRAM_BOUNDS = [1e-6 * 2 ** n for n in range(21)] + [float('inf')]
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BOUNDS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(self.counts)}
+
+class Metrics:
+    """Counters, gauges and timing histograms for one block.
+
+    Counters and histograms are cumulative over the life of the block. poll() calls publish with a snapshot at most
+    once every interval seconds; blocks call it from their message handlers or work(), so a block that sees no
+    traffic publishes nothing.
+
+    name may be a callable, such as a block's alias method, since GRC only sets a block's alias after creating it.
+    Safe to use from several threads at once, as a block's message handlers and work() run on different threads.
+    """
+    enabled = True
+
+    def __init__(self, name, interval=1.0, publish=None):
+        self.name = name
+        self.interval = interval
+        self.publish = publish
+        self.next_publish = time.monotonic() + interval
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # guards the counters, gauges and histograms, whose updates are read-modify-writes
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def clock(self):
+        return time.perf_counter()
+
+    def elapsed(self, name, started):
+        """Record the time since started, a value returned by clock(), in the histogram called name."""
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(elapsed)
+
+    def snapshot(self):
+        block = self.name() if callable(self.name) else self.name
+        with self.lock:
+            return {
+                'block': block,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: histogram.snapshot() for (name, histogram) in self.histograms.items()},
+            }
+
+    def poll(self):
+        if self.publish is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_publish:
+                return
+            self.next_publish = now + self.interval
+        # published outside the lock, as publishing may take a while, or call back into the block
+        self.publish(self.snapshot())
+
+class NullMetrics:
+    """Stands in for Metrics when metrics are turned off; every method does nothing."""
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+    def gauge(self, name, value):
+        pass
+    def clock(self):
+        return 0.0
+    def elapsed(self, name, started):
+        pass
+    def poll(self):
+        pass
+
+null_metrics = NullMetrics()
+
+def make_metrics(name, interval, publish=None):
+    """Return a Metrics publishing through publish every interval seconds, or null_metrics if interval is 0."""
+    if not interval:
+        return null_metrics
+    return Metrics(name, interval, publish)
+
+def prometheus_text(snapshots, prefix='godox'):
+    """Render Metrics snapshots in the Prometheus text exposition format, labelled by block name."""
+    counters = {}
+    gauges = {}
+    histograms = {}
+    for snapshot in snapshots:
+        label = str(snapshot['block']).replace('\\', '\\\\').replace('"', '\\"')
+        for (name, value) in snapshot['counters'].items():
+            counters.setdefault(name, []).append((label, value))
+        for (name, value) in snapshot['gauges'].items():
+            gauges.setdefault(name, []).append((label, value))
+        for (name, value) in snapshot['histograms'].items():
+            histograms.setdefault(name, []).append((label, value))
+    lines = []
+    for (name, samples) in sorted(counters.items()):
+        lines.append(f'# TYPE {prefix}_{name}_total counter')
+        lines.extend(f'{prefix}_{name}_total{{block="{label}"}} {value}' for (label, value) in samples)
+    for (name, samples) in sorted(gauges.items()):
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        lines.extend(f'{prefix}_{name}{{block="{label}"}} {value}' for (label, value) in samples)
+    for (name, samples) in sorted(histograms.items()):
+        lines.append(f'# TYPE {prefix}_{name}_seconds histogram')
+        for (label, histogram) in samples:
+            cumulative = 0
+            for (bound, count) in zip(HISTOGRAM_BOUNDS, histogram['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:.9g}'
+                lines.append(f'{prefix}_{name}_seconds_bucket{{block="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_seconds_sum{{block="{label}"}} {histogram["sum"]}')
+            lines.append(f'{prefix}_{name}_seconds_count{{block="{label}"}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path, snapshots, prefix='godox'):
+    """Write prometheus_text() to path atomically, as node_exporter's textfile collector expects."""
+    directory = os.path.dirname(os.path.abspath(path))
+    (fd, tmp_path) = tempfile.mkstemp(dir=directory, prefix='.godox-metrics-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(prometheus_text(snapshots, prefix))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,48 @@
+import time
+
+import pmt
+from gnuradio import gr
+
+from .metrics import write_prometheus
+
+class metrics_exporter(gr.sync_block):
+    """Write the metrics published on other blocks' stats ports to a Prometheus text file.
+
+    Connect any number of stats ports to the input. The latest snapshot from each block is kept, and the file is
+    rewritten (atomically, for node_exporter's textfile collector) at most every interval seconds, and when the
+    flowgraph stops.
+    """
+    def __init__(self, path='godox_rc_emu.prom', interval=10.0):
+        gr.sync_block.__init__(
+            self,
+            name='Godox Metrics Exporter',
+            in_sig=None,
+            out_sig=None,
+        )
+        self.inPortName = pmt.intern('in')
+        self.message_port_register_in(self.inPortName)
+        self.set_msg_handler(self.inPortName, self.handle_msg)
+
+        self.path = path
+        self.interval = interval
+        self.next_write = 0.0
+        # map from block name to its most recent snapshot
+        self.snapshots = {}
+
+    def handle_msg(self, msg_pmt):
+        snapshot = pmt.to_python(msg_pmt)
+        # the muxer's stats carry its metrics alongside its per-interval figures
+        if 'counters' not in snapshot:
+            snapshot = snapshot.get('metrics')
+            if snapshot is None:
+                return
+        self.snapshots[snapshot['block']] = snapshot
+        now = time.monotonic()
+        if now >= self.next_write:
+            self.next_write = now + self.interval
+            write_prometheus(self.path, self.snapshots.values())
+
+    def stop(self):
+        if self.snapshots:
+            write_prometheus(self.path, self.snapshots.values())
+        return True
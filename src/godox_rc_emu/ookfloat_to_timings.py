@@ -2,6 +2,9 @@ import numpy as np
 import pmt
 from gnuradio import gr
 
+from .metrics import make_metrics
+from .pmt_wire import timings_to_pmt
+
 class ookfloat_to_timings(gr.sync_block):
     """Given data with tags indicating regions of interest, and rising/falling edges within those regions, analyze for content
 
@@ -10,9 +13,13 @@ class ookfloat_to_timings(gr.sync_block):
     edge_tag: Tag that indicates rising/falling edges; only relevant within a packet
 
     Whenever a packet_tag of False is seen, dumps all the edge timings collected prior to that point, as a tuple of (bool, float) pairs
+
+    compact_output: If True, dump each packet as a pair of a u8vector of levels and an f32vector of durations instead
+
+    stats_interval: If nonzero, publish metrics on the stats port at most this often (seconds)
     """
 
-    def __init__(self, sample_rate=1, packet_tag='packet', edge_tag='edge'):
+    def __init__(self, sample_rate=1, packet_tag='packet', edge_tag='edge', compact_output=False, stats_interval=0.0):
         gr.sync_block.__init__(
             self,
             name='OOK Timing Detector',   # will show up in GRC
@@ -23,11 +30,16 @@ class ookfloat_to_timings(gr.sync_block):
         self.debugPortName = pmt.intern('debug')
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
 
         # Used to change offset to timestamp; setting to 1 keeps an offset
         self.sample_rate = sample_rate
         self.packet_tag = pmt.intern(packet_tag)
         self.edge_tag = pmt.intern(edge_tag)
+        self.compact_output = compact_output
 
         self.in_packet = False
         self.packet_content = None
@@ -37,7 +49,16 @@ class ookfloat_to_timings(gr.sync_block):
         # When non-None, this should be the offset of when the current_state was asserted
         self.state_start_time = None
 
+    def publish_packet(self, packet):
+        if self.compact_output:
+            levels = [state for (state, _) in packet]
+            durations = [duration for (_, duration) in packet]
+            self.message_port_pub(self.outPortName, timings_to_pmt(levels, durations, compact=True))
+        else:
+            self.message_port_pub(self.outPortName, pmt.to_pmt(packet))
+
     def work(self, input_items, output_items):
+        started = self.metrics.clock()
         in0 = input_items[0]
         tags = self.get_tags_in_window(0, 0, len(in0))
         for tag in tags:
@@ -54,7 +75,8 @@ class ookfloat_to_timings(gr.sync_block):
                 elif tag.value is pmt.PMT_F:
                     if self.packet_content is not None:
                         # Send our accumulated packet
-                        self.message_port_pub(self.outPortName, pmt.to_pmt(self.packet_content))
+                        self.publish_packet(self.packet_content)
+                        self.metrics.count('messages_out')
                     # Reset state
                     self.state_start_time = self.current_state = self.packet_content = None
                     self.in_packet = False
@@ -78,4 +100,7 @@ class ookfloat_to_timings(gr.sync_block):
                 self.state_start_time = tag.offset
                 self.current_state = tag.value
         self.consume(0, len(in0))
+        self.metrics.count('samples_in', len(in0))
+        self.metrics.elapsed('work', started)
+        self.metrics.poll()
         return 0
@@ -0,0 +1,61 @@
+import numpy as np
+import pmt
+from gnuradio import gr
+
+from .core.edges import EdgeExtractor
+from .metrics import make_metrics
+from .pmt_wire import timings_to_pmt
+
+class ookmag_to_timings(gr.sync_block):
+    """Given a float magnitude stream, find OOK packets and emit the timings of the edges within each.
+
+    Does the job of the threshold / burst tagger chain and OOK Timing Detector without stream tags: edges are found
+    with a hysteresis threshold between threshold_low and threshold_high, and a packet ends once the signal has been
+    low for gap_time seconds.
+
+    sample_rate: Number of samples per second, used to transform offsets to times; if 1, time field will have offsets
+    gap_time: How long the signal must stay low to end a packet; in samples if sample_rate is 1
+    compact_output: If True, emit each packet as a pair of a u8vector of levels and an f32vector of durations
+    stats_interval: If nonzero, publish metrics on the stats port at most this often (seconds)
+
+    Emits each packet as a sequence of (bool, float) pairs, in the same form as OOK Timing Detector.
+    """
+
+    def __init__(self, sample_rate=1, threshold_low=0.02, threshold_high=0.04, gap_time=5e-3, compact_output=False, stats_interval=0.0):
+        gr.sync_block.__init__(
+            self,
+            name='OOK Magnitude -> Timings',
+            in_sig=[np.float32],
+            out_sig=None
+        )
+        self.outPortName = pmt.intern('out')
+        self.debugPortName = pmt.intern('debug')
+        self.message_port_register_out(self.outPortName)
+        self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
+
+        self.sample_rate = sample_rate
+        self.compact_output = compact_output
+        self.extractor = EdgeExtractor(threshold_low, threshold_high, max(1, int(gap_time * sample_rate)))
+
+    def work(self, input_items, output_items):
+        started = self.metrics.clock()
+        in0 = input_items[0]
+        for packet in self.extractor.process(in0):
+            if self.compact_output:
+                levels = np.fromiter((state for (state, _) in packet), dtype=np.uint8, count=len(packet))
+                durations = np.fromiter((duration for (_, duration) in packet), dtype=np.float64, count=len(packet)) / self.sample_rate
+                self.message_port_pub(self.outPortName, timings_to_pmt(levels, durations, compact=True))
+            else:
+                if self.sample_rate != 1:
+                    packet = [(state, float(duration) / self.sample_rate) for (state, duration) in packet]
+                self.message_port_pub(self.outPortName, pmt.to_pmt(packet))
+            self.metrics.count('messages_out')
+        self.consume(0, len(in0))
+        self.metrics.count('samples_in', len(in0))
+        self.metrics.elapsed('work', started)
+        self.metrics.poll()
+        return 0
@@ -0,0 +1,61 @@
+import numpy as np
+import pmt
+
+# Conversions between the PMT forms in which bitfields and timings travel between blocks, and numpy arrays.
+#
+# Bitfields are a list of 0/1 values, a string of '0's and '1's, or (compact) a u8vector; an integer is taken as a
+# packed 33-bit frame. Timings are a list of (bool, float) pairs, or (compact) a pair of a u8vector of levels and
+# an f32vector of durations, or a dict with those under 'levels' and 'durations'. Every block accepts any of these,
+# and emits the compact forms when its compact_output option is set; these are built and read as whole arrays
+# rather than element by element.
+
+def bits_to_pmt(bits, compact=False):
+    if compact:
+        return pmt.to_pmt(np.asarray(bits, dtype=np.uint8))
+    return pmt.to_pmt([int(bit) for bit in bits])
+
+def pmt_to_bits(msg_pmt):
+    """Return the bits of a bitfield message, in any of its forms, as a uint8 array.
+
+    Raises ValueError for a string with any character other than 0 and 1, as bitfield_to_message rejects.
+    """
+    msg = pmt.to_python(msg_pmt)
+    if isinstance(msg, (int, np.integer)) and not isinstance(msg, bool):
+        msg = int(msg)
+        return np.array([(msg >> shift) & 1 for shift in range(32, -1, -1)], dtype=np.uint8)
+    if isinstance(msg, bytes):
+        msg = msg.decode('ascii', errors='replace')
+    if isinstance(msg, str):
+        if msg.strip('01'):
+            raise ValueError(f'Value with characters other than 0 and 1 seen: {msg!r}')
+        return (np.frombuffer(msg.encode('ascii'), dtype=np.uint8) == ord('1')).astype(np.uint8)
+    return np.asarray(msg, dtype=np.uint8)
+
+def timings_to_pmt(levels, durations, compact=False):
+    if compact:
+        return pmt.cons(pmt.to_pmt(np.asarray(levels, dtype=np.uint8)),
+            pmt.to_pmt(np.asarray(durations, dtype=np.float32)))
+    return pmt.to_pmt([(bool(level), float(duration)) for (level, duration) in zip(levels, durations)])
+
+levels_key = pmt.intern('levels')
+durations_key = pmt.intern('durations')
+
+def is_compact_timings(msg_pmt):
+    # a PMT pair also passes pmt.is_dict(), so the pair form must be checked for first
+    if pmt.is_pair(msg_pmt) and pmt.is_u8vector(pmt.car(msg_pmt)):
+        return True
+    return pmt.is_dict(msg_pmt) and pmt.dict_has_key(msg_pmt, levels_key)
+
+def pmt_to_timings(msg_pmt):
+    """Return the (levels, durations) of a timings message, in any of its forms, as bool and float64 arrays."""
+    if not is_compact_timings(msg_pmt):
+        msg = pmt.to_python(msg_pmt)
+        levels = np.fromiter((bool(level) for (level, _) in msg), dtype=bool, count=len(msg))
+        durations = np.fromiter((duration for (_, duration) in msg), dtype=np.float64, count=len(msg))
+        return (levels, durations)
+    if pmt.is_pair(msg_pmt) and pmt.is_u8vector(pmt.car(msg_pmt)):
+        (levels, durations) = (pmt.car(msg_pmt), pmt.cdr(msg_pmt))
+    else:
+        levels = pmt.dict_ref(msg_pmt, levels_key, pmt.PMT_NIL)
+        durations = pmt.dict_ref(msg_pmt, durations_key, pmt.PMT_NIL)
+    return (np.asarray(pmt.to_python(levels), dtype=bool), np.asarray(pmt.to_python(durations), dtype=np.float64))
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pmt
+from gnuradio import gr
+
+from .core.state_cache import StateCache
+from .metrics import make_metrics
+
+class state_cache(gr.sync_block):
+    """Drop sanitized messages which would only resend a light the state it was sent moments ago.
+
+    Sits between the Message Sanitizer and the Message Muxer. A message whose light was last sent the same
+    brightness, color and command less than freshness seconds ago is dropped; a scene is dropped only if every one of
+    its lights would be. If refresh_interval is nonzero, each light's last state is sent again once that many seconds
+    have passed without it being sent, so lights that missed it (or were switched on since) catch up. Any message
+    on the refresh port sends the cached states at once: all of them, or only those matching the group and/or chan
+    it gives.
+
+    Cache hits (lights whose state, sent within freshness, was not resent), expired entries (the same state, sent
+    longer ago), hits resent (unchanged lights in a scene sent for its other lights), misses and suppressed messages
+    are counted in the metrics published on the stats port.
+    """
+    def __init__(self, freshness=10.0, refresh_interval=0.0, stats_interval=0.0):
+        gr.sync_block.__init__(
+            self,
+            name='Godox State Cache',
+            in_sig=None,
+            out_sig=None,
+        )
+        self.inPortName = pmt.intern('in')
+        self.refreshPortName = pmt.intern('refresh')
+        self.outPortName = pmt.intern('out')
+        self.message_port_register_in(self.inPortName)
+        self.message_port_register_in(self.refreshPortName)
+        self.message_port_register_out(self.outPortName)
+        self.set_msg_handler(self.inPortName, self.handle_msg)
+        self.set_msg_handler(self.refreshPortName, self.handle_refresh)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
+
+        self.cache = StateCache(freshness, refresh_interval)
+        # guards the cache, as the refresh thread and message handlers may run at once
+        self.condition = threading.Condition()
+        self.refresh_thread = None
+        self.stopping = False
+
+    def start(self):
+        if self.cache.refresh_interval:
+            self.stopping = False
+            self.refresh_thread = threading.Thread(target=self.run_refresh, name='godox-state-refresh', daemon=True)
+            self.refresh_thread.start()
+        return True
+
+    def stop(self):
+        if self.refresh_thread is not None:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify()
+            self.refresh_thread.join()
+            self.refresh_thread = None
+        return True
+
+    def set_freshness(self, freshness):
+        with self.condition:
+            self.cache.freshness = freshness
+
+    def run_refresh(self):
+        with self.condition:
+            while not self.stopping:
+                for state in self.cache.due(time.monotonic()):
+                    self.publish(state)
+                    self.metrics.count('refreshed')
+                wakeup_time = self.cache.next_refresh_time()
+                self.condition.wait(None if wakeup_time is None else max(0.0, wakeup_time - time.monotonic()))
+
+    def publish(self, msg):
+        self.message_port_pub(self.outPortName, pmt.to_pmt(msg))
+        self.metrics.count('messages_out')
+
+    def count_results(self, results, suppressed):
+        # only lights whose resending was suppressed count as hits; the rest were passed on, and count apart
+        names = {'hit': 'cache_hits' if suppressed else 'cache_hits_resent', 'expired': 'cache_expired'}
+        for result in results:
+            self.metrics.count(names.get(result, 'cache_misses'))
+
+    def handle_msg(self, msg_pmt):
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
+        msg = pmt.to_python(msg_pmt)
+        now = time.monotonic()
+        with self.condition:
+            if 'scene' in msg:
+                results = self.cache.offer_scene(msg['scene'], now)
+                suppressed = bool(results) and all(result == 'hit' for result in results)
+            else:
+                results = [self.cache.offer(msg, now)]
+                suppressed = results[0] == 'hit'
+            self.count_results(results, suppressed)
+            if suppressed:
+                self.metrics.count('suppressed')
+            else:
+                self.message_port_pub(self.outPortName, msg_pmt)
+                self.metrics.count('messages_out')
+            self.metrics.gauge('lights', len(self.cache.states))
+            # a new light may be due for refreshing before any already known
+            self.condition.notify()
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
+
+    def handle_refresh(self, msg_pmt):
+        msg = pmt.to_python(msg_pmt)
+        if not isinstance(msg, dict):
+            msg = {}
+        with self.condition:
+            for state in self.cache.refresh(time.monotonic(), msg.get('group'), msg.get('chan')):
+                self.publish(state)
+                self.metrics.count('refreshed')
+        self.metrics.poll()
@@ -2,14 +2,26 @@ import numpy as np
 import pmt
 from gnuradio import gr
 
+from .core.timing import TimingRecovery, decode_timings
+from .metrics import make_metrics
+from .pmt_wire import bits_to_pmt, pmt_to_timings
+
 class timings_to_bitfield(gr.sync_block):
     """Given a sequence of messages containing locations of rising and falling edges within a packet, try to decode that packet.
+
+    Timings may be given in any of the forms described in pmt_wire.
+
+    With adaptive set, each frame's timing is estimated from the frame itself (see core.timing.TimingRecovery),
+    so transmitters whose clocks run fast or slow, or receivers which smear pulses, still decode with the usual
+    windows; a report of each frame's confidence and estimated timing is published on the confidence port.
     """
 
     def __init__(self,
             # if True, we emit a string composed of '0's and '1's
             # if False, we emit a vector of uint8s, each of which is a 0 or 1
             textual_output=False,
+            # if True (and textual_output is False), that vector is a u8vector rather than a list
+            compact_output=False,
             # should we ignore or queue partial messages?
             forward_partial=False,
             # How long should we see a high signal to start a message? Typical value 11e5-4
@@ -22,7 +34,13 @@ class timings_to_bitfield(gr.sync_block):
             high_max=14e-4,
             # How long of a high signal can separate bits within a message? Typical value 7e-4
             sep_min=6e-4,
-            sep_max=8e-4):
+            sep_max=8e-4,
+            # if True, estimate each frame's timing scale and offset before classifying its pulses
+            adaptive=False,
+            # how quickly the per-transmitter timing estimates follow each new frame (0 to 1)
+            adaptation_rate=0.1,
+            # If nonzero, publish metrics on the stats port at most this often (seconds)
+            stats_interval=0.0):
         gr.sync_block.__init__(
             self,
             name='Godox Timings -> Bitfield',   # will show up in GRC
@@ -37,32 +55,65 @@ class timings_to_bitfield(gr.sync_block):
         self.sep_min = sep_min
         self.sep_max = sep_max
         self.textual_output = textual_output
+        self.compact_output = compact_output
         self.forward_partial = forward_partial
+        self.recovery = TimingRecovery(hello_min, hello_max, low_min, low_max, high_max, sep_min, sep_max,
+            adaptation_rate) if adaptive else None
 
         self.inPortName = pmt.intern('in')
         self.outPortName = pmt.intern('out')
         self.debugPortName = pmt.intern('debug')
+        self.confidencePortName = pmt.intern('confidence')
 
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.outPortName)
         self.message_port_register_out(self.debugPortName)
+        self.message_port_register_out(self.confidencePortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
 
         self.set_msg_handler(self.inPortName, self.handle_msg)
 
-    def send_now(self, content, partial=None, with_warning=None):
-        if partial is None:
-            partial = with_warning is not None
-        if with_warning:
-            self.message_port_pub(self.debugPortName, pmt.to_pmt(with_warning))
-        if not content:
-            return False, content
-        if partial and not self.forward_partial:
-            return False, []
+    def publish_frame(self, bits):
         if self.textual_output:
-            self.message_port_pub(self.outPortName, pmt.to_pmt(''.join('1' if item else '0' for item in content)))
+            self.message_port_pub(self.outPortName, pmt.to_pmt(''.join('1' if bit else '0' for bit in bits)))
+        else:
+            self.message_port_pub(self.outPortName, bits_to_pmt(bits, self.compact_output))
+
+    def decode_arrays(self, levels, durations):
+        """Decode timings given as parallel arrays of levels and durations, publishing each frame found.
+
+        Warnings are aggregated, and published once per call rather than once per pulse.
+        """
+        if self.recovery is not None:
+            (frames, warnings) = self.recovery.decode(levels, durations)
         else:
-            self.message_port_pub(self.outPortName, pmt.to_pmt(content))
-        return False, []
+            (frames, warnings) = decode_timings(levels, durations, self.hello_min, self.hello_max, self.low_min,
+                self.low_max, self.high_max, self.sep_min, self.sep_max)
+        if warnings:
+            self.metrics.count('decode_failures_timing', sum(warnings.values()))
+            self.message_port_pub(self.debugPortName, pmt.to_pmt(
+                '; '.join(f'{count} x {warning}' for (warning, count) in warnings.items())))
+        for (bits, partial, *report) in frames:
+            if report:
+                self.publish_report(bits, report[0])
+            if partial and not self.forward_partial:
+                self.metrics.count('partial_dropped')
+                continue
+            self.publish_frame(bits)
+            self.metrics.count('messages_out')
+
+    def publish_report(self, bits, report):
+        report = dict(report)
+        if len(bits) >= 8:
+            report['group'] = int(''.join(str(int(bit)) for bit in bits[:4]), 2)
+            report['chan'] = int(''.join(str(int(bit)) for bit in bits[4:8]), 2)
+        if report['source'] == 'transmitter':
+            self.metrics.count('frames_recovered')
+        self.metrics.gauge('confidence', report['confidence'])
+        self.message_port_pub(self.confidencePortName, pmt.to_pmt(report))
 
     def handle_msg(self, msg_pmt):
         """
@@ -75,50 +126,9 @@ class timings_to_bitfield(gr.sync_block):
         - A span that is high between sep_min and sep_max (after a hello) divides two bits
         - Any span outside the above terminates decoding
         """
-        msg = pmt.to_python(msg_pmt)
-        in_msg = False
-        content = []
-        for item in msg:
-            (item_val, item_time) = item
-            if in_msg is False:
-                if not item_val:
-                    # hellos must be high
-                    continue
-                if item_time < self.hello_min:
-                    continue
-                if item_time > self.hello_max:
-                    continue
-                in_msg = True
-                continue
-            # below here, in_msg is true
-            if item_val:
-                # either this is a separator or the message is invalid
-                if item_time < self.sep_min:
-                    in_msg, content = self.send_now(content, f"Separator seen with duration {item_time}, less than minimum {self.sep_min}")
-                    continue
-                if item_time > self.sep_max:
-                    # Invalid message, so we're counting it ended
-                    in_msg, content = self.send_now(content, partial=True)
-                    # high too long to be a separator; if it's within the hello range, consider it start of a new message
-                    if item_time > self.hello_min and item_time < self.hello_max:
-                        self.message_port_pub(self.debugPortName, pmt.to_pmt("Hello seen while already in a prior message; truncating and starting new"))
-                        in_msg = True
-                    else:
-                        self.message_port_pub(self.debugPortName, pmt.to_pmt("Invalid long-high seen; ending message"))
-                    continue
-                # If we reached here, this separator is valid; no action to take
-                continue
-            # High branch closed with continue; we're processing a low period
-            if item_time < self.low_min:
-                in_msg, content = self.send_now(content, "Short-low timing of {item_time} below minimum of {self.low_min}")
-                continue
-            if item_time < self.low_max:
-                content.append(0)
-                continue
-            if item_time > self.high_max:
-                # No need for a warning here: This is expected after a legitimate message
-                in_msg, content = self.send_now(content)
-                continue
-            content.append(1)
-        self.send_now(content)
-
+        started = self.metrics.clock()
+        (levels, durations) = pmt_to_timings(msg_pmt)
+        self.decode_arrays(levels, durations)
+        self.metrics.count('messages_in')
+        self.metrics.elapsed('handle_msg', started)
+        self.metrics.poll()
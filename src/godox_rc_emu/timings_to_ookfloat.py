@@ -1,19 +1,65 @@
+import collections
+import threading
+import time
+
 import numpy as np
 import pmt
 from gnuradio import gr
 
+from .core.frame import pack_frame
+from .core.render import mix_to_carrier, render_frame, render_levels, render_timings, sample_counts
+from .core.waveform_cache import message_key, shared_cache
+from .metrics import make_metrics
+from .pmt_wire import is_compact_timings, pmt_to_timings
+
 class timings_to_ookfloat(gr.sync_block):
-    def __init__(self, sample_rate=1, true_value=1, false_value=0, idle_value=0, sep_time=1e-3, sep_value=0.0):
+    """Render messages of (bool, float) timings to a stream of OOK samples.
+
+    Each message is rendered once, on arrival, into a contiguous sample array; work() only copies slices out of the
+    queue of rendered bursts. At most max_queue bursts are held (0 for no limit); when full, queue_policy decides
+    whether the oldest queued burst ('drop_oldest') or the incoming one ('drop_newest') is discarded.
+
+    Timings may be in any of the forms described in pmt_wire. Messages may also be decoded dicts, as emitted by the
+    message muxer; these are encoded using the given hello/bit timings, skipping the Message->Bitfield and
+    Bitfield->Timings blocks. When use_cache is set, their renderings are kept in the process-wide waveform cache,
+    so repeats and recently used states are not encoded again.
+
+    In burst mode, samples are only produced while a message is being sent: nothing is written while idle, and each
+    burst is marked with tx_sob/tx_eob stream tags so that a UHD sink starts and stops transmitting around it. If
+    tx_time_lead is nonzero, each burst is also tagged with a tx_time that many seconds after it was dequeued (this
+    assumes the device clock has been set from the host's).
+
+    With output_type 'complex', the output is complex64 baseband: the OOK envelope, scaled by amplitude, on a carrier
+    freq_offset Hz from center. Each burst is mixed once, when rendered (and cached that way), starting at zero phase;
+    as it is dequeued, it is rotated to the current phase of the carrier, so the carrier stays phase-continuous from
+    one burst to the next. This replaces a Float To Complex / Signal Source / Multiply chain after the block.
+
+    If stats_interval is nonzero, metrics (including the depth of the burst queue, and this block's waveform cache
+    hits and misses) are published on the stats port at most that often (seconds).
+    """
+    block_name = 'Timings -> OOK'
+
+    def __init__(self, sample_rate=1, true_value=1, false_value=0, idle_value=0, sep_time=1e-3, sep_value=0.0,
+            max_queue=32, queue_policy='drop_oldest',
+            hello_time=13e-4, bit_low_time=6e-4, bit_high_time=13e-4, bit_sep_time=7e-4, use_cache=True,
+            burst_mode=False, tx_time_lead=0.0, output_type='float', freq_offset=0.0, amplitude=1.0,
+            stats_interval=0.0):
+        if output_type not in ('float', 'complex'):
+            raise ValueError(f'Unknown output_type {output_type!r}; expected float or complex')
         gr.sync_block.__init__(
             self,
-            name='Timings -> OOK',
+            name=self.block_name,
             in_sig=None,
-            out_sig=[np.float32],
+            out_sig=[np.complex64 if output_type == 'complex' else np.float32],
         )
         self.inPortName = pmt.intern('in')
         self.debugPortName = pmt.intern('debug')
         self.message_port_register_in(self.inPortName)
         self.message_port_register_out(self.debugPortName)
+        self.statsPortName = pmt.intern('stats')
+        self.message_port_register_out(self.statsPortName)
+        self.metrics = make_metrics(self.alias, stats_interval,
+            lambda snapshot: self.message_port_pub(self.statsPortName, pmt.to_pmt(snapshot)))
         self.set_msg_handler(self.inPortName, self.handle_msg)
 
         self.sample_rate = float(sample_rate)
@@ -22,51 +68,184 @@ class timings_to_ookfloat(gr.sync_block):
         self.idle_value = float(idle_value)
         self.sep_time = float(sep_time)
         self.sep_value = float(sep_value)
+        self.hello_time = hello_time
+        self.bit_low_time = bit_low_time
+        self.bit_high_time = bit_high_time
+        self.bit_sep_time = bit_sep_time
+        self.cache = shared_cache if use_cache else None
+
+        if queue_policy not in ('drop_oldest', 'drop_newest'):
+            raise ValueError(f'Unknown queue_policy {queue_policy!r}; expected drop_oldest or drop_newest')
+        self.max_queue = int(max_queue)
+        self.queue_policy = queue_policy
+        # with drop_oldest, the deque itself discards from the far end once maxlen is reached
+        self.queued_msgs = collections.deque(maxlen=(self.max_queue or None) if queue_policy == 'drop_oldest' else None)
+
+        # burst currently being written, and how many of its samples have already been written
+        self.current_burst = None
+        self.current_burst_pos = 0
+
+        self.burst_mode = burst_mode
+        self.tx_time_lead = tx_time_lead
+        # in burst mode, work() waits on this (for at most idle_wait seconds) while there is nothing to send
+        self.queue_condition = threading.Condition()
+        self.idle_wait = 0.1
+        self.sob_key = pmt.intern('tx_sob')
+        self.eob_key = pmt.intern('tx_eob')
+        self.time_key = pmt.intern('tx_time')
 
-        self.queued_msgs = []
+        self.output_type = output_type
+        self.freq_offset = float(freq_offset)
+        self.amplitude = float(amplitude)
+        # carrier phase (radians) at the next sample to be written, and its advance per sample
+        self.phase = 0.0
+        self.phase_step = 2 * np.pi * self.freq_offset / self.sample_rate
+        # complex output only: rotation applied to current_burst, bringing its zero phase start to the carrier's phase
+        self.current_rotation = 1.0
 
-        self.current_msg = None
-        self.current_bit_val = None
-        self.current_bit_samples_remaining = 0
+    def modulate(self, samples):
+        if self.output_type == 'float':
+            return samples
+        return mix_to_carrier(samples, self.phase_step, self.amplitude)
+
+    def render(self, timings):
+        return self.modulate(render_timings(list(timings) + [(self.sep_value, self.sep_time)],
+            self.sample_rate, self.true_value, self.false_value))
+
+    def render_arrays(self, levels, durations):
+        samples = render_levels(levels, durations, self.sample_rate, self.true_value, self.false_value)
+        sep = np.full(sample_counts(self.sep_time, self.sample_rate), self.sep_value, dtype=np.float32)
+        return self.modulate(np.concatenate((samples, sep)))
+
+    def render_message(self, msg):
+        return self.modulate(render_frame(pack_frame(msg), self.sample_rate, self.true_value, self.false_value,
+            self.sep_value, self.sep_time, self.hello_time, self.bit_low_time, self.bit_high_time, self.bit_sep_time))
+
+    def cached_render_message(self, msg):
+        if self.cache is None:
+            return self.render_message(msg)
+        key = message_key(msg, self.hello_time, self.bit_low_time, self.bit_high_time, self.bit_sep_time,
+            self.sample_rate, self.true_value, self.false_value, self.sep_time, self.sep_value,
+            self.output_type, self.freq_offset, self.amplitude)
+        samples = self.cache.get(key)
+        if samples is None:
+            self.metrics.count('cache_misses')
+            samples = self.cache.put(key, self.render_message(msg))
+        else:
+            self.metrics.count('cache_hits')
+        if self.metrics.enabled:
+            # the cache is shared by every encoder in the process; its size is reported as each block last saw it
+            stats = self.cache.stats()
+            self.metrics.gauge('cache_entries', stats['entries'])
+            self.metrics.gauge('cache_bytes', stats['bytes'])
+        return samples
+
+    def enqueue(self, burst):
+        if self.max_queue and len(self.queued_msgs) >= self.max_queue:
+            self.metrics.count('messages_dropped')
+            if self.queue_policy == 'drop_newest':
+                self.message_port_pub(self.debugPortName, pmt.to_pmt(f'Queue full ({self.max_queue} bursts); dropping new message'))
+                return
+            self.message_port_pub(self.debugPortName, pmt.to_pmt(f'Queue full ({self.max_queue} bursts); dropping oldest message'))
+        with self.queue_condition:
+            self.queued_msgs.append(burst)
+            self.queue_condition.notify()
+        self.metrics.gauge('queue_depth', len(self.queued_msgs))
 
     def handle_msg(self, msg_pmt):
-        # TODO: Discard messages when queue is too full? (If so, new messages, or old ones?)
-        self.queued_msgs.append(pmt.to_python(msg_pmt) + [(self.sep_value, self.sep_time)])
+        started = self.metrics.clock()
+        self.metrics.count('messages_in')
+        if is_compact_timings(msg_pmt):
+            self.enqueue(self.render_arrays(*pmt_to_timings(msg_pmt)))
+            self.metrics.elapsed('handle_msg', started)
+            return
+        msg = pmt.to_python(msg_pmt)
+        if isinstance(msg, dict):
+            self.enqueue(self.cached_render_message(msg))
+        else:
+            self.enqueue(self.render(msg))
+        self.metrics.elapsed('handle_msg', started)
+
+    def start_burst(self):
+        self.current_burst = self.queued_msgs.popleft()
+        self.current_burst_pos = 0
+        self.metrics.count('messages_out')
+        self.metrics.gauge('queue_depth', len(self.queued_msgs))
+        if self.output_type == 'complex':
+            self.current_rotation = np.complex64(np.exp(1j * self.phase))
+            self.phase = (self.phase + self.phase_step * len(self.current_burst)) % (2 * np.pi)
+
+    def write_burst(self, out):
+        """Fill out with the next samples of current_burst."""
+        samples = self.current_burst[self.current_burst_pos:self.current_burst_pos+len(out)]
+        if self.output_type == 'complex':
+            np.multiply(samples, self.current_rotation, out=out)
+        else:
+            out[:] = samples
+
+    def write_idle(self, out):
+        if self.output_type == 'float':
+            out[:] = self.idle_value
+            return
+        if self.idle_value:
+            out[:] = mix_to_carrier(np.full(len(out), self.idle_value), self.phase_step, self.amplitude, self.phase)
+        else:
+            out[:] = 0
+        # the carrier keeps running while idle, as a separate signal source would
+        self.phase = (self.phase + self.phase_step * len(out)) % (2 * np.pi)
 
     def work(self, input_items, output_items):
+        if self.burst_mode:
+            return self.work_bursts(output_items[0])
+        started = self.metrics.clock()
         out0 = output_items[0]
 
         buf_pos = 0
-        output_space_remaining = len(out0)
-        while output_space_remaining > 0:
-            #print(f"Need to write {output_space_remaining} samples")
-            # In the middle of a bit already; finish writing it
-            if self.current_bit_samples_remaining:
-                #print(f"  Writing {self.current_bit_samples_remaining} samples of value {self.current_bit_val}")
-                samples_to_write = min(output_space_remaining, self.current_bit_samples_remaining)
-                out0[buf_pos:buf_pos+samples_to_write] = self.current_bit_val
-                buf_pos += samples_to_write
-                output_space_remaining -= samples_to_write
-                self.current_bit_samples_remaining -= samples_to_write
-                continue
-            # finished current message, but a new one is available
-            if self.queued_msgs and not self.current_msg:
-                self.current_msg = self.queued_msgs.pop(0)
-                #print(f"  Message queue was empty; popped off message {self.current_msg}")
-                continue
-            # ready to start a new bit
-            if self.current_msg:
-                (new_bit, new_time) = self.current_msg.pop(0)
-                if isinstance(new_bit, bool):
-                    new_bit = self.true_value if new_bit else self.false_value
-                self.current_bit_val = new_bit
-                self.current_bit_samples_remaining = int(new_time * self.sample_rate)
-                #print(f"  Pulling a new bit from the current message: {new_bit} for {new_time} == {self.current_bit_samples_remaining} samples")
-                continue
-            # if we reached here, no new bits remain; we're idle
-            # FIXME: Maybe add some assertions to the effect of the above?
-            #print(f"Nothing to do; writing idle_value from position {buf_pos} onward")
-            out0[buf_pos:] = self.idle_value
-            break
-        #print(f"Finished writing {len(out0)} samples")
-        return len(out0)
+        buf_len = len(out0)
+        while buf_pos < buf_len:
+            if self.current_burst is None:
+                if not self.queued_msgs:
+                    # nothing left to send; we're idle
+                    self.write_idle(out0[buf_pos:])
+                    break
+                self.start_burst()
+            samples_to_write = min(buf_len - buf_pos, len(self.current_burst) - self.current_burst_pos)
+            self.write_burst(out0[buf_pos:buf_pos+samples_to_write])
+            buf_pos += samples_to_write
+            self.current_burst_pos += samples_to_write
+            if self.current_burst_pos >= len(self.current_burst):
+                self.current_burst = None
+        self.metrics.count('samples_out', buf_len)
+        self.metrics.elapsed('work', started)
+        self.metrics.poll()
+        return buf_len
+
+    def work_bursts(self, out0):
+        if self.current_burst is None and not self.queued_msgs:
+            with self.queue_condition:
+                self.queue_condition.wait_for(lambda: self.queued_msgs, self.idle_wait)
+        started = self.metrics.clock()
+        buf_pos = 0
+        buf_len = len(out0)
+        start_offset = self.nitems_written(0)
+        while buf_pos < buf_len:
+            if self.current_burst is None:
+                if not self.queued_msgs:
+                    break
+                self.start_burst()
+                self.add_item_tag(0, start_offset + buf_pos, self.sob_key, pmt.PMT_T)
+                if self.tx_time_lead:
+                    tx_time = time.time() + self.tx_time_lead
+                    self.add_item_tag(0, start_offset + buf_pos, self.time_key,
+                        pmt.make_tuple(pmt.from_uint64(int(tx_time)), pmt.from_double(tx_time % 1)))
+            samples_to_write = min(buf_len - buf_pos, len(self.current_burst) - self.current_burst_pos)
+            self.write_burst(out0[buf_pos:buf_pos+samples_to_write])
+            buf_pos += samples_to_write
+            self.current_burst_pos += samples_to_write
+            if self.current_burst_pos >= len(self.current_burst):
+                self.add_item_tag(0, start_offset + buf_pos - 1, self.eob_key, pmt.PMT_T)
+                self.current_burst = None
+        self.metrics.count('samples_out', buf_pos)
+        self.metrics.elapsed('work', started)
+        self.metrics.poll()
+        return buf_pos
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the package is used from src/ in place (as the run script does), rather than installed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
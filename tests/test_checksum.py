@@ -0,0 +1,36 @@
+import sqlite3
+
+import numpy as np
+
+from godox_rc_emu.core.checksum import checksum, checksum_array, register_sqlite
+
+def reference_checksum(group, chan, brightness):
+    """The bit-by-bit checksum the sanitizer computed before the lookup tables."""
+    def update_checksum(checksum, content, xor_values):
+        current_bit = 1
+        for xor_value in xor_values:
+            if content & current_bit:
+                checksum ^= xor_value
+            current_bit <<= 1
+        return checksum
+    value = update_checksum(0, group, [110, 220, 137, 35])
+    value = update_checksum(value, chan, [244, 217, 131, 55])
+    return update_checksum(value, brightness, [49, 98, 196, 185, 67, 134, 61])
+
+# every value a sanitized message can carry
+(GROUPS, CHANS, BRIGHTNESSES) = np.meshgrid(np.arange(16), np.arange(16), np.arange(128), indexing='ij')
+
+def expected():
+    return np.vectorize(reference_checksum)(GROUPS, CHANS, BRIGHTNESSES)
+
+def test_checksum_matches_reference():
+    assert np.vectorize(checksum)(GROUPS, CHANS, BRIGHTNESSES).tolist() == expected().tolist()
+
+def test_checksum_array_matches_reference():
+    assert checksum_array(GROUPS.ravel(), CHANS.ravel(), BRIGHTNESSES.ravel()).tolist() == expected().ravel().tolist()
+
+def test_sqlite_function_matches_reference():
+    conn = sqlite3.connect(':memory:')
+    register_sqlite(conn)
+    rows = conn.execute('SELECT godox_checksum(?, ?, ?)', (3, 9, 77)).fetchall()
+    assert rows == [(reference_checksum(3, 9, 77),)]
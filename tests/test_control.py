@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from godox_rc_emu.control import ControlServer, parse_request
+
+def test_single_command_is_a_batch_of_one():
+    assert parse_request('{"group": 2, "chan": 11, "brightness": 40}') == [{'group': 2, 'chan': 11, 'brightness': 40}]
+    assert parse_request(b'{"recall": "evening"}\n') == [{'recall': 'evening'}]
+
+def test_batch_form():
+    commands = [{'group': 3, 'chan': 1}, {'scene': {'key': {'chan': 7}, 'fill': {'chan': 8}}, 'name': 'two'},
+        {'chan': 5, 'fade_time': 1.5}]
+    assert parse_request(json.dumps(commands)) == commands
+    assert parse_request('[]') == []
+
+@pytest.mark.parametrize(('request_text', 'error'), [
+    ('not json', 'Expecting value'),
+    ('{"chan": 1', 'Expecting'),
+    ('5', 'a request must be a JSON object, or a list of JSON objects'),
+    ('"chan"', 'a request must be a JSON object'),
+    ('[{"chan": 1}, 2]', 'command 1 must be a JSON object'),
+    ('{"group": 16}', 'command 0: group must be an integer from 0 to 15, not 16'),
+    ('{"chan": -1}', 'command 0: chan must be an integer from 0 to 15, not -1'),
+    ('{"brightness": 40.5}', 'command 0: brightness must be an integer from 0 to 127, not 40.5'),
+    ('{"cmd": true}', 'command 0: cmd must be an integer from 0 to 3, not True'),
+    ('{"color": "24"}', "command 0: color must be an integer from 0 to 63, not '24'"),
+    ('{"cksum": 256}', 'command 0: cksum must be an integer from 0 to 255, not 256'),
+    ('{"fade_time": -1}', 'command 0: fade_time must be a non-negative number of seconds, not -1'),
+    ('{"fade_time": 1e999}', 'command 0: fade_time must be a non-negative number of seconds, not inf'),
+    ('{"recall": 3}', 'command 0: recall must be a scene name (a string)'),
+    ('{"scene": 3}', 'command 0: scene must be a list of lights, or an object of them'),
+    ('{"scene": [{"chan": 1}, {"chan": 99}]}', 'command 0, light 1: chan must be an integer from 0 to 15, not 99'),
+    ('{"scene": {"key": [1]}}', 'command 0, light 0 must be a JSON object'),
+    ('{"scene": [], "name": 5}', 'command 0: name must be a string'),
+])
+def test_invalid_requests(request_text, error):
+    with pytest.raises(ValueError, match=error.replace('(', r'\(').replace(')', r'\)')):
+        parse_request(request_text)
+
+def test_invalid_command_rejects_the_whole_batch():
+    submitted = []
+    async def submit(commands):
+        submitted.append(commands)
+        return [{'queued': None} for _ in commands]
+    server = ControlServer([], submit)
+    reply = asyncio.run(server.handle_request('[{"chan": 1}, {"chan": 16}]'))
+    assert reply == {'ok': False, 'error': 'command 1: chan must be an integer from 0 to 15, not 16'}
+    assert submitted == []
+    reply = asyncio.run(server.handle_request('[{"chan": 1}, {"chan": 2}]'))
+    assert reply == {'ok': True, 'results': [{'queued': None}, {'queued': None}]}
+    assert submitted == [[{'chan': 1}, {'chan': 2}]]
+
+class TestControlSource:
+    @pytest.fixture
+    def source(self):
+        pytest.importorskip('gnuradio')
+        pmt = pytest.importorskip('pmt')
+        from godox_rc_emu.control_source import control_source
+        source = control_source(endpoints='', ack_timeout=0.2, stats_interval=3600.0)
+        # submit() runs on this loop, as it would on the server's; the server itself is not started
+        source.loop = asyncio.new_event_loop()
+        self.published = []
+        self.ack = None
+        def message_port_pub(port, msg_pmt):
+            command = pmt.to_python(msg_pmt)
+            self.published.append(command)
+            if self.ack is not None:
+                # the muxer acks from its own thread, a little later
+                ack = self.ack(command)
+                if ack is not None:
+                    threading.Timer(0.01, source.handle_ack, [pmt.to_pmt(ack)]).start()
+        source.message_port_pub = message_port_pub
+        yield source
+        source.loop.close()
+
+    def submit(self, source, commands):
+        return source.loop.run_until_complete(source.submit(commands))
+
+    def test_ack_round_trip(self, source):
+        self.ack = lambda command: {'ack_id': command['ack_id'], 'position': command['chan'], 'pending': 3,
+            'backlog': 0.01}
+        results = self.submit(source, [{'chan': 4}, {'chan': 2}])
+        assert results == [
+            {'queued': True, 'acked': True, 'position': 4, 'pending': 3, 'backlog': 0.01},
+            {'queued': True, 'acked': True, 'position': 2, 'pending': 3, 'backlog': 0.01},
+        ]
+        # each command went out with its own ack_id, and none are left waiting
+        assert len({command['ack_id'] for command in self.published}) == 2
+        assert source.waiters == {}
+        assert source.metrics.counters == {'requests': 1, 'commands': 2}
+
+    def test_ack_timeout(self, source):
+        # only the second command is acked, and the first gets an ack meant for some other command
+        self.ack = lambda command: ({'ack_id': command['ack_id'], 'position': 0, 'pending': 1, 'backlog': 0.0}
+            if command['chan'] == 2 else {'ack_id': -1, 'position': 9, 'pending': 9, 'backlog': 9.0})
+        results = self.submit(source, [{'chan': 1}, {'chan': 2}])
+        assert results == [
+            {'queued': None, 'acked': False, 'position': None},
+            {'queued': True, 'acked': True, 'position': 0, 'pending': 1, 'backlog': 0.0},
+        ]
+        assert source.waiters == {}
+        assert source.metrics.counters == {'requests': 1, 'commands': 2, 'acks_missed': 1}
+
+    def test_no_ack_wait_without_timeout(self, source):
+        source.ack_timeout = 0.0
+        assert self.submit(source, [{'chan': 1}]) == [{'queued': None, 'acked': False, 'position': None}]
+        assert self.published == [{'chan': 1}]
+        assert source.metrics.counters == {'requests': 1, 'commands': 1, 'acks_skipped': 1}
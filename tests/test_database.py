@@ -0,0 +1,75 @@
+import sqlite3
+
+from godox_rc_emu.core import checksum, message_to_bits
+from godox_rc_emu.database import decoded_columns, migrate, setup_database, views_ddl
+
+# raw_messages as first defined, before the decoded columns were added
+BASELINE_DDL = '''
+CREATE TABLE raw_messages(
+    id INTEGER PRIMARY KEY,
+    content BLOB UNIQUE,
+    first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    seen_count INTEGER DEFAULT 1
+);
+'''
+
+def bit_string(group, chan, brightness, cksum=None):
+    msg = {'group': group, 'chan': chan, 'brightness': brightness, 'cmd': 1, 'color': 24,
+        'cksum': checksum(group, chan, brightness) if cksum is None else cksum}
+    return ''.join(map(str, message_to_bits(msg)))
+
+ROWS = [
+    (1, bit_string(1, 0, 25)),
+    (2, bit_string(3, 12, 100)),
+    (3, bit_string(15, 15, 127, cksum=7)), # wrong checksum
+    (4, bit_string(2, 2, 2)[:26]), # too short to be a frame
+    (5, 'x' * 33), # not bits at all
+]
+
+def baseline_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_DDL)
+    with conn:
+        conn.executemany('INSERT INTO raw_messages(id, content, seen_count) VALUES(?, ?, 3)', ROWS)
+    return conn
+
+def decoded(conn):
+    return conn.execute(f'SELECT id, {", ".join(decoded_columns)} FROM raw_messages ORDER BY id').fetchall()
+
+def test_migrate_backfills_baseline_database(tmp_path):
+    conn = baseline_database(str(tmp_path / 'collect.sqlite'))
+    assert migrate(conn) == 3
+    assert decoded(conn) == [
+        (1, 1, 0, 25, 1, 24, checksum(1, 0, 25), checksum(1, 0, 25), 1),
+        (2, 3, 12, 100, 1, 24, checksum(3, 12, 100), checksum(3, 12, 100), 1),
+        (3, 15, 15, 127, 1, 24, 7, checksum(15, 15, 127), 0),
+        (4,) + (None,) * len(decoded_columns),
+        (5,) + (None,) * len(decoded_columns),
+    ]
+    conn.executescript(views_ddl)
+    indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'raw_messages_grp_chan', 'raw_messages_cksum_valid'} <= indexes
+    plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM raw_messages WHERE grp = 3 AND chan = 12').fetchall()
+    assert any('raw_messages_grp_chan' in row[-1] for row in plan)
+    assert [row[0] for row in conn.execute('SELECT content FROM parsed_messages ORDER BY content')] == sorted(
+        content for (_, content) in ROWS[:3])
+
+def test_second_migrate_is_a_no_op(tmp_path):
+    conn = baseline_database(str(tmp_path / 'collect.sqlite'))
+    migrate(conn)
+    before = decoded(conn)
+    assert migrate(conn) == 0
+    assert decoded(conn) == before
+
+def test_setup_database_migrates_in_place(tmp_path, capsys):
+    path = str(tmp_path / 'collect.sqlite')
+    baseline_database(path).close()
+    conn = setup_database(path)
+    assert 'Decoded 3 previously stored messages' in capsys.readouterr().err
+    assert conn.execute('SELECT cksum_valid FROM raw_messages WHERE id = 3').fetchone() == (0,)
+    assert conn.execute('SELECT godox_checksum(1, 0, 25)').fetchone() == (checksum(1, 0, 25),)
+    conn.close()
+    # opening it again has nothing left to decode
+    setup_database(path).close()
+    assert capsys.readouterr().err == ''
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import decode_timings
+
+LIMITS = dict(hello_min=10e-4, hello_max=12e-4, low_min=5e-4, low_max=7e-4, high_max=14e-4, sep_min=6e-4, sep_max=8e-4)
+
+def reference_decode(timings, hello_min, hello_max, low_min, low_max, high_max, sep_min, sep_max, forward_partial):
+    """The per-pulse state machine timings_to_bitfield used before decode_timings(), returning the frames it sent."""
+    frames = []
+    def send_now(content, partial=None, with_warning=None):
+        if partial is None:
+            partial = with_warning is not None
+        if content and not (partial and not forward_partial):
+            frames.append(list(content))
+        return False, []
+    in_msg = False
+    content = []
+    for (item_val, item_time) in timings:
+        if in_msg is False:
+            if not item_val:
+                continue
+            if item_time < hello_min:
+                continue
+            if item_time > hello_max:
+                continue
+            in_msg = True
+            continue
+        if item_val:
+            if item_time < sep_min:
+                in_msg, content = send_now(content, 'separator too short')
+                continue
+            if item_time > sep_max:
+                in_msg, content = send_now(content, partial=True)
+                if item_time > hello_min and item_time < hello_max:
+                    in_msg = True
+                continue
+            continue
+        if item_time < low_min:
+            in_msg, content = send_now(content, 'low too short')
+            continue
+        if item_time < low_max:
+            content.append(0)
+            continue
+        if item_time > high_max:
+            in_msg, content = send_now(content)
+            continue
+        content.append(1)
+    send_now(content)
+    return frames
+
+def random_timings(rng):
+    """Pulses mostly near the protocol's nominal timings, with some anywhere at all, so every path gets exercised."""
+    timings = []
+    level = bool(rng.integers(2))
+    for _ in range(rng.integers(1, 120)):
+        if rng.random() < 0.1:
+            duration = rng.uniform(0, 2e-3)
+        elif level:
+            duration = rng.choice([11e-4, 7e-4, 7e-4, 7e-4, 5e-4, 9e-4, 13e-4]) + rng.normal(0, 4e-5)
+        else:
+            duration = rng.choice([6e-4, 12e-4, 3e-3, 4e-4]) + rng.normal(0, 4e-5)
+        timings.append((level, float(duration)))
+        # levels usually alternate, but the old decoder took any sequence
+        level = (not level) if rng.random() < 0.95 else level
+    return timings
+
+@pytest.mark.parametrize('forward_partial', [False, True])
+def test_matches_reference_decoder(forward_partial):
+    rng = np.random.default_rng(5)
+    for _ in range(2000):
+        timings = random_timings(rng)
+        expected = reference_decode(timings, **LIMITS, forward_partial=forward_partial)
+        levels = np.array([level for (level, _) in timings], dtype=bool)
+        durations = np.array([duration for (_, duration) in timings])
+        (frames, _) = decode_timings(levels, durations, **LIMITS)
+        decoded = [bits.tolist() for (bits, partial) in frames if forward_partial or not partial]
+        assert decoded == expected, timings
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import EdgeExtractor, threshold_levels
+
+LOW = 0.3
+HIGH = 0.6
+GAP = 40
+
+def reference_packets(samples, threshold_low, threshold_high, gap_samples):
+    """Find the (offset, packet) pairs in the whole stream at once, a sample at a time."""
+    packets = []
+    level = 0
+    content = None
+    for (index, sample) in enumerate(samples.tolist()):
+        new_level = 1 if sample > threshold_high else 0 if sample < threshold_low else level
+        if new_level == level:
+            continue
+        level = new_level
+        if content is None:
+            if level:
+                content = []
+                packet_start = last_edge = index
+            continue
+        if level and index - last_edge >= gap_samples:
+            packets.append((packet_start, content))
+            content = []
+            packet_start = index
+        else:
+            content.append((not level, index - last_edge))
+        last_edge = index
+    if content is not None and not level and len(samples) - last_edge >= gap_samples:
+        packets.append((packet_start, content))
+    return packets
+
+def random_signal(rng):
+    """Runs of high and low, some shorter and some longer than the gap, with noise that sometimes lands between the
+    thresholds; ends with a long low, so the last packet is complete."""
+    runs = []
+    for _ in range(rng.integers(1, 60)):
+        length = int(rng.choice([rng.integers(1, 10), rng.integers(10, 60)]))
+        runs.append(np.full(length, rng.choice([0.0, 1.0])))
+    runs.append(np.zeros(GAP + 1))
+    signal = np.concatenate(runs)
+    return signal + rng.normal(0, 0.12, len(signal))
+
+def extract_in_chunks(signal, bounds):
+    extractor = EdgeExtractor(LOW, HIGH, GAP)
+    packets = []
+    for (start, end) in zip(bounds[:-1], bounds[1:]):
+        packets.extend(extractor.process_with_offsets(signal[start:end]))
+    return packets
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_chunks_match_single_pass(seed):
+    rng = np.random.default_rng(seed)
+    signal = random_signal(rng)
+    expected = reference_packets(signal, LOW, HIGH, GAP)
+    assert extract_in_chunks(signal, [0, len(signal)]) == expected
+    # chunk sizes from empty to several packets long
+    cuts = np.sort(rng.integers(0, len(signal) + 1, rng.integers(1, 40)))
+    bounds = [0, *cuts.tolist(), len(signal)]
+    assert extract_in_chunks(signal, bounds) == expected
+    assert extract_in_chunks(signal, list(range(len(signal) + 1))) == expected
+
+def test_edge_on_chunk_boundary():
+    signal = np.zeros(200)
+    signal[10:20] = 1.0
+    signal[25:30] = 1.0
+    # the next packet starts exactly GAP samples after the last edge, so the low before it ends the first packet
+    signal[30 + GAP:30 + GAP + 5] = 1.0
+    expected = [(10, [(True, 10), (False, 5), (True, 5)]), (30 + GAP, [(True, 5)])]
+    assert reference_packets(signal, LOW, HIGH, GAP) == expected
+    # split on every edge, and on either side of it
+    for edge in (10, 20, 25, 30, 30 + GAP, 35 + GAP):
+        for split in (edge - 1, edge, edge + 1):
+            assert extract_in_chunks(signal, [0, split, len(signal)]) == expected, split
+
+def test_packet_ends_when_gap_is_reached_at_block_end():
+    signal = np.zeros(20 + GAP)
+    signal[10:20] = 1.0
+    extractor = EdgeExtractor(LOW, HIGH, GAP, offset=1000)
+    # one sample short of the gap, the packet may still go on
+    assert extractor.process_with_offsets(signal[:-1]) == []
+    assert extractor.process_with_offsets(signal[-1:]) == [(1010, [(True, 10)])]
+
+def test_threshold_levels_holds_between_thresholds():
+    samples = np.array([0.5, 0.7, 0.5, 0.4, 0.2, 0.5])
+    assert threshold_levels(samples, LOW, HIGH, 1).tolist() == [1, 1, 1, 1, 0, 0]
+    assert threshold_levels(samples, LOW, HIGH, 0).tolist() == [0, 1, 1, 1, 0, 0]
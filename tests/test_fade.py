@@ -0,0 +1,78 @@
+import heapq
+import itertools
+
+import godox_rc_emu.core.fade as fade_module
+from godox_rc_emu.core import checksum, frame_airtime, pack_frame
+from godox_rc_emu.core.fade import Fader
+
+REPEAT_COUNT = 5
+
+def light(chan, brightness):
+    return {'group': 1, 'chan': chan, 'brightness': brightness, 'cmd': 0, 'color': 24,
+        'cksum': checksum(1, chan, brightness)}
+
+def airtime(msg):
+    return frame_airtime(pack_frame(msg))
+
+def superseded_by_muxer(published):
+    """Replay (time, msg) pairs through a model of the muxer, sending each message REPEAT_COUNT times, oldest repeat
+    first, back to back; return how many repeats were still pending when a newer state for their light replaced
+    them."""
+    pending = {}
+    schedule = []
+    seq = itertools.count()
+    channel_free_time = 0.0
+    superseded = 0
+    for (now, msg) in published:
+        # send whatever the channel had time for before this message arrived
+        while schedule and channel_free_time < now:
+            (last_sent, _, key) = heapq.heappop(schedule)
+            if key not in pending:
+                continue
+            (repeats, queued_msg) = pending[key]
+            start = max(channel_free_time, last_sent)
+            channel_free_time = start + airtime(queued_msg)
+            if repeats > 1:
+                pending[key] = (repeats - 1, queued_msg)
+                heapq.heappush(schedule, (start, next(seq), key))
+            else:
+                del pending[key]
+        key = (msg['group'], msg['chan'])
+        if key in pending:
+            superseded += pending[key][0]
+        pending[key] = (REPEAT_COUNT, msg)
+        heapq.heappush(schedule, (now, next(seq), key))
+    return superseded
+
+def run_fades(monkeypatch, fades, until):
+    now = [100.0]
+    monkeypatch.setattr(fade_module.time, 'monotonic', lambda: now[0])
+    fader = Fader()
+    # stepped by hand below, on the fake clock, rather than from the fader's own thread
+    fader.thread = 'stepped by the test'
+    published = []
+    for (start, target) in fades:
+        fader.fade((start['group'], start['chan']), start, target, 3.0, lambda state: REPEAT_COUNT * airtime(state),
+            lambda state: published.append((now[0], state)))
+    while fader.fades and now[0] < 100.0 + until:
+        fader.step(now[0])
+        now[0] = max(now[0] + 1e-3, fader.next_step)
+    return published
+
+def test_multi_light_fade_is_never_superseded(monkeypatch):
+    fades = [(light(chan, 0), light(chan, 100)) for chan in range(3)]
+    published = run_fades(monkeypatch, fades, until=10.0)
+    # every light gets intermediate steps, and ends at its target
+    for chan in range(3):
+        states = [msg['brightness'] for (_, msg) in published if msg['chan'] == chan]
+        assert len(states) > 2
+        assert states[-1] == 100
+    assert superseded_by_muxer(published) == 0
+
+def test_steps_cover_every_repeat(monkeypatch):
+    fades = [(light(chan, 100), light(chan, 0)) for chan in range(2)]
+    published = run_fades(monkeypatch, fades, until=10.0)
+    times = sorted({now for (now, _) in published})
+    for (this_step, next_step) in zip(times, times[1:]):
+        sent = [msg for (now, msg) in published if now == this_step]
+        assert next_step - this_step >= sum(REPEAT_COUNT * airtime(msg) for msg in sent) - 1e-9
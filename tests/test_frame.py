@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import (FRAME_DTYPE, bits_to_frame, checksum, frame_error, frame_to_bits, message_to_bits,
+    pack_frame, unpack_frame, unpack_frames)
+
+def random_frames(rng, count):
+    """Well-formed frames, frames with the trailing bit set, frames with bits above the 33rd, and both."""
+    frames = rng.integers(0, 1 << 32, count, dtype=np.uint64) << np.uint64(1)
+    kind = rng.integers(4, size=count)
+    frames[kind & 1 == 1] |= np.uint64(1)
+    frames[kind & 2 == 2] |= rng.integers(1, 1 << 20, int(np.count_nonzero(kind & 2)), dtype=np.uint64) << np.uint64(33)
+    return frames
+
+def test_unpack_frames_matches_unpack_frame():
+    frames = random_frames(np.random.default_rng(6), 5000)
+    (fields, valid) = unpack_frames(frames)
+    assert fields.dtype == FRAME_DTYPE
+    assert valid.tolist() == [frame_error(frame) is None for frame in frames.tolist()]
+    assert valid.any() and not valid.all()
+    for (row, frame) in zip(fields[valid].tolist(), frames[valid].tolist()):
+        assert dict(zip(FRAME_DTYPE.names, row)) == unpack_frame(frame)
+
+def test_unpack_frames_of_nothing():
+    (fields, valid) = unpack_frames([])
+    assert len(fields) == len(valid) == 0
+
+def test_frame_error_classes():
+    msg = {'group': 15, 'chan': 15, 'brightness': 127, 'cmd': 3, 'color': 63, 'cksum': checksum(15, 15, 127)}
+    frame = pack_frame(msg)
+    assert frame_error(frame) is None
+    assert unpack_frame(frame) == msg
+    assert frame_error(frame | 1) == 'last bit high'
+    assert frame_error(frame | (1 << 33)) == 'high bits left after consuming expected content'
+    # the trailing bit is checked first
+    assert frame_error(frame | (1 << 40) | 1) == 'last bit high'
+    assert frame_error(0) is None
+
+def test_bits_to_frame_forms():
+    msg = {'group': 2, 'chan': 9, 'brightness': 64, 'cmd': 0, 'color': 24, 'cksum': checksum(2, 9, 64)}
+    bits = message_to_bits(msg)
+    string = ''.join(str(bit) for bit in bits)
+    assert bits == frame_to_bits(pack_frame(msg))
+    assert bits_to_frame(bits) == bits_to_frame(np.array(bits, dtype=np.uint8)) == pack_frame(msg)
+    assert bits_to_frame(string) == bits_to_frame(string.encode('ascii')) == pack_frame(msg)
+
+@pytest.mark.parametrize('bits', ['', '0b101', ' 101', '101\n', '1_01', '10x1', '12', '１０', b'10\xff1'])
+def test_bits_to_frame_rejects_other_characters(bits):
+    with pytest.raises(ValueError):
+        bits_to_frame(bits)
+
+class TestBlock:
+    @pytest.fixture
+    def block(self):
+        pytest.importorskip('gnuradio')
+        self.pmt = pytest.importorskip('pmt')
+        from godox_rc_emu.bitfield_to_message import bitfield_to_message
+        block = bitfield_to_message(stats_interval=3600.0)
+        self.published = []
+        block.message_port_pub = lambda port, msg_pmt: self.published.append(
+            (self.pmt.symbol_to_string(port), self.pmt.to_python(msg_pmt)))
+        return block
+
+    def test_string_with_other_characters_is_a_decode_failure(self, block):
+        for bits in ['0b' + '1' * 31, ' ' + '0' * 32, '1_' + '0' * 31, '2' * 33]:
+            block.handle_msg(self.pmt.to_pmt(bits))
+        assert [port for (port, _) in self.published] == ['debug'] * 4
+        assert block.metrics.counters == {'messages_in': 4, 'decode_failures_characters': 4}
+
+    def test_frame_errors_are_counted_by_class(self, block):
+        frame = pack_frame({'group': 1, 'chan': 2, 'brightness': 3, 'cmd': 0, 'color': 24, 'cksum': checksum(1, 2, 3)})
+        for msg in [frame, frame | 1, frame | (1 << 33), '0' * 32, ''.join(map(str, frame_to_bits(frame)))]:
+            block.handle_msg(self.pmt.to_pmt(msg))
+        assert [port for (port, _) in self.published] == ['out', 'debug', 'debug', 'debug', 'out']
+        assert block.metrics.counters == {'messages_in': 5, 'messages_out': 2, 'decode_failures_trailing_bit': 1,
+            'decode_failures_length': 2}
+
+    def test_batch_matches_single_frames(self, block):
+        frames = random_frames(np.random.default_rng(60), 200)
+        for frame in frames.tolist():
+            block.handle_msg(self.pmt.to_pmt(frame))
+        single = [msg for (port, msg) in self.published if port == 'out']
+        single_counters = dict(block.metrics.counters)
+        block.metrics.counters.clear()
+        del self.published[:]
+        block.handle_msg(self.pmt.to_pmt(frames))
+        assert [msg for (port, msg) in self.published if port == 'out'] == single
+        assert block.metrics.counters == single_counters
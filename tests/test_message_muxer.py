@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gnuradio')
+pmt = pytest.importorskip('pmt')
+
+from godox_rc_emu.message_muxer import message_muxer
+
+class ReferenceMuxer:
+    """The muxer's scheduling before the heap: sort every pending message by age on each trigger."""
+    def __init__(self, clock, repeat_count, time_between_repeats, active_gain, inactive_gain, cutoff_time):
+        self.clock = clock
+        self.published = []
+        self.messages = {}
+        self.last_send_time = None
+        self.repeat_count = repeat_count
+        self.time_between_repeats_ns = int(time_between_repeats * 1e9)
+        self.active_gain = active_gain
+        self.inactive_gain = inactive_gain
+        self.cutoff_time_ns = int(cutoff_time * 1e9)
+        self.last_set_gain = None
+
+    def handle_msg(self, msg):
+        self.messages[(msg.get('chan'), msg.get('group'))] = (0, self.repeat_count, msg)
+        self.trigger_now()
+
+    def trigger_now(self):
+        current_time = self.clock()
+        if not self.messages:
+            if self.last_set_gain != self.inactive_gain:
+                if current_time > ((self.last_send_time or 0) + self.cutoff_time_ns):
+                    self.published.append(('gain', {'gain': self.inactive_gain}))
+                    self.last_set_gain = self.inactive_gain
+            return
+        if self.last_set_gain != self.active_gain:
+            if current_time > ((self.last_send_time or 0) + self.cutoff_time_ns):
+                self.published.append(('gain', {'gain': self.active_gain}))
+                self.last_set_gain = self.active_gain
+        all_msgs = [i for i in self.messages.items() if i[1][0] <= (current_time - self.time_between_repeats_ns)]
+        if not all_msgs:
+            return
+        all_msgs.sort(key=lambda item: item[1][0])
+        (msg_key, (_, repeat_count, msg)) = all_msgs.pop(0)
+        if repeat_count > 1:
+            self.messages[msg_key] = (current_time, repeat_count-1, msg)
+        else:
+            del self.messages[msg_key]
+        self.last_send_time = current_time
+        self.published.append(('out', msg))
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_reference_muxer(monkeypatch, seed):
+    rng = np.random.default_rng(seed)
+    now = [1_000_000_000_000]
+    clock = lambda: now[0]
+    monkeypatch.setattr(time, 'time_ns', clock)
+    params = dict(repeat_count=int(rng.integers(1, 6)), time_between_repeats=float(rng.uniform(0.05, 0.5)),
+        active_gain=50, inactive_gain=0, cutoff_time=float(rng.uniform(0.5, 4.0)))
+    reference = ReferenceMuxer(clock, **params)
+    # stats off, so only the messages and gain changes are published; triggers are spaced further apart than any
+    # frame takes to send, so the airtime-aware muxer is never held up waiting for the channel
+    muxer = message_muxer(stats_interval=0.0, **params)
+    published = []
+    muxer.message_port_pub = lambda port, msg_pmt: published.append((pmt.symbol_to_string(port), pmt.to_python(msg_pmt)))
+
+    for _ in range(400):
+        now[0] += int(rng.uniform(0.08, 1.0) * 1e9)
+        if rng.random() < 0.3:
+            # a few lights, so updates often replace ones still pending
+            msg = {'group': int(rng.integers(2)), 'chan': int(rng.integers(3)), 'brightness': int(rng.integers(101)),
+                'cmd': 0, 'color': 24}
+            reference.handle_msg(msg)
+            muxer.handle_msg(pmt.to_pmt(msg))
+        else:
+            reference.trigger_now()
+            muxer.trigger_now()
+    sent = [(port, msg) for (port, msg) in published if port in ('out', 'gain')]
+    assert sent == reference.published
+
+def test_idle_muxer_does_not_wake_for_stats(monkeypatch):
+    now = [1_000_000_000_000]
+    monkeypatch.setattr(time, 'time_ns', lambda: now[0])
+    muxer = message_muxer(repeat_count=2, time_between_repeats=0.1, cutoff_time=1.0, stats_interval=1.0)
+    published = []
+    muxer.message_port_pub = lambda port, msg_pmt: published.append(pmt.symbol_to_string(port))
+    def run_until_idle():
+        # as the clock thread does: trigger, then sleep until the next event
+        for _ in range(100):
+            muxer.trigger_now()
+            wakeup_time = muxer.next_event_time()
+            if wakeup_time is None:
+                return
+            now[0] = max(now[0] + 1, wakeup_time)
+        raise AssertionError('muxer never went idle')
+
+    run_until_idle()
+    assert published == ['gain']
+    assert muxer.next_event_time() is None
+    muxer.handle_msg(pmt.to_pmt({'group': 1, 'chan': 2, 'brightness': 30, 'cmd': 0, 'color': 24}))
+    run_until_idle()
+    # the interval's stats are published once, after the last repeat, and then nothing more is due
+    assert published.count('out') == 2
+    assert published.count('stats') == 1
+    assert published.index('stats') > max(index for (index, port) in enumerate(published) if port == 'out')
+    assert published[-1] == 'gain'
+
+def test_stats_are_off_by_default():
+    muxer = message_muxer()
+    assert muxer.stats_interval_ns == 0
+    assert not muxer.metrics.enabled
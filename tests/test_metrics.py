@@ -0,0 +1,48 @@
+import sys
+import threading
+
+import pytest
+
+from godox_rc_emu.metrics import Metrics, make_metrics, null_metrics
+
+@pytest.fixture
+def frequent_switches():
+    # switch threads as often as possible, so an unguarded read-modify-write would lose updates
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+def test_counts_from_several_threads_are_not_lost(frequent_switches):
+    metrics = Metrics('test', interval=3600.0)
+    def work():
+        for _ in range(20000):
+            metrics.count('messages_in')
+            metrics.count('samples_in', 3)
+            metrics.elapsed('handle_msg', metrics.clock())
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # snapshots taken meanwhile, as a poll() from another thread would
+    while any(thread.is_alive() for thread in threads):
+        metrics.snapshot()
+    for thread in threads:
+        thread.join()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'messages_in': 80000, 'samples_in': 240000}
+    assert snapshot['histograms']['handle_msg']['count'] == 80000
+
+def test_poll_publishes_once_per_interval():
+    published = []
+    metrics = Metrics(lambda: 'alias', interval=3600.0, publish=published.append)
+    metrics.next_publish = 0.0
+    metrics.count('messages_in')
+    metrics.poll()
+    metrics.poll()
+    assert [snapshot['block'] for snapshot in published] == ['alias']
+    assert published[0]['counters'] == {'messages_in': 1}
+
+def test_zero_interval_turns_metrics_off():
+    assert make_metrics('test', 0.0) is null_metrics
+    assert not null_metrics.enabled
+    assert make_metrics('test', 1.0).enabled
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pmt = pytest.importorskip('pmt')
+
+from godox_rc_emu.core import bits_to_timing_arrays, checksum, message_to_bits, pack_frame
+from godox_rc_emu.pmt_wire import bits_to_pmt, is_compact_timings, pmt_to_bits, pmt_to_timings, timings_to_pmt
+
+MSG = {'group': 2, 'chan': 11, 'brightness': 77, 'cmd': 1, 'color': 24, 'cksum': checksum(2, 11, 77)}
+BITS = message_to_bits(MSG)
+
+def test_bits_round_trip_in_every_form():
+    compact = bits_to_pmt(BITS, compact=True)
+    legacy = bits_to_pmt(BITS)
+    assert pmt.is_u8vector(compact)
+    assert not pmt.is_u8vector(legacy)
+    string = ''.join(map(str, BITS))
+    for msg_pmt in [compact, legacy, pmt.to_pmt(string), pmt.to_pmt(pack_frame(MSG))]:
+        bits = pmt_to_bits(msg_pmt)
+        assert bits.dtype == np.uint8
+        assert bits.tolist() == BITS
+
+@pytest.mark.parametrize('bits', ['0102', ' 0101', '0b101', '1_01', '01x', '０１'])
+def test_bits_with_other_characters_are_rejected(bits):
+    with pytest.raises(ValueError, match='characters other than 0 and 1'):
+        pmt_to_bits(pmt.to_pmt(bits))
+
+def test_timings_round_trip_in_every_form():
+    (levels, durations) = bits_to_timing_arrays(BITS)
+    compact = timings_to_pmt(levels, durations, compact=True)
+    legacy = timings_to_pmt(levels, durations)
+    as_dict = pmt.dict_add(pmt.dict_add(pmt.make_dict(), pmt.intern('levels'), pmt.to_pmt(levels)),
+        pmt.intern('durations'), pmt.to_pmt(durations))
+    assert is_compact_timings(compact)
+    assert is_compact_timings(as_dict)
+    assert not is_compact_timings(legacy)
+    for msg_pmt in [compact, legacy, as_dict]:
+        (decoded_levels, decoded_durations) = pmt_to_timings(msg_pmt)
+        assert decoded_levels.dtype == bool
+        assert decoded_durations.dtype == np.float64
+        assert decoded_levels.tolist() == levels.astype(bool).tolist()
+        # compact timings carry float32 durations; every form should give the same float32 values back
+        assert decoded_durations.astype(np.float32).tolist() == durations.tolist()
+
+def test_bitfield_to_timings_drops_bad_strings():
+    pytest.importorskip('gnuradio')
+    from godox_rc_emu.bitfield_to_timings import bitfield_to_timings
+    published = []
+    outputs = {}
+    for compact_output in (False, True):
+        block = bitfield_to_timings(compact_output=compact_output, stats_interval=3600.0)
+        block.message_port_pub = lambda port, msg_pmt: published.append((pmt.symbol_to_string(port), msg_pmt))
+        del published[:]
+        block.handle_msg(pmt.to_pmt('01' * 16 + '2'))
+        block.handle_msg(bits_to_pmt(BITS, compact=True))
+        assert [port for (port, _) in published] == ['debug', 'out']
+        assert block.metrics.counters == {'messages_in': 2, 'messages_dropped': 1, 'messages_out': 1}
+        outputs[compact_output] = pmt_to_timings(published[1][1])
+    # either output form decodes to the same timings
+    assert outputs[False][0].tolist() == outputs[True][0].tolist()
+    assert outputs[False][1].astype(np.float32).tolist() == outputs[True][1].astype(np.float32).tolist()
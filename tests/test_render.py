@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import (bits_to_timing_arrays, bits_to_timings, checksum, frame_to_bits, pack_frame,
+    render_frame, render_levels, render_timings, sample_counts)
+
+def test_whole_sample_durations_do_not_lose_a_sample():
+    # as compact timings carry them, these fall just short of a whole number of samples, which int() truncated
+    durations = np.array([7e-4, 9e-4, 14e-4], dtype=np.float32)
+    assert [int(duration * 1e6) for duration in durations.tolist()] == [699, 899, 1399]
+    assert sample_counts(durations, 1e6).tolist() == [700, 900, 1400]
+    # likewise one float64 rounding step short
+    assert int(np.nextafter(8e-4, 0) * 1e6) == 799
+    assert sample_counts([np.nextafter(8e-4, 0)], 1e6).tolist() == [800]
+
+@pytest.mark.parametrize(('duration', 'sample_rate', 'count'), [
+    (2.5, 1.0, 2),
+    (0.9999, 1.0, 0),
+    (1.9, 1.0, 1),
+    (13e-4, 48e3, 62), # 62.4 samples
+    (0.7, 2e6, 1400000),
+    (0.7000004, 2e6, 1400000), # 1400000.8 samples: a fraction, however long the burst
+    (0.0, 1e6, 0),
+])
+def test_other_durations_are_truncated(duration, sample_rate, count):
+    assert int(duration * sample_rate) == count
+    assert sample_counts([duration], sample_rate).tolist() == [count]
+    assert sample_counts(np.float32(duration), sample_rate) == count
+
+@pytest.mark.parametrize('sample_rate', [48e3, 250e3, 1e6, 2e6])
+def test_every_form_renders_the_same_burst(sample_rate):
+    frame = pack_frame({'group': 3, 'chan': 9, 'brightness': 77, 'cmd': 1, 'color': 24, 'cksum': checksum(3, 9, 77)})
+    bits = frame_to_bits(frame)
+    expected = render_frame(frame, sample_rate, 1.0, 0.0, 0.0, 1e-3)
+    timings = bits_to_timings(bits) + [(False, 1e-3)]
+    assert np.array_equal(render_timings(timings, sample_rate), expected)
+    (levels, durations) = bits_to_timing_arrays(bits)
+    levels = np.append(levels, 0)
+    durations = np.append(durations, np.float32(1e-3))
+    assert durations.dtype == np.float32
+    assert np.array_equal(render_levels(levels, durations, sample_rate), expected)
+    assert len(expected) == int(sample_counts([duration for (_, duration) in timings], sample_rate).sum())
+
+def test_render_timings_values():
+    samples = render_timings([(True, 2.0), (False, 1.0), (0.5, 3.0)], 1.0, true_value=0.8, false_value=0.1)
+    assert samples.dtype == np.float32
+    assert samples.tolist() == pytest.approx([0.8, 0.8, 0.1, 0.5, 0.5, 0.5])
@@ -0,0 +1,48 @@
+from godox_rc_emu.core import checksum
+from godox_rc_emu.core.sanitize import sanitize_scene, scene_lights
+
+DEFAULTS = {'group': 1, 'chan': 0, 'brightness': 25, 'color': 24}
+
+def light(chan, brightness):
+    return {'group': 2, 'chan': chan, 'brightness': brightness, 'cmd': 0, 'color': 24,
+        'cksum': checksum(2, chan, brightness)}
+
+def test_malformed_lights_are_dropped_with_a_warning():
+    warnings = []
+    lights = [
+        light(1, 50),
+        {'group': 2, 'chan': 'x', 'brightness': 10},
+        (('group', 2), ('chan', 3, 'extra')),
+        ('not', 'pairs'),
+        {'group': None},
+        {'brightness': 10**30},
+        {'color': float('nan')},
+        {'chan': [4]},
+        'a string',
+        7,
+        light(5, 100),
+    ]
+    assert sanitize_scene(lights, DEFAULTS, warnings.append) == [light(1, 50), light(5, 100)]
+    assert warnings == ['Dropping 9 light(s) in scene that could not be interpreted as messages']
+
+def test_scene_of_only_malformed_lights_is_ignored():
+    warnings = []
+    assert sanitize_scene([{'chan': 'x'}, ('a', 'b')], DEFAULTS, warnings.append) == []
+    assert warnings == ['Dropping 2 light(s) in scene that could not be interpreted as messages',
+        'Ignoring scene with no lights']
+
+def test_lights_in_tuple_form_and_defaults():
+    warnings = []
+    lights = [(('chan', 3), ('brightness', 60)), {'group': 4, 'brightness': 200.0}]
+    assert sanitize_scene(lights, DEFAULTS, warnings.append) == [
+        {'group': 1, 'chan': 3, 'brightness': 60, 'cmd': 0, 'color': 24, 'cksum': checksum(1, 3, 60)},
+        {'group': 4, 'chan': 0, 'brightness': 127, 'cmd': 0, 'color': 24, 'cksum': checksum(4, 0, 127)},
+    ]
+    assert warnings == []
+
+def test_scene_that_is_not_a_collection_has_no_lights():
+    assert scene_lights(5) == []
+    assert scene_lights({'a': light(1, 2)}) == [light(1, 2)]
+    warnings = []
+    assert sanitize_scene(scene_lights(None), DEFAULTS, warnings.append) == []
+    assert warnings == ['Ignoring scene with no lights']
@@ -0,0 +1,71 @@
+from godox_rc_emu.core import StateCache, checksum
+
+def light(chan, brightness, **extra):
+    return dict({'group': 1, 'chan': chan, 'brightness': brightness, 'cmd': 0, 'color': 24,
+        'cksum': checksum(1, chan, brightness)}, **extra)
+
+def test_entries_expire_after_freshness():
+    cache = StateCache(freshness=10.0)
+    assert cache.offer(light(1, 50), 100.0) == 'miss'
+    assert cache.offer(light(1, 50), 105.0) == 'hit'
+    # a suppressed hit does not extend the entry's time
+    assert cache.offer(light(1, 50), 109.9) == 'hit'
+    assert cache.offer(light(1, 50), 110.0) == 'expired'
+    assert cache.offer(light(1, 50), 115.0) == 'hit'
+    assert cache.offer(light(1, 60), 116.0) == 'changed'
+    assert cache.states[(1, 1)] == (light(1, 60), 116.0)
+    # another light is cached apart
+    assert cache.offer(light(2, 60), 116.0) == 'miss'
+
+def test_scene_is_recorded_unless_every_light_is_a_hit():
+    cache = StateCache(freshness=10.0)
+    cache.offer(light(1, 50), 100.0)
+    assert cache.offer_scene([light(1, 50)], 101.0) == ['hit']
+    assert cache.states[(1, 1)][1] == 100.0
+    assert cache.offer_scene([light(1, 50), light(2, 50)], 102.0) == ['hit', 'miss']
+    assert [sent_time for (_, sent_time) in cache.states.values()] == [102.0, 102.0]
+
+def test_refresh_schedule():
+    cache = StateCache(freshness=10.0, refresh_interval=30.0)
+    assert cache.next_refresh_time() is None
+    cache.offer(light(1, 50), 100.0)
+    cache.offer(light(2, 70), 110.0)
+    assert cache.next_refresh_time() == 130.0
+    assert cache.due(129.9) == []
+    assert cache.due(130.0) == [light(1, 50)]
+    # refreshing a light puts it at the back of the schedule
+    assert cache.next_refresh_time() == 140.0
+    assert cache.due(140.0) == [light(2, 70)]
+    assert cache.next_refresh_time() == 160.0
+    # a new state resets its light's schedule
+    cache.offer(light(1, 55), 150.0)
+    assert cache.next_refresh_time() == 170.0
+    assert cache.due(175.0) == [light(2, 70)]
+    assert cache.due(180.0) == [light(1, 55)]
+
+def test_no_refresh_without_interval():
+    cache = StateCache(freshness=10.0)
+    cache.offer(light(1, 50), 100.0)
+    assert cache.next_refresh_time() is None
+    assert cache.due(1e9) == []
+
+def test_refresh_on_request():
+    cache = StateCache(freshness=10.0)
+    cache.offer(light(1, 50), 100.0)
+    cache.offer(light(2, 70), 100.0)
+    cache.offer(dict(light(3, 90), group=2, cksum=checksum(2, 3, 90)), 100.0)
+    assert cache.refresh(101.0, chan=2) == [light(2, 70)]
+    assert cache.refresh(102.0, group=1) == [light(1, 50), light(2, 70)]
+    assert len(cache.refresh(103.0)) == 3
+    assert {sent_time for (_, sent_time) in cache.states.values()} == {103.0}
+
+def test_refreshed_state_does_not_replay_ack_id():
+    cache = StateCache(freshness=10.0, refresh_interval=30.0)
+    msg = light(1, 50, ack_id=17)
+    assert cache.offer(msg, 100.0) == 'miss'
+    # the message passed on keeps its ack_id; the state cached for refreshing does not
+    assert msg['ack_id'] == 17
+    assert cache.due(130.0) == [light(1, 50)]
+    assert cache.refresh(131.0) == [light(1, 50)]
+    # the same state with another command's ack_id is still a hit
+    assert cache.offer(light(1, 50, ack_id=18), 132.0) == 'hit'
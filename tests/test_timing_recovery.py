@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import TimingRecovery, bits_to_timing_arrays, checksum, decode_timings, message_to_bits
+
+LIMITS = dict(hello_min=10e-4, hello_max=12e-4, low_min=5e-4, low_max=7e-4, high_max=14e-4, sep_min=6e-4, sep_max=8e-4)
+# long enough a low to end a frame, as the gap between packets does
+GAP = 5e-3
+
+def message(group, chan, brightness):
+    return {'group': group, 'chan': chan, 'brightness': brightness, 'cmd': 0, 'color': 24,
+        'cksum': checksum(group, chan, brightness)}
+
+def transmit(msgs, scale=1.0, offset=0.0, jitter=0.0, rng=None):
+    """Levels and durations for msgs sent back to back, each pulse stretched by scale, highs lengthened and lows
+    shortened by offset, and every pulse moved by up to jitter at random."""
+    all_levels = []
+    all_durations = []
+    for msg in msgs:
+        (levels, durations) = bits_to_timing_arrays(message_to_bits(msg), hello_time=11e-4)
+        levels = np.append(levels, 0).astype(bool)
+        durations = np.append(durations.astype(np.float64), GAP / scale)
+        durations = durations * scale + np.where(levels, offset, -offset)
+        if jitter:
+            durations += rng.uniform(-jitter, jitter, len(durations))
+        all_levels.append(levels)
+        all_durations.append(durations)
+    return (np.concatenate(all_levels), np.concatenate(all_durations))
+
+def fixed_decode(levels, durations):
+    (frames, _) = decode_timings(levels, durations, **LIMITS)
+    return [bits.tolist() for (bits, partial) in frames if not partial]
+
+def adaptive_decode(recovery, levels, durations):
+    (frames, _) = recovery.decode(levels, durations)
+    return [bits.tolist() for (bits, partial, _) in frames if not partial]
+
+MSGS = [message(2, 3, brightness) for brightness in (0, 1, 50, 99, 127)] + [message(5, 11, 64), message(15, 15, 85)]
+EXPECTED = [message_to_bits(msg) for msg in MSGS]
+
+def test_nominal_timings_decode_either_way():
+    (levels, durations) = transmit(MSGS)
+    assert fixed_decode(levels, durations) == EXPECTED
+    assert adaptive_decode(TimingRecovery(**LIMITS), levels, durations) == EXPECTED
+
+@pytest.mark.parametrize('distortion', [
+    dict(scale=1.12), # a slow transmitter clock: 1s and the hello fall outside their windows
+    dict(scale=0.86), # a fast one: 0s fall below theirs
+    dict(offset=1.5e-4), # smoothing in the receiver: separators too long, 0s too short
+    dict(scale=1.08, offset=-1e-4, jitter=2e-5), # all at once, with every pulse jittered
+])
+def test_distorted_timings_need_recovery(distortion):
+    rng = np.random.default_rng(24)
+    (levels, durations) = transmit(MSGS, rng=rng, **distortion)
+    assert fixed_decode(levels, durations) != EXPECTED
+    assert adaptive_decode(TimingRecovery(**LIMITS), levels, durations) == EXPECTED
+
+def test_reports_fitted_timing():
+    (levels, durations) = transmit(MSGS[:1], scale=1.1, offset=0.5e-4)
+    (frames, warnings) = TimingRecovery(**LIMITS).decode(levels, durations)
+    assert not warnings
+    [(_, partial, report)] = frames
+    assert not partial
+    assert report['source'] == 'frame'
+    assert report['scale'] == pytest.approx(1.1, abs=0.01)
+    assert report['offset'] == pytest.approx(0.5e-4, abs=0.1e-4)
+    assert 0 < report['confidence'] <= 1
+
+def test_estimates_converge_per_transmitter():
+    rng = np.random.default_rng(7)
+    recovery = TimingRecovery(**LIMITS, adaptation_rate=0.2)
+    slow = [message(2, 3, int(brightness)) for brightness in rng.integers(128, size=40)]
+    fast = [message(5, 11, int(brightness)) for brightness in rng.integers(128, size=40)]
+
+    (levels, durations) = transmit(slow, scale=1.1, offset=0.4e-4, jitter=1e-5, rng=rng)
+    assert adaptive_decode(recovery, levels, durations) == [message_to_bits(msg) for msg in slow]
+    # only the transmitter heard has an estimate
+    assert set(recovery.estimates) == {(2, 3)}
+    (scale, offset) = recovery.estimates[(2, 3)]
+    assert scale == pytest.approx(1.1, abs=0.01)
+    assert offset == pytest.approx(0.4e-4, abs=0.1e-4)
+
+    (levels, durations) = transmit(fast, scale=0.9, offset=-0.3e-4, jitter=1e-5, rng=rng)
+    assert adaptive_decode(recovery, levels, durations) == [message_to_bits(msg) for msg in fast]
+    assert set(recovery.estimates) == {(2, 3), (5, 11)}
+    (scale, offset) = recovery.estimates[(5, 11)]
+    assert scale == pytest.approx(0.9, abs=0.01)
+    assert offset == pytest.approx(-0.3e-4, abs=0.1e-4)
+    # the other transmitter's frames left the first one's estimate alone
+    assert recovery.estimates[(2, 3)] == (pytest.approx(1.1, abs=0.01), pytest.approx(0.4e-4, abs=0.1e-4))
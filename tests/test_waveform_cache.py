@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from godox_rc_emu.core import WaveformCache, checksum, message_key, pack_frame, render_frame
+
+def message(chan, brightness):
+    return {'group': 1, 'chan': chan, 'brightness': brightness, 'cmd': 0, 'color': 24,
+        'cksum': checksum(1, chan, brightness)}
+
+def samples(value, count):
+    return np.full(count, value, dtype=np.float32)
+
+def test_hits_and_misses():
+    cache = WaveformCache()
+    renders = []
+    def render():
+        renders.append(1)
+        return samples(1.0, 10)
+    first = cache.get_or_render('a', render)
+    second = cache.get_or_render('a', render)
+    assert second is first
+    assert len(renders) == 1
+    assert cache.get('b') is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'entries': 1, 'bytes': 40}
+    # shared arrays can't be changed by any one user
+    with pytest.raises(ValueError):
+        first[0] = 2.0
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = WaveformCache(max_bytes=100)
+    for key in 'abc':
+        cache.put(key, samples(1.0, 8)) # 32 bytes each
+    cache.get('a')
+    cache.put('d', samples(1.0, 8))
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.current_bytes == 96
+    # replacing an entry accounts for the size of the one it replaces
+    cache.put('c', samples(2.0, 4))
+    assert cache.current_bytes == 80
+    cache.put('e', samples(1.0, 10))
+    assert list(cache.entries) == ['d', 'c', 'e']
+    assert cache.current_bytes == 88
+
+def test_oversized_samples_are_not_cached():
+    cache = WaveformCache(max_bytes=100)
+    cache.put('a', samples(1.0, 8))
+    big = cache.put('big', samples(1.0, 26))
+    assert len(big) == 26
+    assert list(cache.entries) == ['a']
+    cache.clear()
+    assert cache.stats()['entries'] == cache.stats()['bytes'] == 0
+
+def test_cached_waveform_matches_fresh_render():
+    cache = WaveformCache()
+    rng = np.random.default_rng(2)
+    for _ in range(300):
+        msg = message(int(rng.integers(2)), int(rng.integers(3)))
+        sample_rate = float(rng.choice([48e3, 250e3, 1e6]))
+        key = message_key(msg, sample_rate)
+        cached = cache.get_or_render(key, lambda: render_frame(pack_frame(msg), sample_rate))
+        assert np.array_equal(cached, render_frame(pack_frame(msg), sample_rate))
+    # 6 messages at 3 sample rates
+    assert cache.stats()['entries'] == 18
+    assert cache.hits == 300 - 18
+
+def test_message_key():
+    msg = message(3, 40)
+    assert message_key(msg, 1e6) == message_key(dict(msg, ack_id=5), 1e6)
+    assert message_key(msg, 1e6) != message_key(msg, 2e6)
+    assert message_key(msg, 1e6) != message_key(message(3, 41), 1e6)
+
+@pytest.mark.parametrize('output_type', ['float', 'complex'])
+def test_block_renders_the_same_with_and_without_cache(output_type):
+    pytest.importorskip('gnuradio')
+    pytest.importorskip('pmt')
+    from godox_rc_emu.timings_to_ookfloat import timings_to_ookfloat
+    params = dict(sample_rate=250e3, output_type=output_type, freq_offset=10e3, amplitude=0.5)
+    cached = timings_to_ookfloat(use_cache=True, **params)
+    cached.cache = WaveformCache()
+    uncached = timings_to_ookfloat(use_cache=False, **params)
+    for (chan, brightness) in [(1, 20), (2, 20), (1, 20), (1, 21), (2, 20)]:
+        msg = message(chan, brightness)
+        assert np.array_equal(cached.cached_render_message(msg), uncached.cached_render_message(msg))
+    assert cached.cache.stats()['hits'] == 2